@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checksums of local files, computed by a pool of processes so that audits and baselines with "use_checksum" are not
+bound to one core. Files are handed to the workers in batches, to keep the cost of passing them around low for
+small files. A worker reads large files memory-mapped and small files with a big buffer, and computes all digests
+asked for in one pass over the file.
+
+Digests are base64 encoded, as resync.utils.compute_md5_for_file does and as they appear in resource lists.
+"""
+
+import base64, concurrent.futures, hashlib, logging, mmap, multiprocessing, os, threading
+
+from des.config import Config
+
+MD5 = "md5"
+SHA256 = "sha-256"
+# hashlib names of the hash types in resource lists.
+ALGORITHMS = {MD5: "md5", SHA256: "sha256"}
+
+# Files of this many bytes or more are read memory-mapped.
+MMAP_THRESHOLD = 4 * 1024 * 1024
+# Bytes read at a time from smaller files.
+BUFFER_SIZE = 1024 * 1024
+# A batch handed to a worker has at most this many files or, unless it holds one file, this many bytes.
+BATCH_FILES = 256
+BATCH_BYTES = 64 * 1024 * 1024
+
+_instance = None
+_lock = threading.Lock()
+
+
+def instance():
+    """
+    Get the Checksummer of this process. Its number of worker processes is given by the configuration parameter
+    "checksum_workers": 0 (default) for one per core, 1 for computing checksums in the calling thread.
+    :return: an instance of Checksummer
+    """
+    global _instance
+    with _lock:
+        if _instance is None:
+            _instance = Checksummer(Config().int_prop(Config.key_checksum_workers, 0))
+
+    return _instance
+
+
+def reset_instance():
+    """
+    Shut down the worker processes of the current instance: next time an instance is requested it will be
+    constructed anew.
+    :return: None
+    """
+    global _instance
+    with _lock:
+        if _instance is not None:
+            _instance.close()
+        _instance = None
+
+
+def file_digests(filename, algorithms):
+    """
+    Compute the digests of a file.
+    :param filename: the file
+    :param algorithms: sequence of hash types, MD5 and/or SHA256
+    :return: tuple of the base64 digests, in the order of algorithms
+    :raises OSError: if the file cannot be read
+    """
+    hashes = [hashlib.new(ALGORITHMS[algorithm]) for algorithm in algorithms]
+    with open(filename, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for h in hashes:
+                    h.update(data)
+        else:
+            buffer = bytearray(min(size, BUFFER_SIZE) or 1)
+            view = memoryview(buffer)
+            while True:
+                count = file.readinto(buffer)
+                if not count:
+                    break
+                for h in hashes:
+                    h.update(view[:count])
+    return tuple(base64.b64encode(h.digest()).decode("ascii") for h in hashes)
+
+
+def digest_batch(files):
+    """
+    Compute the digests of a batch of files; run by the worker processes.
+    :param files: list of tuples (filename, sequence of hash types)
+    :return: list with for each file the tuple of digests, or the OSError that prevented reading it
+    """
+    results = []
+    for filename, algorithms in files:
+        if len(algorithms) == 0:
+            results.append(())
+            continue
+        try:
+            results.append(file_digests(filename, algorithms))
+        except OSError as err:
+            results.append(err)
+    return results
+
+
+class Digester(object):
+    """
+    Computes digests of content while it is written, so that downloaded content can be verified without reading it
+    again or holding it in memory.
+    """
+
+    def __init__(self, file=None, algorithms=()):
+        """
+        Initialize a Digester.
+        :param file: the binary file object written to or None to only compute digests
+        :param algorithms: sequence of hash types, MD5 and/or SHA256
+        :return: None
+        """
+        self.file = file
+        self.hashes = {algorithm: hashlib.new(ALGORITHMS[algorithm]) for algorithm in algorithms}
+        self.length = 0
+
+    def write(self, data):
+        if self.file is not None:
+            self.file.write(data)
+        for h in self.hashes.values():
+            h.update(data)
+        self.length += len(data)
+
+    def digest(self, algorithm):
+        """
+        :param algorithm: hash type, MD5 or SHA256
+        :return: the base64 digest of what was written or None if algorithm was not asked for
+        """
+        h = self.hashes.get(algorithm)
+        return None if h is None else base64.b64encode(h.digest()).decode("ascii")
+
+
+class Checksummer(object):
+    """
+    Computes digests of files in a pool of worker processes. Workers are started with the spawn method, which is
+    safe in a process with threads, when digests are first asked for.
+    """
+
+    def __init__(self, workers=0):
+        """
+        Initialize a Checksummer.
+        :param workers: number of worker processes, 0 or less for one per core, 1 for no worker processes
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+    def __executor__(self):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                self.logger.debug("Started %d checksum workers" % self.workers)
+        return self.executor
+
+    def digests(self, items, algorithms):
+        """
+        Compute the digests of files.
+        :param items: iterable of tuples (filename, size in bytes, anything), the size is used to make batches
+        :param algorithms: sequence of hash types, MD5 and/or SHA256, or a function of an item that gives the
+                sequence of hash types for that item; files of items without hash types are not read
+        :return: generator of tuples (item, tuple of digests or the OSError that prevented reading the file), in
+                the order of items
+        """
+        if callable(algorithms):
+            algorithms_of = lambda item: tuple(algorithms(item))
+        else:
+            algorithms = tuple(algorithms)
+            algorithms_of = lambda item: algorithms
+        if self.workers == 1:
+            for item in items:
+                yield item, digest_batch([(item[0], algorithms_of(item))])[0]
+            return
+
+        executor = self.__executor__()
+        pending = []
+        for batch in self.__batches__(items):
+            files = [(item[0], algorithms_of(item)) for item in batch]
+            pending.append((batch, executor.submit(digest_batch, files)))
+            # keep all workers busy, but do not run ahead of the consumer too far
+            if len(pending) >= 2 * self.workers:
+                yield from self.__collect__(pending.pop(0))
+        for batch_and_future in pending:
+            yield from self.__collect__(batch_and_future)
+
+    def __batches__(self, items):
+        batch = []
+        size = 0
+        for item in items:
+            if len(batch) > 0 and (len(batch) >= BATCH_FILES or size + item[1] > BATCH_BYTES):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(item)
+            size += item[1]
+        if len(batch) > 0:
+            yield batch
+
+    def __collect__(self, batch_and_future):
+        batch, future = batch_and_future
+        yield from zip(batch, future.result())
+
+    def close(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
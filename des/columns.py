@@ -0,0 +1,378 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A compact, columnar container of resources. Instead of one resync.resource.Resource object per resource, with a dict
+or slots of its own, each attribute is kept in a column:
+
+- uris are split in a prefix, up to and including the last '/', and a suffix. Prefixes are interned; suffixes are
+  stored utf-8 encoded, back to back, with an array of offsets;
+- timestamps and lengths are arrays of doubles and long integers;
+- md5 and sha-256 digests are stored as 16 and 32 raw bytes, the sha-256 column only once a sha-256 is added;
+- the change of a resource (in a change list) and which digests it has are flags in one byte.
+
+Resources with attributes beyond these, such as the capability and md:at of the documents in a capability list or
+sitemapindex, a sha-1 or an unknown change, are kept whole on the side; so are digests that are not base64 of the
+number of bytes of their hash type. Resource objects are made on the fly when iterating.
+"""
+
+import array, base64, binascii, collections, math
+
+from resync.resource import Resource
+from resync.resource_container import ResourceContainer
+
+import des.compare
+
+# Changes as stored in the flags column: index in CHANGES << 1.
+CHANGES = (None, "created", "updated", "deleted")
+CHANGE_CODES = dict((change, code) for code, change in enumerate(CHANGES))
+FLAG_MD5 = 0x01
+CHANGE_SHIFT = 1
+CHANGE_MASK = 0x06
+FLAG_SHA256 = 0x08
+
+MD5_SIZE = 16
+SHA256_SIZE = 32
+# Resource attributes that do not fit in the columns.
+EXTRA_ATTRIBUTES = ("sha1", "mime_type", "path", "_extra", "ln")
+
+
+def encode_digest(digest, size=MD5_SIZE):
+    """
+    :param digest: a digest of a resource as base64 string
+    :param size: the number of bytes of the digest
+    :return: the bytes of the digest or None if digest does not round trip as base64 of size bytes
+    """
+    try:
+        raw = base64.b64decode(digest, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if len(raw) != size or base64.b64encode(raw).decode("ascii") != digest:
+        return None
+    return raw
+
+
+class ResourceColumns(ResourceContainer):
+    """
+    A resync.resource_container.ResourceContainer that keeps its resources in columns. It can be handed to
+    resync.sitemap.Sitemap.parse_xml as the resources to add to, and supports iteration, indexing, lookup by uri and
+    prune_dupes as resync.change_list.ChangeList does.
+    """
+
+    def __init__(self, md=None, ln=None, uri=None, capability_name=None):
+        """
+        Initialize ResourceColumns.
+        :return: None
+        """
+        self.md = md if md is not None else {}
+        self.ln = ln if ln is not None else []
+        self.uri = uri
+        self.capability_name = capability_name
+        self.__clear__()
+
+    def __clear__(self):
+        # prefix -> index in self.prefixes
+        self.prefix_ids = dict()
+        self.prefixes = []
+        self.prefix_bytes = 0
+        self.prefix_column = array.array("I")
+        self.suffixes = bytearray()
+        self.offsets = array.array("Q", [0])
+        # NaN for no timestamp
+        self.timestamps = array.array("d")
+        # -1 for no length
+        self.lengths = array.array("q")
+        self.md5s = bytearray()
+        # None until a sha-256 is added
+        self.sha256s = None
+        self.flags = bytearray()
+        # index -> Resource with attributes that do not fit in the columns
+        self.extras = dict()
+        # index -> md5 or sha-256 that does not fit in its column
+        self.odd_md5s = dict()
+        self.odd_sha256s = dict()
+        # indexes in uri order, made on demand for lookups
+        self.order = None
+
+    @property
+    def resources(self):
+        return self
+
+    def __len__(self):
+        return len(self.flags)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.resource(index)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ResourceColumns index out of range")
+        return self.resource(index)
+
+    def add(self, resource):
+        """
+        Add a resource or an iterable of resources.
+        :param resource: resync.resource.Resource or iterable of them
+        :return: None
+        """
+        if isinstance(resource, collections.abc.Iterable):
+            for r in resource:
+                self.add(r)
+            return
+        change = resource.change
+        if change not in CHANGE_CODES or \
+                any(getattr(resource, attribute, None) is not None for attribute in EXTRA_ATTRIBUTES):
+            self.extras[len(self)] = resource
+            change = None
+        self.append(resource.uri, resource.timestamp, resource.length, resource.md5, change, resource.sha256)
+
+    def append(self, uri, timestamp=None, length=None, md5=None, change=None, sha256=None):
+        """
+        Add a resource by its attributes.
+        :param uri: the uri
+        :param timestamp: the timestamp or None
+        :param length: the length or None
+        :param md5: the md5 as base64 string or None
+        :param change: None, 'created', 'updated' or 'deleted'
+        :param sha256: the sha-256 as base64 string or None
+        :return: None
+        """
+        cut = uri.rfind("/") + 1
+        prefix = uri[:cut]
+        prefix_id = self.prefix_ids.get(prefix)
+        if prefix_id is None:
+            prefix_id = len(self.prefixes)
+            self.prefix_ids[prefix] = prefix_id
+            self.prefixes.append(prefix)
+            self.prefix_bytes += len(prefix)
+        self.prefix_column.append(prefix_id)
+        self.suffixes += uri[cut:].encode("utf-8")
+        self.offsets.append(len(self.suffixes))
+        self.timestamps.append(math.nan if timestamp is None else timestamp)
+        self.lengths.append(-1 if length is None else length)
+        flags = CHANGE_CODES[change] << CHANGE_SHIFT
+        raw = None if md5 is None else encode_digest(md5, MD5_SIZE)
+        if raw is None:
+            if md5 is not None:
+                self.odd_md5s[len(self)] = md5
+            self.md5s += bytes(MD5_SIZE)
+        else:
+            self.md5s += raw
+            flags |= FLAG_MD5
+        if sha256 is not None and self.sha256s is None:
+            self.sha256s = bytearray(SHA256_SIZE * len(self))
+        if self.sha256s is not None:
+            raw = None if sha256 is None else encode_digest(sha256, SHA256_SIZE)
+            if raw is None:
+                if sha256 is not None:
+                    self.odd_sha256s[len(self)] = sha256
+                self.sha256s += bytes(SHA256_SIZE)
+            else:
+                self.sha256s += raw
+                flags |= FLAG_SHA256
+        self.flags.append(flags)
+        self.order = None
+
+    def uri_of(self, index):
+        suffix = self.suffixes[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+        return self.prefixes[self.prefix_column[index]] + suffix
+
+    def entry(self, index):
+        """
+        :param index: index of the resource
+        :return: the resource as des.compare.Entry
+        """
+        extra = self.extras.get(index)
+        if extra is not None:
+            return des.compare.Entry(extra.uri, extra.timestamp, extra.length, extra.md5, extra.sha256)
+        timestamp = self.timestamps[index]
+        length = self.lengths[index]
+        md5 = self.odd_md5s.get(index)
+        if self.flags[index] & FLAG_MD5:
+            start = index * MD5_SIZE
+            md5 = base64.b64encode(self.md5s[start:start + MD5_SIZE]).decode("ascii")
+        sha256 = self.odd_sha256s.get(index)
+        if self.flags[index] & FLAG_SHA256:
+            start = index * SHA256_SIZE
+            sha256 = base64.b64encode(self.sha256s[start:start + SHA256_SIZE]).decode("ascii")
+        return des.compare.Entry(self.uri_of(index), None if math.isnan(timestamp) else timestamp,
+                                 None if length < 0 else length, md5, sha256)
+
+    def change_of(self, index):
+        extra = self.extras.get(index)
+        if extra is not None:
+            return extra.change
+        return CHANGES[(self.flags[index] & CHANGE_MASK) >> CHANGE_SHIFT]
+
+    def resource(self, index):
+        """
+        :param index: index of the resource
+        :return: the resource as resync.resource.Resource, made anew on each call
+        """
+        extra = self.extras.get(index)
+        if extra is not None:
+            return extra
+        entry = self.entry(index)
+        return Resource(uri=entry.uri, timestamp=entry.timestamp, length=entry.length, md5=entry.md5,
+                        sha256=entry.sha256, change=self.change_of(index))
+
+    def entries(self):
+        """
+        :return: generator of des.compare.Entry in order of addition
+        """
+        for index in range(len(self)):
+            yield self.entry(index)
+
+    def uris(self):
+        return [self.uri_of(index) for index in range(len(self))]
+
+    def sorted_indexes(self):
+        """
+        :return: array of the indexes of the resources in uri order; of equal uris in order of addition
+        """
+        if self.order is None:
+            self.order = array.array("Q", sorted(range(len(self)), key=self.uri_of))
+        return self.order
+
+    def find(self, uri):
+        """
+        Look up a resource by uri with a binary search over the uri order.
+        :param uri: the uri
+        :return: index of the first resource added with uri or None
+        """
+        order = self.sorted_indexes()
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.uri_of(order[middle]) < uri:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and self.uri_of(order[low]) == uri:
+            return order[low]
+        return None
+
+    def __contains__(self, uri):
+        return self.find(uri) is not None
+
+    def get(self, uri):
+        """
+        :param uri: the uri
+        :return: the resync.resource.Resource with uri or None
+        """
+        index = self.find(uri)
+        return None if index is None else self.resource(index)
+
+    def keep(self, indexes):
+        """
+        Keep only the resources at indexes, in the order given.
+        :param indexes: iterable of indexes
+        :return: None
+        """
+        resources = [(self.entry(index), self.change_of(index), self.extras.get(index)) for index in indexes]
+        self.__clear__()
+        for entry, change, extra in resources:
+            if extra is not None:
+                self.extras[len(self)] = extra
+            self.append(entry.uri, entry.timestamp, entry.length, entry.md5, None if extra is not None else change,
+                        entry.sha256)
+
+    def prune_before(self, timestamp):
+        """
+        Remove all resources with timestamp earlier than timestamp, as resync.resource_container.ResourceContainer.
+        :return: the number of resources removed
+        """
+        kept = []
+        for index in range(len(self)):
+            entry = self.entry(index)
+            if entry.timestamp is None:
+                raise Exception("Entry %s has no timestamp" % entry.uri)
+            elif entry.timestamp >= timestamp:
+                kept.append(index)
+        removed = len(self) - len(kept)
+        self.keep(kept)
+        return removed
+
+    def prune_dupes(self):
+        """
+        Remove all but the last entry for a given resource uri and all entries for a uri where the first entry is a
+        create and the last entry is a delete, as resync.change_list.ChangeList does.
+        :return: the number of resources removed
+        """
+        kept = []
+        order = self.sorted_indexes()
+        start = 0
+        while start < len(order):
+            uri = self.uri_of(order[start])
+            end = start + 1
+            while end < len(order) and self.uri_of(order[end]) == uri:
+                end += 1
+            first, last = order[start], order[end - 1]
+            if not (end - start > 1 and self.change_of(last) == "deleted" and self.change_of(first) == "created"):
+                kept.append(last)
+            start = end
+        kept.sort()
+        removed = len(self) - len(kept)
+        self.keep(kept)
+        return removed
+
+    def coalesce(self):
+        """
+        Collapse all changes to a uri into the final one: the latest change by timestamp, of equal timestamps the last
+        one added. A uri that was created and in the end deleted is removed altogether; a uri that was created and
+        then updated stays created.
+        :return: tuple (number of resources removed, number of created or updated resources removed, i.e. fetches
+                saved)
+        """
+        kept = []
+        created = set()
+        order = self.sorted_indexes()
+        start = 0
+        while start < len(order):
+            uri = self.uri_of(order[start])
+            end = start + 1
+            while end < len(order) and self.uri_of(order[end]) == uri:
+                end += 1
+            group = sorted(order[start:end], key=lambda index: (
+                -math.inf if math.isnan(self.timestamps[index]) else self.timestamps[index], index))
+            first, last = self.change_of(group[0]), self.change_of(group[-1])
+            if len(group) == 1 or not (first == "created" and last == "deleted"):
+                kept.append(group[-1])
+                if len(group) > 1 and first == "created" and last == "updated":
+                    created.add(group[-1])
+            start = end
+        kept.sort()
+        fetches = self.__fetches__()
+        removed = len(self) - len(kept)
+        self.keep(kept)
+        for position, index in enumerate(kept):
+            if index in created:
+                self.set_change(position, "created")
+        return removed, fetches - self.__fetches__()
+
+    def __fetches__(self):
+        return sum(1 for index in range(len(self)) if self.change_of(index) in ("created", "updated"))
+
+    def set_change(self, index, change):
+        """
+        :param index: index of the resource
+        :param change: None, 'created', 'updated' or 'deleted'
+        :return: None
+        """
+        extra = self.extras.get(index)
+        if extra is not None:
+            self.extras[index] = Resource(resource=extra, change=change)
+        else:
+            self.flags[index] = (self.flags[index] & ~CHANGE_MASK) | CHANGE_CODES[change] << CHANGE_SHIFT
+
+    def nbytes(self):
+        """
+        :return: the bytes taken by the columns, not counting the resources and md5 values kept on the side
+        """
+        return self.prefix_bytes + self.prefix_column.itemsize * len(self.prefix_column) + len(self.suffixes) + \
+            self.offsets.itemsize * len(self.offsets) + self.timestamps.itemsize * len(self.timestamps) + \
+            self.lengths.itemsize * len(self.lengths) + len(self.md5s) + len(self.flags) + \
+            (0 if self.sha256s is None else len(self.sha256s))
@@ -0,0 +1,352 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Comparison of a source resource list with the resources at the destination, for inventories that do not fit in memory.
+Both sides are read as streams of light-weight entries, sorted on uri by an external merge sort that spills to disk
+when its memory budget is exceeded, and merged in one pass. The comparison yields its results as it goes, so fetching
+can start before the comparison has finished.
+"""
+
+import collections, heapq, itertools, logging, operator, os, pickle, re, tempfile
+import xml.etree.ElementTree as ET
+
+import resync.w3c_datetime as w3c
+from resync.resource import Resource
+from resync.sitemap import SitemapParseError, SITEMAP_NS, RS_NS
+
+import des.checksum
+import des.columns
+
+# Kinds of comparison results, as in resync.resource_list.ResourceList.compare.
+SAME = "same"
+UPDATED = "updated"
+DELETED = "deleted"
+CREATED = "created"
+
+# Default memory budget of an ExternalSort in bytes.
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# Entries written to or read from a run on disk at a time.
+BATCH_SIZE = 10000
+# Bytes sorting takes per entry in memory, besides its uri: the index in the list sorted and in the array of the
+# order, the int object of the index, the key in the list of keys and the header of the key string.
+SORT_OVERHEAD = 8 + 8 + 32 + 8 + 56
+
+URLSET_TAG = "{%s}urlset" % SITEMAP_NS
+SITEMAPINDEX_TAG = "{%s}sitemapindex" % SITEMAP_NS
+URL_TAG = "{%s}url" % SITEMAP_NS
+LOC_TAG = "{%s}loc" % SITEMAP_NS
+LASTMOD_TAG = "{%s}lastmod" % SITEMAP_NS
+MD_TAG = "{%s}md" % RS_NS
+
+# Files and directories resync.resource_list_builder.ResourceListBuilder leaves out of a disk inventory.
+EXCLUDE_FILES = re.compile(r"sitemap\d{0,5}.xml")
+EXCLUDE_DIRS = ["CVS", ".git"]
+
+
+class Entry(collections.namedtuple("Entry", "uri timestamp length md5 sha256", defaults=(None,))):
+    """
+    A resource in an inventory: its uri, timestamp, length, md5 and sha-256, any but the uri may be None. Takes a
+    fraction of the memory of a resync.resource.Resource.
+    """
+    __slots__ = ()
+
+    def to_resource(self):
+        """
+        :return: the entry as resync.resource.Resource
+        """
+        return Resource(uri=self.uri, timestamp=self.timestamp, length=self.length, md5=self.md5, sha256=self.sha256)
+
+
+def equal(dst, src, delta=1.0):
+    """
+    Are dst and src the same resource? As resync.resource.Resource.equal: same uri, timestamps within delta if either
+    is given, same md5 if both are given, same length if both are given; and same sha-256 if both are given.
+    :param dst: Entry at the destination
+    :param src: Entry at the source
+    :param delta: seconds the timestamps may differ (default = 1.0, as resync.resource.Resource ==)
+    :return: True if equal, False otherwise
+    """
+    if dst.uri != src.uri:
+        return False
+    if dst.timestamp is not None or src.timestamp is not None:
+        if dst.timestamp is None or src.timestamp is None or abs(dst.timestamp - src.timestamp) >= delta:
+            return False
+    if dst.md5 is not None and src.md5 is not None and dst.md5 != src.md5:
+        return False
+    if dst.sha256 is not None and src.sha256 is not None and dst.sha256 != src.sha256:
+        return False
+    if dst.length is not None and src.length is not None and dst.length != src.length:
+        return False
+    return True
+
+
+def compare(dst_entries, src_entries, delta=1.0):
+    """
+    Compare the destination with the source, both as streams of entries in uri order.
+    :param dst_entries: iterable of Entry at the destination, sorted on uri
+    :param src_entries: iterable of Entry at the source, sorted on uri
+    :param delta: seconds the timestamps of the same resource may differ
+    :return: generator of tuples (kind, entry): (SAME, dst entry), (UPDATED, src entry), (DELETED, dst entry) or
+            (CREATED, src entry), in uri order
+    """
+    dst_iter = iter(dst_entries)
+    src_iter = iter(src_entries)
+    dst = next(dst_iter, None)
+    src = next(src_iter, None)
+    while dst is not None and src is not None:
+        if dst.uri == src.uri:
+            yield (SAME, dst) if equal(dst, src, delta) else (UPDATED, src)
+            dst = next(dst_iter, None)
+            src = next(src_iter, None)
+        elif dst.uri < src.uri:
+            yield DELETED, dst
+            dst = next(dst_iter, None)
+        else:
+            yield CREATED, src
+            src = next(src_iter, None)
+    while dst is not None:
+        yield DELETED, dst
+        dst = next(dst_iter, None)
+    while src is not None:
+        yield CREATED, src
+        src = next(src_iter, None)
+
+
+class ExternalSort(object):
+    """
+    Sorts entries on uri. Entries are kept in memory, in a des.columns.ResourceColumns, until the memory budget is
+    exceeded; then they are sorted and written to a run on disk. Iterating merges the runs and the entries in memory.
+    Of entries with the same uri only the first one added is kept.
+
+    The memory budget counts the columns as well as the Python objects sorting them takes: a list of indexes and a
+    key string for each entry (SORT_OVERHEAD bytes plus the length of its uri).
+
+    Use as context manager, or call close(), to remove the runs.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, tmpdir=None):
+        """
+        Initialize an ExternalSort.
+        :param memory_budget: bytes the entries in memory, and sorting them, may take
+        :param tmpdir: the directory for runs (default = the directory of tempfile)
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.memory_budget = memory_budget
+        self.tmpdir = tmpdir
+        self.buffer = des.columns.ResourceColumns()
+        self.runs = []
+        self.count = 0
+        self.uri_bytes = 0
+
+    def __len__(self):
+        """
+        :return: the number of entries added, duplicates included
+        """
+        return self.count
+
+    def add(self, entry):
+        self.buffer.append(entry.uri, entry.timestamp, entry.length, entry.md5, sha256=entry.sha256)
+        self.count += 1
+        self.uri_bytes += len(entry.uri)
+        if self.nbytes() > self.memory_budget:
+            self.__spill__()
+
+    def nbytes(self):
+        """
+        :return: the bytes taken by the entries in memory and by sorting them
+        """
+        return self.buffer.nbytes() + len(self.buffer) * SORT_OVERHEAD + self.uri_bytes
+
+    def extend(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def __sorted_buffer__(self):
+        # the sort is stable: of entries with the same uri the first one added comes first
+        for index in self.buffer.sorted_indexes():
+            yield self.buffer.entry(index)
+
+    def __spill__(self):
+        entries = self.__sorted_buffer__()
+        with tempfile.NamedTemporaryFile(dir=self.tmpdir, prefix="resydes-sort-", suffix=".run", delete=False) as file:
+            self.runs.append(file.name)
+            while True:
+                batch = [tuple(entry) for entry in itertools.islice(entries, BATCH_SIZE)]
+                if len(batch) == 0:
+                    break
+                pickle.dump(batch, file, pickle.HIGHEST_PROTOCOL)
+        self.logger.debug("Spilled %d entries to %s" % (len(self.buffer), file.name))
+        self.buffer = des.columns.ResourceColumns()
+        self.uri_bytes = 0
+
+    def __read_run__(self, filename):
+        with open(filename, "rb") as file:
+            while True:
+                try:
+                    batch = pickle.load(file)
+                except EOFError:
+                    return
+                yield from batch
+
+    def __iter__(self):
+        # runs are in order of addition, the entries in memory came last; heapq.merge keeps that order for equal uris
+        streams = [self.__read_run__(filename) for filename in self.runs] + [self.__sorted_buffer__()]
+        previous = None
+        for fields in heapq.merge(*streams, key=operator.itemgetter(0)):
+            if fields[0] != previous:
+                previous = fields[0]
+                yield Entry(*fields)
+
+    def close(self):
+        for filename in self.runs:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+        self.runs = []
+        self.buffer = des.columns.ResourceColumns()
+        self.uri_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_sitemap(fh, capability=None):
+    """
+    Read the entries of a sitemap (urlset) without keeping the document in memory.
+    :param fh: binary file object of the sitemap
+    :param capability: the capability the sitemap must have or None
+    :return: generator of Entry in document order
+    :raises SitemapParseError: if the sitemap is a sitemapindex or has another capability
+    :raises xml.etree.ElementTree.ParseError: if the sitemap is not well-formed
+    """
+    in_preamble = True
+    root = None
+    for event, element in ET.iterparse(fh, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+                if element.tag == SITEMAPINDEX_TAG:
+                    raise SitemapParseError("Got a sitemapindex where a sitemap was expected")
+                elif element.tag != URLSET_TAG:
+                    raise SitemapParseError("Root element is not urlset but %s" % element.tag)
+            in_preamble = in_preamble and element.tag != URL_TAG
+        elif element.tag == MD_TAG and in_preamble:
+            found = element.get("capability")
+            if capability is not None and found != capability:
+                raise SitemapParseError("Capability is not %s but %s" % (capability, found))
+        elif element.tag == URL_TAG:
+            yield entry_of(element)
+            # keep memory flat
+            element.clear()
+            root.remove(element)
+
+
+def entry_of(element):
+    """
+    :param element: xml.etree.ElementTree.Element of a <url> in a resource list
+    :return: the Entry
+    """
+    loc = element.findtext(LOC_TAG)
+    if loc is None:
+        raise SitemapParseError("Missing <loc> in <url>")
+    lastmod = element.findtext(LASTMOD_TAG)
+    timestamp = w3c.str_to_datetime(lastmod.strip()) if lastmod is not None else None
+    length = None
+    md5 = None
+    sha256 = None
+    md = element.find(MD_TAG)
+    if md is not None:
+        if md.get("length") is not None:
+            length = int(md.get("length"))
+        for value in md.get("hash", "").split():
+            if value.startswith("md5:"):
+                md5 = value[4:]
+            elif value.startswith("sha-256:"):
+                sha256 = value[8:]
+    return Entry(loc.strip(), timestamp, length, md5, sha256)
+
+
+def iter_disk(mapper, set_md5=False, set_sha256=False, sample=None):
+    """
+    Read the entries of the files at the destinations of mapper, as
+    resync.resource_list_builder.ResourceListBuilder.from_disk does, without keeping them in memory. Digests are
+    computed by the des.checksum.Checksummer of this process.
+    :param mapper: resync.mapper.Mapper from source uris to destination paths
+    :param set_md5: True to compute the md5 of each file
+    :param set_sha256: True to compute the sha-256 of each file
+    :param sample: function of a uri that tells whether to compute the digests of its file, None for all files
+    :return: generator of Entry in directory order
+    """
+    entries = __iter_files__(mapper)
+    algorithms = [algorithm for algorithm, wanted in ((des.checksum.MD5, set_md5), (des.checksum.SHA256, set_sha256))
+                  if wanted]
+    if len(algorithms) == 0:
+        for filename, size, entry in entries:
+            yield entry
+        return
+
+    def algorithms_of(item):
+        return algorithms if sample is None or sample(item[2].uri) else ()
+
+    for (filename, size, entry), digests in des.checksum.instance().digests(entries, algorithms_of):
+        if isinstance(digests, OSError):
+            logging.getLogger(__name__).warn("Ignoring file %s (%s)" % (filename, str(digests)))
+            continue
+        yield with_digests(entry, algorithms_of((filename, size, entry)), digests)
+
+
+def with_digests(entry, algorithms, digests):
+    """
+    :param entry: an Entry
+    :param algorithms: the hash types of digests
+    :param digests: the digests computed by des.checksum
+    :return: entry with the digests as md5 and sha-256
+    """
+    values = dict(zip(algorithms, digests))
+    return entry._replace(md5=values.get(des.checksum.MD5), sha256=values.get(des.checksum.SHA256))
+
+
+def __iter_files__(mapper):
+    # tuples (filename, size, Entry without digests) of the files at the destinations of mapper
+    for mapping in mapper.mappings:
+        path = mapping.dst_path
+        if os.path.isdir(path):
+            for dirpath, dirs, files in os.walk(path, topdown=True):
+                for exclude in EXCLUDE_DIRS:
+                    if exclude in dirs:
+                        dirs.remove(exclude)
+                for file in files:
+                    filename = os.path.join(dirpath, file)
+                    entry = entry_of_file(mapper, filename)
+                    if entry is not None:
+                        yield filename, entry.length, entry
+        else:
+            entry = entry_of_file(mapper, path)
+            if entry is not None:
+                yield path, entry.length, entry
+
+
+def entry_of_file(mapper, filename, set_md5=False):
+    """
+    :param mapper: resync.mapper.Mapper from source uris to destination paths
+    :param filename: the file
+    :param set_md5: True to compute the md5 of the file
+    :return: the Entry of the file or None if the file is left out of the inventory
+    """
+    if EXCLUDE_FILES.match(os.path.basename(filename)):
+        return None
+    try:
+        if not os.path.isfile(filename) or os.path.islink(filename):
+            return None
+        stat = os.stat(filename)
+        md5 = des.checksum.file_digests(filename, (des.checksum.MD5,))[0] if set_md5 else None
+    except OSError as err:
+        logging.getLogger(__name__).warn("Ignoring file %s (%s)" % (filename, str(err)))
+        return None
+    return Entry(mapper.dst_to_src(filename), stat.st_mtime, stat.st_size, md5)
@@ -23,11 +23,34 @@ class Config(object):
     key_destination_root = "destination_root"
     key_use_netloc = "use_netloc"
     key_use_checksum = "use_checksum"
+    key_checksum_workers = "checksum_workers"
     key_audit_only = "audit_only"
+    key_audit_mode = "audit_mode"
+    key_audit_sample_rounds = "audit_sample_rounds"
     key_sync_status_report_file = "sync_status_report_file"
     key_sync_pause = "sync_pause"
+    key_sync_pause_min = "sync_pause_min"
+    key_sync_pause_max = "sync_pause_max"
     key_des_processor_listeners = "des_processor_listeners"
     key_des_dump_listeners = "des_dump_listeners"
+    key_state_store_file = "state_store_file"
+    key_worker_threads = "worker_threads"
+    key_fetch_backend = "fetch_backend"
+    key_compress_sitemaps = "compress_sitemaps"
+    key_connect_timeout = "connect_timeout"
+    key_read_timeout = "read_timeout"
+    key_source_budget = "source_budget"
+    key_round_budget = "round_budget"
+    key_compare_memory_budget = "compare_memory_budget"
+    key_pipeline_queue_size = "pipeline_queue_size"
+    key_pipeline_fetch_workers = "pipeline_fetch_workers"
+    key_change_workers = "change_workers"
+    key_journal_dir = "journal_dir"
+    key_retry_backoff = "retry_backoff"
+    key_retry_backoff_max = "retry_backoff_max"
+    key_metrics_report_file = "metrics_report_file"
+    key_monitor_host = "monitor_host"
+    key_monitor_port = "monitor_port"
 
     @staticmethod
     def __get_logger__():
@@ -111,6 +134,18 @@ class Config(object):
             return value
         return int(value)
 
+    def float_prop(self, key, default_value=0.0):
+        """
+        Get the float value for the given key or default_value if key not found.
+        :param key:
+        :param default_value:
+        :return:
+        """
+        value = self.prop(key, str(default_value))
+        if value is None:
+            return value
+        return float(value)
+
     def list_prop(self, key, default_value=[]):
         """
         Get the list value for the given key or default_value if key not found.
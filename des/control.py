@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, os, signal, threading
+
+# The file that, when it exists, stops a running DesRunner.
+STOP_FILENAME = "stop"
+
+# How often watched files are examined, unit is seconds.
+WATCH_INTERVAL = 1.0
+
+
+def file_signature(filename):
+    """
+    :param filename: the file to examine
+    :return: a value that changes when the file is created, removed, replaced or modified
+    """
+    try:
+        stat = os.stat(filename)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+class Control(object):
+    """
+    Control of a running DesRunner. The runner waits on a Control instead of sleeping: the wait ends as soon as a stop
+    or a reload is requested.
+
+    A stop is requested by SIGTERM or SIGINT or by creating the stop file. A reload is requested by SIGHUP or by
+    changes to any of the watched files. Files are watched by a daemon thread that examines them every
+    WATCH_INTERVAL seconds.
+    """
+
+    def __init__(self, watched_files=(), stop_filename=STOP_FILENAME, watch_interval=WATCH_INTERVAL):
+        """
+        Initialize a Control.
+        :param watched_files: files that trigger a reload when they change
+        :param stop_filename: the file that triggers a stop when it exists
+        :param watch_interval: seconds between examinations of the files
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.stop_filename = stop_filename
+        self.watch_interval = watch_interval
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.stop_requested = False
+        self.reload_requested = True
+        self.signatures = dict()
+        self.watched_files = []
+        self.watcher = None
+        self.closed = threading.Event()
+        self.previous_handlers = dict()
+        for filename in watched_files:
+            self.watch(filename)
+
+    def watch(self, filename):
+        """
+        Watch filename for changes.
+        :param filename: the file to watch
+        :return: None
+        """
+        with self.lock:
+            if filename is not None and filename not in self.watched_files:
+                self.watched_files.append(filename)
+                self.signatures[filename] = file_signature(filename)
+
+    def start(self):
+        """
+        Install signal handlers, if called from the main thread, and start watching files.
+        :return: None
+        """
+        if threading.current_thread() is threading.main_thread():
+            for signum, handler in ((signal.SIGTERM, self.__on_stop_signal__),
+                                    (signal.SIGINT, self.__on_stop_signal__),
+                                    (signal.SIGHUP, self.__on_reload_signal__)):
+                self.previous_handlers[signum] = signal.signal(signum, handler)
+        self.check_files()
+        self.watcher = threading.Thread(target=self.__watch__, name="control")
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def close(self):
+        """
+        Stop watching files and restore previous signal handlers.
+        :return: None
+        """
+        self.closed.set()
+        for signum, handler in self.previous_handlers.items():
+            signal.signal(signum, handler)
+        self.previous_handlers = dict()
+
+    def request_stop(self, reason):
+        with self.lock:
+            if not self.stop_requested:
+                self.logger.info("Stop requested: %s" % reason)
+            self.stop_requested = True
+        self.event.set()
+
+    def request_reload(self, reason):
+        with self.lock:
+            self.logger.info("Reload requested: %s" % reason)
+            self.reload_requested = True
+        self.event.set()
+
+    def take_reload(self):
+        """
+        :return: True if a reload was requested since the last call, False otherwise
+        """
+        with self.lock:
+            reload = self.reload_requested
+            self.reload_requested = False
+            return reload
+
+    def wait(self, timeout):
+        """
+        Wait until timeout seconds have passed or a stop or reload is requested.
+        :param timeout: seconds to wait at most, None to wait for a request
+        :return: True if the wait ended because of a request, False otherwise
+        """
+        requested = self.event.wait(timeout)
+        self.event.clear()
+        return requested
+
+    def check_files(self):
+        """
+        Examine the stop file and the watched files now.
+        :return: None
+        """
+        if os.path.isfile(self.stop_filename):
+            self.request_stop("found file named '%s'" % self.stop_filename)
+        changed = []
+        with self.lock:
+            for filename in self.watched_files:
+                signature = file_signature(filename)
+                if signature != self.signatures[filename]:
+                    self.signatures[filename] = signature
+                    changed.append(filename)
+        if len(changed) > 0:
+            self.request_reload("changed %s" % ", ".join(changed))
+
+    def __watch__(self):
+        while not self.closed.wait(self.watch_interval):
+            self.check_files()
+
+    def __on_stop_signal__(self, signum, frame):
+        self.request_stop("received signal %d" % signum)
+
+    def __on_reload_signal__(self, signum, frame):
+        self.request_reload("received signal %d" % signum)
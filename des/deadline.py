@@ -0,0 +1,110 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib, threading, time
+
+# Seconds to wait for a connection to be made.
+DEFAULT_CONNECT_TIMEOUT = 10.0
+# Seconds to wait for the next bytes of a response.
+DEFAULT_READ_TIMEOUT = 60.0
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    """
+    The time budget of a source url or a round has been spent.
+    """
+    pass
+
+
+class Deadline(object):
+    """
+    A time budget. A deadline can have a parent, i.e. the deadline of a source url has the deadline of the round as
+    parent: whichever expires first counts.
+    """
+
+    def __init__(self, budget, name, parent=None):
+        """
+        Initialize a Deadline. The budget starts to run right away.
+        :param budget: seconds in the budget, 0 or less for no budget
+        :param name: what the budget is for, i.e. the source url
+        :param parent: the Deadline of the enclosing budget (default = None)
+        :return: None
+        """
+        self.name = name
+        self.parent = parent
+        self.expires = time.monotonic() + budget if budget > 0 else None
+
+    def remaining(self):
+        """
+        :return: the seconds left in this budget and the budgets enclosing it, None if there is no budget at all
+        """
+        remaining = None if self.expires is None else self.expires - time.monotonic()
+        if self.parent is not None:
+            parent_remaining = self.parent.remaining()
+            if remaining is None or (parent_remaining is not None and parent_remaining < remaining):
+                remaining = parent_remaining
+        return remaining
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        """
+        :raises DeadlineExceeded: if the budget has been spent
+        """
+        if self.expired():
+            raise DeadlineExceeded("Time budget spent: %s" % self.__spent__().name)
+
+    def timeout(self, timeout):
+        """
+        Cut a timeout down to the seconds left in the budget.
+        :param timeout: the timeout in seconds, None for no timeout
+        :return: the timeout or the seconds left, whichever is less
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        remaining = max(remaining, 0.0)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def __spent__(self):
+        # the deadline that has expired: this one or an enclosing one
+        if self.parent is not None and self.parent.expired():
+            return self.parent.__spent__()
+        return self
+
+    def __repr__(self):
+        return "Deadline(%s, remaining=%s)" % (self.name, self.remaining())
+
+
+def current():
+    """
+    :return: the Deadline of the work the current thread is doing or None
+    """
+    return getattr(_local, "deadline", None)
+
+
+@contextlib.contextmanager
+def scope(deadline):
+    """
+    Do the work in the with-block under deadline.
+    :param deadline: a Deadline or None for no deadline
+    """
+    previous = current()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def check():
+    """
+    :raises DeadlineExceeded: if the budget of the work the current thread is doing has been spent
+    """
+    deadline = current()
+    if deadline is not None:
+        deadline.check()
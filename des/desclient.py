@@ -1,24 +1,30 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import logging, datetime, os.path, inspect, des.reporter
-from resync.client import Client
+import logging, datetime, os.path, inspect, shutil, threading, des.checksum, des.fetch, des.reporter, des.metrics
+from resync.client import Client, ClientFatalError
+from resync.resource import Resource
 from resync.mapper import Map
 from des.config import Config
 
 
-_instance = None
+# Suffix of a file that a resource is downloaded to before it replaces the file of the resource.
+PARTIAL_SUFFIX = ".part"
+
+_local = threading.local()
+# incremented by reset_instance: threads holding an instance of an older generation construct a new one
+_generation = 0
 
 
 def instance():
     """
     resync.Client is a somewhat heavy class. Desclient inherits and is adapted to be used during one run of
-    resyncing several sources. For convenience: grab the one instance from here.
+    resyncing several sources. For convenience: grab the one instance from here. A DesClient keeps the mappings
+    of the sync in progress, so each thread gets its own instance.
     :return: an instance of Desclient
     """
-    global _instance
     logger = logging.getLogger(__name__)
-    if _instance is None:
+    if getattr(_local, "instance", None) is None or _local.generation != _generation:
         config = Config()
 
         # Parameters in the constructor of resync Client
@@ -29,20 +35,21 @@ def instance():
         audit_only = config.boolean_prop(Config.key_audit_only, True)
         dryrun = audit_only
 
-        _instance = DesClient(checksum, verbose, dryrun)
+        _local.instance = DesClient(checksum, verbose, dryrun)
+        _local.generation = _generation
         logger.debug("Created a new %s [checksum=%s, verbose=%s, dryrun=%s]"
-                         % ( _instance.__class__.__name__ , checksum, verbose, dryrun))
+                         % ( _local.instance.__class__.__name__ , checksum, verbose, dryrun))
 
-    return _instance
+    return _local.instance
 
 
 def reset_instance():
     """
-    Reset the _instance variable: next time an instance is requested it will be constructed anew.
+    Reset the instances: next time an instance is requested it will be constructed anew.
     :return: None
     """
-    global _instance
-    _instance = None
+    global _generation
+    _generation += 1
 
 
 class DesClient(Client):
@@ -79,11 +86,161 @@ class DesClient(Client):
 
     # Override
     def log_status(self, in_sync=None, incremental=False, audit=False,
-                   same=None, created=0, updated=0, deleted=0, to_delete=0, exception=None):
+                   same=None, created=0, updated=0, deleted=0, to_delete=0, exception=None, verified=None,
+                   coverage=None):
         origin = "%s:%s" % (inspect.stack()[1][1], inspect.stack()[1][2])
         des.reporter.instance().log_status(self.mapper.default_src_uri(), origin, in_sync, incremental, audit, same,
-                                           created, updated, deleted, to_delete, exception)
+                                           created, updated, deleted, to_delete, exception, verified, coverage)
         super().log_status(in_sync, incremental, audit, same, created, updated, deleted, to_delete)
+        # resync.client.Client logs an audit right after comparing the source and destination resource lists.
+        if audit and same is not None:
+            metrics = des.metrics.instance()
+            metrics.inc(des.metrics.RESOURCES_COMPARED, same + created + updated + deleted)
+            metrics.inc(des.metrics.CHANGES_OBSERVED, created + updated + deleted)
+
+    # Override
+    def update_resource(self, resource, filename, change=None):
+        """
+        Update resource from uri to filename on local system, keeping metrics. Does what
+        resync.client.Client.update_resource does, but gets the resource with the des.fetch backend.
+        """
+        metrics = des.metrics.instance()
+        with metrics.timer(des.metrics.STAGE_WRITE, resource.uri):
+            num_updated = self.__get_resource__(resource, filename, change)
+        if num_updated > 0:
+            metrics.inc(des.metrics.RESOURCES_WRITTEN, num_updated, change=change)
+        return num_updated
+
+    def __get_resource__(self, resource, filename, change):
+        if self.dryrun:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            self.logger.info("dryrun: would GET %s --> %s" % (resource.uri, filename))
+            return 0
+        digester = self.download_resource(resource, filename)
+        if digester is None:
+            return 0
+        num_updated = self.__written__(resource, filename, change)
+        self.verify_digests(resource, digester)
+        return num_updated
+
+    def fetch_resource(self, resource):
+        """
+        Get the content of resource with the des.fetch backend.
+        :param resource: the resync.resource.Resource
+        :return: the content as bytes or None if the GET failed and failures are ignored
+        :raises ClientFatalError: if the GET failed
+        """
+        try:
+            response = des.fetch.instance().get(resource.uri)
+            des.metrics.instance().fetched(resource.uri, response.status_code, len(response.content))
+            if response.status_code != 200:
+                raise IOError("HTTP Error %d" % response.status_code)
+            return response.content
+        except IOError as err:
+            msg = "Failed to GET %s -- %s" % (resource.uri, str(err))
+            if getattr(self, "ignore_failures", False):
+                self.logger.warning(msg)
+                return None
+            raise ClientFatalError(msg)
+
+    def download_resource(self, resource, filename):
+        """
+        Get the content of resource with the des.fetch backend and write it to filename while it is read, computing
+        the digests to verify it on the way. The content goes to a partial file first, so that a failed download
+        leaves an earlier copy of the resource as it was.
+        :param resource: the resync.resource.Resource
+        :param filename: the file to write to
+        :return: the des.checksum.Digester of the content or None if the GET failed and failures are ignored
+        :raises ClientFatalError: if the GET failed
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        partial = filename + PARTIAL_SUFFIX
+        try:
+            with open(partial, "wb") as file:
+                digester = des.checksum.Digester(file, self.__algorithms__(resource))
+                response = des.fetch.instance().get_to_file(resource.uri, digester)
+            des.metrics.instance().fetched(resource.uri, response.status_code, response.length)
+            if response.status_code != 200:
+                raise IOError("HTTP Error %d" % response.status_code)
+            if os.path.exists(filename):
+                shutil.copymode(filename, partial)
+            os.replace(partial, filename)
+            return digester
+        except IOError as err:
+            msg = "Failed to GET %s -- %s" % (resource.uri, str(err))
+            if getattr(self, "ignore_failures", False):
+                self.logger.warning(msg)
+                return None
+            raise ClientFatalError(msg)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def write_resource(self, resource, filename, content, change=None):
+        """
+        Write the content of resource to filename and give the file the timestamp of resource.
+        :return: the number of resources written
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as file:
+            file.write(content)
+        return self.__written__(resource, filename, change)
+
+    def __written__(self, resource, filename, change):
+        # give the file the timestamp of resource and log the change
+        if resource.timestamp is not None:
+            unixtime = int(resource.timestamp)  # no fractional
+            os.utime(filename, (unixtime, unixtime))
+            if resource.timestamp > self.last_timestamp:
+                self.last_timestamp = resource.timestamp
+        self.log_event(Resource(resource=resource, change=change))
+        return 1
+
+    def verify_resource(self, resource, content):
+        """
+        Check the length and, if checksums are used, the md5 and sha-256 of the content of resource against the
+        values in the resource list. Mismatches are logged.
+        :return: True if the content matches, False otherwise
+        """
+        digester = des.checksum.Digester(algorithms=self.__algorithms__(resource))
+        digester.write(content)
+        return self.verify_digests(resource, digester)
+
+    def verify_digests(self, resource, digester):
+        """
+        Check the length and, if checksums are used, the md5 and sha-256 of content written to a
+        des.checksum.Digester against the values in the resource list. Mismatches are logged.
+        :return: True if the content matches, False otherwise
+        """
+        verified = True
+        length = digester.length
+        if resource.length is not None and resource.length != length:
+            self.logger.info("Downloaded size for %s of %d bytes does not match expected %d bytes"
+                             % (resource.uri, length, resource.length))
+            verified = False
+        for name, expected, algorithm in (("MD5", resource.md5, des.checksum.MD5),
+                                          ("SHA-256", resource.sha256, des.checksum.SHA256)):
+            digest = digester.digest(algorithm)
+            if expected is not None and digest is not None and expected != digest:
+                self.logger.info("%s mismatch for %s, got %s but expected %s" % (name, resource.uri, digest, expected))
+                verified = False
+        return verified
+
+    def __algorithms__(self, resource):
+        # the hash types of which the digests of the content of resource are verified
+        if not self.checksum:
+            return ()
+        return tuple(algorithm for algorithm, expected in ((des.checksum.MD5, resource.md5),
+                                                           (des.checksum.SHA256, resource.sha256))
+                     if expected is not None)
+
+    # Override
+    def delete_resource(self, resource, filename, allow_deletion=False):
+        """Delete copy of resource in filename on local system, keeping metrics."""
+        num_deleted = super().delete_resource(resource, filename, allow_deletion)
+        if num_deleted > 0:
+            des.metrics.instance().inc(des.metrics.RESOURCES_WRITTEN, num_deleted, change="deleted")
+        return num_deleted
 
 
 
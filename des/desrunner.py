@@ -13,16 +13,21 @@ try:
 except:
     pass
 
-import des.reporter, des.processor, des.dump
+import des.reporter, des.processor, des.dump, des.state, des.visited, des.metrics, des.monitor, des.control, \
+    des.taskqueue, des.fetch, des.deadline, des.checksum
 from des.config import Config
 from des.location_mapper import DestinationMap
 from des.processor import Sodesproc, Capaproc
 from des.discover import Discoverer
+from des.profiler import RoundProfiler
+from des.scheduler import Scheduler
+from des.control import Control
+from des.shard import HashRing, Coordinator, configure_shard, parse_shard, merge_reports
 
 
 class DesRunner(object):
     """
-    usage: desrunner.py [-h] [-c] [-t] [-o] sources
+    usage: desrunner.py [-h] [-c] [-t] [-o] [-p] [--shard] [--shards] [--merge] sources
 
     Run a ResourceSync Destination as an application.
 
@@ -35,12 +40,22 @@ class DesRunner(object):
       -t, --task     the task that should be run. ['discover', 'wellknown',
                       'capability'] (default: discover)
       -o, --once      explore source urls once and exit (default: False)
+      -p, --profile   profile each round and write the results next to the sync
+                      status report (default: False)
+      --shard         process only this shard of the source urls, given as
+                      index/count (default: None)
+      --shards        partition the source urls over this many worker
+                      processes (default: 1)
+      --merge         merge the sync status reports of --shards shards and exit
+                      (default: False)
     """
 
-    def __init__(self, config_filename="conf/config.txt"):
+    def __init__(self, config_filename="conf/config.txt", shard=None):
         '''
         Create a Runner using the configuration file denoted by config_filename.
         :param config_filename:
+        :param shard: tuple (index, count) to process only the shard index of count shards of the source urls,
+                    None to process all source urls
         :return: None
         '''
         try:
@@ -51,6 +66,10 @@ class DesRunner(object):
             print(err)
             raise err
 
+        self.shard = shard
+        if shard is not None:
+            configure_shard(*shard)
+
         logging_configuration_file = config.prop(Config.key_logging_configuration_file, "conf/logging.conf")
         # logging.config.fileConfig raises "KeyError: 'formatters'" if the configuration file does not exist.
         # A FileNotFoundError in this case is less confusing.
@@ -65,11 +84,18 @@ class DesRunner(object):
         self.pid = os.getpid()
         self.sources = None
         self.exceptions = []
+        self.control = None
+        # source url -> statuses reported during the latest visit
+        self.latest_statuses = dict()
 
         self.logger.info("Started %s with pid %d" % (__file__, self.pid))
         self.logger.info("Configured %s from '%s'" % (self.__class__.__name__, config_filename))
+        if shard is not None:
+            self.logger.info("Processing shard %d/%d of source urls" % shard)
         self.logger.info("Configured logging from '%s'" % logging_configuration_file)
         self.__inject_dependencies__(config)
+        self.monitor_server = None
+        self.__start_monitor_server__(config)
 
     def __inject_dependencies__(self, config):
         listeners = config.list_prop(Config.key_des_processor_listeners)
@@ -78,6 +104,15 @@ class DesRunner(object):
         listeners = config.list_prop(Config.key_des_dump_listeners)
         self.__inject__(listeners, des.dump.dump_listeners)
 
+        backend = config.prop(Config.key_fetch_backend)
+        if backend is not None:
+            backends = []
+            self.__inject__([backend], backends)
+            des.fetch.set_instance(backends[0])
+        des.fetch.instance().set_timeouts(
+            config.float_prop(Config.key_connect_timeout, des.deadline.DEFAULT_CONNECT_TIMEOUT),
+            config.float_prop(Config.key_read_timeout, des.deadline.DEFAULT_READ_TIMEOUT))
+
     def __inject__(self, listeners, list):
         for listener in listeners:
             names = listener.rsplit(".", 1)
@@ -85,12 +120,25 @@ class DesRunner(object):
             list.append(clas())
             self.logger.info("Injected %s.%s" % (names[0], names[1]))
 
-    def run(self, sources, task="discover", once=False):
+    def __start_monitor_server__(self, config):
+        port = config.int_prop(Config.key_monitor_port, 0)
+        if port > 0:
+            host = config.prop(Config.key_monitor_host, "localhost")
+            self.monitor_server = des.monitor.MonitorServer(host, port)
+            self.monitor_server.start()
+
+    def run(self, sources, task="discover", once=False, profile=False):
         """
         Run the DesRunner. A running application can be stopped by creating a file named 'stop' in the directory
-        the runner was started from.
-        Source urls are read from the file given in param 'sources'. This file is read each time a full round
-        of synchronizing has taken place, so source urls can be extended or changed without restarting the application.
+        the runner was started from, or by sending it SIGTERM. The source url being processed is finished and
+        reported before the runner stops.
+        Source urls are read from the file given in param 'sources'. This file is watched, as is the destination map
+        file, and read again within seconds after it changes or after the runner receives SIGHUP, so source urls can
+        be extended or changed without restarting the application.
+
+        If the configuration parameters "sync_pause_min" and "sync_pause_max" are given, there are no full rounds:
+        each source url is visited when it is due and the interval between visits adapts to the changes observed
+        at the source. Otherwise all source urls are visited in rounds with "sync_pause" seconds in between.
 
         Sources are mapped to the destinations given in the file denoted by the configuration parameter
         "location_mapper_destination_file".
@@ -102,33 +150,113 @@ class DesRunner(object):
                         - If all source urls point to capability lists, use 'capability'.
                         - If source urls are heterogeneous, use 'discover'.
         :param once: True for exploring source urls once and than exit, False otherwise
+        :param profile: True for profiling each round with cProfile and tracemalloc, False otherwise
         :return:
         """
-        condition = True
-        while condition:
-            # list of urls
-            self.logger.info("Reading source urls from '%s'" % sources)
-            self.__read_sources_doc__(sources)
-            # reset url --> destination map. New mappings may be configured
-            DestinationMap.__set_map_filename__(Config().
-                                                prop(Config.key_location_mapper_destination_file, "conf/desmap.txt"))
-            # drop to force fresh read from file
-            DestinationMap().__drop__()
-            # Set the root of the destination folder if configured
-            DestinationMap().set_root_folder(Config().prop(Config.key_destination_root))
+        config = Config()
+        desmap = config.prop(Config.key_location_mapper_destination_file, "conf/desmap.txt")
+        self.control = Control(watched_files=[sources, desmap])
+        self.control.start()
+        try:
+            min_interval = config.prop(Config.key_sync_pause_min)
+            max_interval = config.prop(Config.key_sync_pause_max)
+            if not once and min_interval is not None and max_interval is not None:
+                self.__run_scheduled__(sources, task, profile, int(min_interval), int(max_interval))
+            else:
+                self.__run_rounds__(sources, task, once, profile)
+        finally:
+            self.control.close()
+            self.control = None
+            des.checksum.reset_instance()
+
+    def __run_rounds__(self, sources, task, once, profile):
+        """
+        Visit all source urls in rounds, sync_pause seconds apart. Source urls that are added while waiting for the
+        next round are visited right away.
+        """
+        while True:
+            self.control.take_reload()
+            self.__prepare_round__(sources)
             # do all the urls
-            self.__do_task__(task)
+            self.__do_round__(task, self.sources, profile)
             # report
             self.__do_report__(task)
             # to continue or not to continue
-            condition = not (once or self.__stop__())
-            if condition:
-                pause = Config().int_prop(Config.key_sync_pause)
-                self.logger.info("Going to sleep for %d seconds." % pause)
-                self.logger.debug("zzzzzzzzzzzzzzzzzzzzzzzzzzzzzz")
-                time.sleep(pause)
-                # repeat after sleep
-                condition = not (once or self.__stop__())
+            if once or self.__stop__():
+                break
+            pause = Config().int_prop(Config.key_sync_pause)
+            self.logger.info("Going to sleep for %d seconds." % pause)
+            self.logger.debug("zzzzzzzzzzzzzzzzzzzzzzzzzzzzzz")
+            deadline = time.time() + pause
+            while not self.__stop__() and time.time() < deadline:
+                self.control.wait(deadline - time.time())
+                if self.control.take_reload() and not self.__stop__():
+                    known = self.sources
+                    self.__prepare_round__(sources)
+                    added = [uri for uri in self.sources if uri not in known]
+                    if len(added) > 0:
+                        self.__do_round__(task, added, profile)
+                        self.__do_report__(task)
+            if self.__stop__():
+                break
+
+    def __run_scheduled__(self, sources, task, profile, min_interval, max_interval):
+        """
+        Visit each source url when it is due. How often a source url is visited depends on the changes observed
+        at the source: between min_interval and max_interval seconds. The source urls that are due at the same time
+        are visited in one round.
+        """
+        self.logger.info("Scheduling source urls every %d to %d seconds" % (min_interval, max_interval))
+        scheduler = Scheduler(min_interval, max_interval, Config().int_prop(Config.key_sync_pause, min_interval))
+        metrics = des.metrics.instance()
+        while not self.__stop__():
+            if self.control.take_reload():
+                # source urls may have been changed or added: new source urls are due immediately
+                self.__prepare_round__(sources)
+                scheduler.set_sources(self.sources)
+            # all source urls that are due are visited in one round, so the workers take them on concurrently
+            now = time.time()
+            due = []
+            uri = scheduler.pop(now)
+            while uri is not None:
+                due.append(uri)
+                uri = scheduler.pop(now)
+            if len(due) == 0:
+                self.control.wait(scheduler.wait_time())
+                continue
+
+            observed = dict((uri, metrics.total(des.metrics.CHANGES_OBSERVED, source=uri)) for uri in due)
+            self.__do_round__(task, due, profile)
+            for uri in due:
+                changes = metrics.total(des.metrics.CHANGES_OBSERVED, source=uri) - observed[uri]
+                schedule = scheduler.reschedule(uri, changes)
+                self.logger.info("Observed %d changes at %s. Next visit in %d seconds"
+                                 % (changes, uri, schedule.interval))
+            self.__do_report__(task)
+
+    def __prepare_round__(self, sources):
+        # list of urls
+        self.logger.info("Reading source urls from '%s'" % sources)
+        self.__read_sources_doc__(sources)
+        # reset url --> destination map. New mappings may be configured
+        DestinationMap.__set_map_filename__(Config().
+                                            prop(Config.key_location_mapper_destination_file, "conf/desmap.txt"))
+        # drop to force fresh read from file
+        DestinationMap().__drop__()
+        # Set the root of the destination folder if configured
+        DestinationMap().set_root_folder(Config().prop(Config.key_destination_root))
+
+    def __do_round__(self, task, uris, profile):
+        des.monitor.instance().start_round(len(uris))
+        profiler = RoundProfiler() if profile else None
+        if profiler is not None:
+            profiler.start()
+        with des.metrics.instance().timer(des.metrics.STAGE_ROUND, source=""):
+            self.__do_task__(task, uris)
+        if profiler is not None:
+            profiler.stop()
+        des.metrics.instance().inc(des.metrics.ROUNDS, source="")
+        des.monitor.instance().end_round()
 
     def __read_sources_doc__(self, sources):
         with open(sources) as f:
@@ -137,50 +265,113 @@ class DesRunner(object):
         for line in lines:
             if line.strip() == "" or line.startswith("#"):
                 pass
+            elif line in self.sources:
+                self.logger.warn("Duplicate source url '%s' in '%s'" % (line, sources))
             else:
                 self.sources.append(line)
+        if self.shard is not None:
+            index, count = self.shard
+            ring = HashRing(count)
+            self.sources = [uri for uri in self.sources if ring.shard_of(uri) == index]
         self.logger.info("Got %d source urls from '%s'" % (len(self.sources), sources))
 
-    def __do_task__(self, task):
-        for uri in self.sources:
-            processor = None
-            if task == "discover":
-                discoverer = Discoverer(uri)
-                processor = discoverer.get_processor()
-            elif task == "wellknown":
-                processor = Sodesproc(uri)
-            elif task == "capability":
-                processor = Capaproc(uri)
-
-            if processor is None:
-                msg = "Could not discover processor for '%s'" % uri
-                self.logger.warn(msg)
-                self.exceptions.append(msg)
-                des.reporter.instance().log_status(uri, exception=msg)
-            else:
-                try:
-                    processor.process_source()
-                    self.exceptions.extend(processor.exceptions)
-                    # do something with processor status
-                except Exception as err:
-                    self.exceptions.append(err)
-                    self.logger.warn("Failure while syncing %s" % uri, exc_info=True)
-                    des.reporter.instance().log_status(uri, exception=err)
+    def __do_task__(self, task, uris):
+        """
+        Process the source urls with a TaskQueue of "worker_threads" workers. Each source url is a SourceTask; the
+        sitemaps, lists and dumps it leads to are tasks of their own, so idle workers can help out with large sources.
+
+        Each source url has a budget of "source_budget" seconds and all source urls together have "round_budget"
+        seconds. Source urls that are not started within the round budget are left for the next round.
+        """
+        config = Config()
+        round_deadline = des.deadline.Deadline(config.float_prop(Config.key_round_budget, 0), "round")
+        source_budget = config.float_prop(Config.key_source_budget, 0)
+        queue = des.taskqueue.TaskQueue(config.int_prop(Config.key_worker_threads, 1))
+        tasks = [SourceTask(self, task, uri, source_budget, round_deadline) for uri in uris]
+        left = queue.run(tasks, stop=lambda: self.__stop__() or round_deadline.expired())
+        if len(left) > 0 and round_deadline.expired():
+            self.logger.warn("Round budget spent: leaving %d source urls unvisited" % len(left))
+        elif len(left) > 0:
+            # drain: the source urls in progress have been finished, leave the others for next time
+            self.logger.info("Stopping: leaving %d source urls unvisited" % len(left))
+        reporter = des.reporter.instance()
+        for source_task in tasks:
+            if source_task not in left:
+                self.latest_statuses[source_task.source] = reporter.statuses_of(source_task.source)
 
     def __do_report__(self, task):
         reporter = des.reporter.instance()
+        # the sync status report holds the latest visit to each source url
+        reporter.sync_status = [status for uri in self.sources for status in self.latest_statuses.get(uri, [])]
         reporter.sync_status_to_file()
+        des.metrics.instance().to_file()
+        des.state.instance().commit()
         self.logger.info("Ran task '%s' over %d sources with %d exceptions" % (task, len(self.sources), len(self.exceptions)))
-        # reset used reporter, clear exceptions
+        # reset used reporter and visited uris, clear exceptions
         des.reporter.reset_instance()
+        des.visited.reset_instance()
         self.exceptions = []
 
     def __stop__(self):
-        stop = os.path.isfile("stop")
-        if stop:
-            self.logger.info("Stopping %s because found file named 'stop'" % self.__class__.__name__)
+        if self.control is None:
+            return os.path.isfile(des.control.STOP_FILENAME)
+        return self.control.stop_requested
 
-        return stop
+
+class SourceTask(des.taskqueue.Task):
+    """
+    Processes one source url with the processor the task of the DesRunner calls for, within the time budget of the
+    source url.
+    """
+
+    kind = des.taskqueue.TASK_SOURCE
+
+    def __init__(self, runner, task, uri, budget=0, round_deadline=None):
+        super(SourceTask, self).__init__(source=uri)
+        self.runner = runner
+        self.task = task
+        self.budget = budget
+        self.deadline = round_deadline
+        self.exceptions = []
+
+    def run(self):
+        # the budget of the source url starts now; the tasks forked from here on run under it
+        self.deadline = des.deadline.Deadline(self.budget, self.source, parent=self.deadline)
+        with des.deadline.scope(self.deadline):
+            self.__run__()
+
+    def __run__(self):
+        des.monitor.instance().start_source(self.source)
+        processor = None
+        if self.task == "discover":
+            discoverer = Discoverer(self.source)
+            processor = discoverer.get_processor()
+        elif self.task == "wellknown":
+            processor = Sodesproc(self.source)
+        elif self.task == "capability":
+            processor = Capaproc(self.source)
+
+        if processor is None:
+            msg = "Could not discover processor for '%s'" % self.source
+            self.logger.warn(msg)
+            self.exceptions.append(msg)
+            des.reporter.instance().log_status(self.source, exception=msg)
+        else:
+            processor.process_once(on_processed=lambda processor: self.exceptions.extend(processor.exceptions))
+
+    def failed(self, err):
+        super(SourceTask, self).failed(err)
+        self.exceptions.append(err)
+
+    def complete(self):
+        timed_out = [err for err in self.exceptions if isinstance(err, des.deadline.DeadlineExceeded)]
+        if len(timed_out) > 0:
+            # tasks skipped for lack of time have not reported themselves
+            msg = "%s: %d tasks stopped or skipped" % (str(timed_out[0]), len(timed_out))
+            self.logger.warn(msg)
+            des.reporter.instance().log_status(self.source, exception=msg)
+        self.runner.exceptions.extend(self.exceptions)
+        des.monitor.instance().end_source(self.source, len(self.exceptions) == 0)
 
 
 if __name__ == '__main__':
@@ -194,9 +385,29 @@ if __name__ == '__main__':
     parser.add_argument("-t", "--task", help="the task that should be run. " + str(task_choices), default="discover",
                         choices=task_choices, metavar="")
     parser.add_argument("-o", "--once", help="explore source urls once and exit", action="store_true")
+    parser.add_argument("-p", "--profile", help="profile each round and write the results next to the sync status "
+                                                "report", action="store_true")
+
+    parser.add_argument("--shard", help="process only this shard of the source urls, given as index/count",
+                        metavar="")
+    parser.add_argument("--shards", help="partition the source urls over this many worker processes", type=int,
+                        default=1, metavar="")
+    parser.add_argument("--merge", help="merge the sync status reports of --shards shards and exit",
+                        action="store_true")
 
     args = parser.parse_args()
 
-    runner = DesRunner(config_filename=args.config)
-    runner.run(args.sources, args.task, args.once)
+    if args.merge or args.shards > 1:
+        Config.__set_config_filename__(args.config)
+        report = Config().prop(Config.key_sync_status_report_file, "sync-status.csv")
+        if args.merge:
+            merge_reports(report, args.shards)
+        else:
+            logging.config.fileConfig(Config().prop(Config.key_logging_configuration_file, "conf/logging.conf"))
+            sys.exit(Coordinator(args.shards, config_filename=args.config)
+                     .run(args.sources, args.task, args.once, args.profile))
+    else:
+        runner = DesRunner(config_filename=args.config,
+                           shard=parse_shard(args.shard) if args.shard else None)
+        runner.run(args.sources, args.task, args.once, args.profile)
 
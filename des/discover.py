@@ -1,7 +1,7 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import logging, requests, des.reporter, urllib
+import logging, des.fetch, des.reporter, des.metrics, urllib
 from html.parser import HTMLParser
 from des.status import Status
 from des.processor import Sodesproc, Capaproc, Reliproc
@@ -26,15 +26,16 @@ class Discoverer(object):
         Discover the resource sync method for the uri.
         :return: a processor for the uri or None if we cannot find one
         """
-        processor = self.try_wellknown()
-        if processor is None:
-            processor = self.try_capabilitylist()
-        if processor is None:
-            processor = self.try_link_html()
-        if processor is None:
-            processor = self.try_link_http()
-        if processor is None:
-            processor = self.try_robots()
+        with des.metrics.instance().timer(des.metrics.STAGE_DISCOVER, self.uri):
+            processor = self.try_wellknown()
+            if processor is None:
+                processor = self.try_capabilitylist()
+            if processor is None:
+                processor = self.try_link_html()
+            if processor is None:
+                processor = self.try_link_http()
+            if processor is None:
+                processor = self.try_robots()
         if processor is None:
             msg = "Could not discover resource sync method for %s" % self.uri
             self.logger.warn(msg)
@@ -74,9 +75,8 @@ class Discoverer(object):
         :return: a Capaproc on a capabilitylist or None
         """
         processor = None
-        session = requests.Session()
         try:
-            response = session.get(self.uri)
+            response = des.fetch.instance().get(self.uri)
             self.logger.debug("Read %s, status %s" % (self.uri, str(response.status_code)))
             assert response.status_code == 200, "Invalid response status: %d" % response.status_code
             text = response.text
@@ -89,15 +89,12 @@ class Discoverer(object):
                 # A Capability List may be made discoverable by means of links provided ... in an HTML document
                 processor = Capaproc(link)
 
-        except requests.exceptions.ConnectionError as err:
+        except des.fetch.FetchError as err:
             self.logger.debug("%s No connection: %s" % (self.uri, str(err)))
 
         except AssertionError as err:
             self.logger.debug("%s Error: %s" % (self.uri, str(err)))
 
-        finally:
-            session.close()
-
         return processor
 
 
@@ -123,9 +120,8 @@ class Discoverer(object):
         else:
             uri = urllib.parse.urljoin(self.uri + "/", "robots.txt")
 
-        session = requests.Session()
         try:
-            response = session.get(uri)
+            response = des.fetch.instance().get(uri)
             self.logger.debug("Read %s, status %s" % (uri, str(response.status_code)))
             assert response.status_code == 200, "Invalid response status: %d" % response.status_code
             text = response.text
@@ -145,15 +141,12 @@ class Discoverer(object):
             if len(links) > 1:
                 self.logger.warn("Discover more than one sitemap from robots.txt not implemented")
 
-        except requests.exceptions.ConnectionError as err:
+        except des.fetch.FetchError as err:
             self.logger.debug("%s No connection: %s" % (self.uri, str(err)))
 
         except AssertionError as err:
             self.logger.debug("%s Error: %s" % (self.uri, str(err)))
 
-        finally:
-            session.close()
-
         return processor
 
 
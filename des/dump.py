@@ -1,16 +1,15 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import logging, os, requests, tempfile, shutil, pathlib
-import des.reporter
+import logging, os, tempfile, shutil, pathlib
+import xml.etree.ElementTree as ET
+import des.compare, des.fetch, des.reporter, des.metrics
 from des.config import Config
 from des.location_mapper import DestinationMap
 from tempfile import NamedTemporaryFile
 from zipfile import ZipFile, BadZipFile
 from enum import Enum
-from resync.sitemap import Sitemap, SitemapParseError
-from resync.resource_list_builder import ResourceListBuilder
-from resync.mapper import Mapper
+from resync.sitemap import SitemapParseError
 
 
 CAPA_RESOURCEDUMP_MANIFEST = "resourcedump-manifest"
@@ -108,19 +107,18 @@ class Redump(object):
         :param file: the file to write to
         :return:
         """
-        session = requests.Session()
         try:
-            with file:
-                response = session.get(self.pack_uri)
+            metrics = des.metrics.instance()
+            with file, metrics.timer(des.metrics.STAGE_FETCH, self.pack_uri):
+                # a dump can be large: it goes to the file while it is read
+                response = des.fetch.instance().get_to_file(self.pack_uri, file)
                 self.source_status = response.status_code
                 assert self.source_status == 200, "Invalid response status: %d on %s" % (self.source_status, self.pack_uri)
-
-                for block in response.iter_content(1024):
-                    file.write(block)
+            metrics.fetched(self.pack_uri, self.source_status, response.length)
 
             self.status = Status.downloaded
 
-        except requests.exceptions.ConnectionError as err:
+        except des.fetch.FetchError as err:
             self.logger.warn("%s No connection: %s" % (self.pack_uri, str(err)))
             self.status = Status.download_error
             self.exceptions.append(err)
@@ -132,9 +130,6 @@ class Redump(object):
             self.exceptions.append(err)
             des.reporter.instance().log_status(self.pack_uri, exception=err)
 
-        finally:
-            session.close()
-
     def base_line(self, unzipdir):
         """
         Synchronize the unzipped contents of a resource dump with the local resources
@@ -143,49 +138,26 @@ class Redump(object):
         """
         manifest_file_name = os.path.join(unzipdir, "manifest.xml")
         try:
-            sitemap = Sitemap()
-            manifest_doc = sitemap.parse_xml(fh=manifest_file_name)
-            # the manifest_doc is a resync.resource_container.ResourceContainer
-            capability = manifest_doc.capability
-            assert capability == CAPA_RESOURCEDUMP_MANIFEST, "Capability is not %s but %s" % (CAPA_RESOURCEDUMP_MANIFEST, capability)
-            self.status = Status.parsed
-            self.__inform_sitemap_received__(capability, manifest_file_name)
-
-            config = Config()
-            netloc = config.boolean_prop(Config.key_use_netloc, False)
-            base_uri, destination = DestinationMap().find_destination(self.pack_uri, netloc=netloc)
-            assert destination is not None, "Found no destination folder in DestinationMap"
-            mapper=Mapper((base_uri, destination))
-            rlb = ResourceListBuilder(mapper=mapper)
-            dst_resource_list = rlb.from_disk()
-            # Compares on uri
-            same, updated, deleted, created = dst_resource_list.compare(manifest_doc)
-
-            raise NotImplementedError("This class is not fully implemented.")
-
-            print(len(same), len(updated), len(deleted), len(created))
-
-            print("same")
-            for resource in same:
-                print(resource)
-            print("updated")
-            for resource in updated:
-                print(resource)
-            print("deleted")
-            for resource in deleted:
-                print(resource)
-            print("created")
-            for resource in created:
-                print(resource)
-                base_uri, local_path = DestinationMap().find_local_path(resource.uri)
-                print(base_uri, local_path)
+            # the manifest is read as a stream of entries, sorted on uri
+            with des.compare.ExternalSort() as manifest:
+                with open(manifest_file_name, "rb") as file:
+                    manifest.extend(des.compare.iter_sitemap(file, capability=CAPA_RESOURCEDUMP_MANIFEST))
+                self.status = Status.parsed
+                self.__inform_sitemap_received__(CAPA_RESOURCEDUMP_MANIFEST, manifest_file_name)
+
+                config = Config()
+                netloc = config.boolean_prop(Config.key_use_netloc, False)
+                base_uri, destination = DestinationMap().find_destination(self.pack_uri, netloc=netloc)
+                assert destination is not None, "Found no destination folder in DestinationMap"
+
+                raise NotImplementedError("This class is not fully implemented.")
 
         except AssertionError as err:
             self.logger.debug("%s Error: %s" % (self.pack_uri, str(err)))
             self.status = Status.parse_error
             self.exceptions.append(err)
-        except SitemapParseError as err:
-            self.logger.debug("%s Unreadable source: %s" % (self.source_uri, str(err)))
+        except (SitemapParseError, ET.ParseError) as err:
+            self.logger.debug("%s Unreadable source: %s" % (self.pack_uri, str(err)))
             self.status = Status.parse_error
             self.exceptions.append(err)
 
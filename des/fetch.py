@@ -0,0 +1,381 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio, gzip, io, logging, threading
+
+import requests, urllib3
+
+import des.deadline
+
+# requests and httpx decode brotli with either of these packages
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Content codings we ask for. Responses are decoded while they are read.
+ACCEPT_ENCODING = "gzip, deflate" if brotli is None else "gzip, deflate, br"
+
+# The first bytes of a gzip file, such as a sitemap.xml.gz.
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Bytes read at a time from a response, between checks of the deadline.
+CHUNK_SIZE = 65536
+
+# Maximum number of connections of the AsyncBackend. Over HTTP/2 one connection per host carries all requests.
+DEFAULT_MAX_CONNECTIONS = 20
+
+_instance = None
+_lock = threading.Lock()
+
+
+def instance():
+    """
+    Get the fetch backend of this process: the backend given to set_instance or else a RequestsBackend.
+    :return: an instance of FetchBackend
+    """
+    global _instance
+    with _lock:
+        if _instance is None:
+            _instance = RequestsBackend()
+
+    return _instance
+
+
+def set_instance(backend):
+    """
+    Set the fetch backend of this process, closing the current one.
+    :param backend: an instance of FetchBackend
+    :return: None
+    """
+    global _instance
+    with _lock:
+        if _instance is not None:
+            _instance.close()
+        _instance = backend
+
+
+def open_document(file):
+    """
+    Open the content in a binary file as a document. A gzip file, such as a sitemap.xml.gz, is decompressed while it
+    is read.
+    :param file: a binary file object, at the start of the content
+    :return: a binary file object
+    """
+    start = file.tell()
+    magic = file.read(len(GZIP_MAGIC))
+    file.seek(start)
+    return gzip.GzipFile(fileobj=file) if magic == GZIP_MAGIC else file
+
+
+def reset_instance():
+    """
+    Close the current instance: next time an instance is requested it will be constructed anew.
+    :return: None
+    """
+    global _instance
+    with _lock:
+        if _instance is not None:
+            _instance.close()
+        _instance = None
+
+
+class FetchError(IOError):
+    """
+    A uri could not be fetched because no connection could be made, the connection broke or the content could not
+    be decompressed.
+    """
+    pass
+
+
+class FetchTimeout(FetchError):
+    """
+    No connection was made within the connect timeout or the server sent nothing within the read timeout.
+    """
+    pass
+
+
+class Response(object):
+    """
+    The response to a GET, read completely. The content of a response written to a file is None.
+    """
+
+    def __init__(self, uri, status_code, content, headers=None, encoding=None, http_version="HTTP/1.1",
+                 length=None):
+        self.uri = uri
+        self.status_code = status_code
+        self.content = content
+        # the number of bytes of the content
+        self.length = len(content) if length is None else length
+        self.headers = {} if headers is None else headers
+        self.encoding = encoding
+        self.http_version = http_version
+
+    def is_gzipped(self):
+        """
+        :return: True if the content is a gzip file, such as a sitemap.xml.gz, False otherwise
+        """
+        return self.content[:2] == GZIP_MAGIC
+
+    def open_document(self):
+        """
+        Open the content as a document. A gzip file is decompressed while it is read.
+        :return: a binary file object
+        """
+        return open_document(io.BytesIO(self.content))
+
+    @property
+    def document(self):
+        """
+        The content of the document, decompressed if it is a gzip file.
+        """
+        if self.is_gzipped():
+            try:
+                with self.open_document() as file:
+                    return file.read()
+            except (OSError, EOFError) as err:
+                raise FetchError("Can't decompress %s (%s)" % (self.uri, str(err))) from err
+        return self.content
+
+    @property
+    def text(self):
+        """
+        The document as text. A gzip file is assumed to hold utf-8.
+        """
+        if self.is_gzipped():
+            return self.document.decode("utf-8", errors="replace")
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class FetchBackend(object):
+    """
+    Fetches uris for processors, dumps and the DesClient. A backend is shared by all worker threads.
+
+    Every request has a connect timeout and a read timeout. A request made under a des.deadline.Deadline is cut
+    short when the budget of the deadline is spent.
+    """
+
+    connect_timeout = des.deadline.DEFAULT_CONNECT_TIMEOUT
+    read_timeout = des.deadline.DEFAULT_READ_TIMEOUT
+
+    def get(self, uri):
+        """
+        Get the resource at uri.
+        :param uri: the uri to get
+        :return: the Response
+        :raises FetchError: if no connection could be made or the connection broke
+        :raises FetchTimeout: if the connect timeout or the read timeout passed
+        :raises des.deadline.DeadlineExceeded: if the budget of the current deadline was spent
+        """
+        raise NotImplementedError
+
+    def get_to_file(self, uri, file):
+        """
+        Get the resource at uri and write its content to file while it is read, so that the content is never held
+        in memory as a whole. The content is only written if the status code is 200.
+        :param uri: the uri to get
+        :param file: a binary file object to write the content to
+        :return: the Response, without content; its length is the number of bytes written
+        :raises FetchError: if no connection could be made or the connection broke
+        :raises FetchTimeout: if the connect timeout or the read timeout passed
+        :raises des.deadline.DeadlineExceeded: if the budget of the current deadline was spent
+        """
+        # backends that cannot stream read the content first
+        response = self.get(uri)
+        length = 0
+        if response.status_code == 200:
+            file.write(response.content)
+            length = len(response.content)
+        return Response(uri, response.status_code, None, response.headers, response.encoding, response.http_version,
+                        length=length)
+
+    def close(self):
+        pass
+
+    def set_timeouts(self, connect_timeout, read_timeout):
+        """
+        Set the timeouts of requests.
+        :param connect_timeout: seconds to wait for a connection, None to wait forever
+        :param read_timeout: seconds to wait for the next bytes of a response, None to wait forever
+        :return: None
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+    def __timeouts__(self):
+        """
+        The timeouts of a request made now by the current thread.
+        :return: tuple of the current deadline or None, the connect timeout and the read timeout
+        :raises des.deadline.DeadlineExceeded: if the budget of the current deadline was spent
+        """
+        deadline = des.deadline.current()
+        if deadline is None:
+            return None, self.connect_timeout, self.read_timeout
+        deadline.check()
+        return deadline, deadline.timeout(self.connect_timeout), deadline.timeout(self.read_timeout)
+
+    def __timed_out__(self, uri, deadline, err):
+        """
+        :return: the FetchTimeout for a request that timed out
+        :raises des.deadline.DeadlineExceeded: if the request timed out because the budget of deadline was spent
+        """
+        if deadline is not None:
+            deadline.check()
+        return FetchTimeout("Timed out: %s (%s)" % (uri, str(err) or err.__class__.__name__))
+
+
+class RequestsBackend(FetchBackend):
+    """
+    Fetches with requests: HTTP/1.1, one request per connection at a time. Compressed responses are decoded while
+    they are read. Each thread has a session of its own, which keeps its connections open between requests.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # the sessions of all threads, closed by close()
+        self.sessions = []
+
+    def __session__(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def get(self, uri):
+        return self.__get__(uri)
+
+    def get_to_file(self, uri, file):
+        return self.__get__(uri, file)
+
+    def __get__(self, uri, file=None):
+        # reads the content or, if file is given, writes it to file
+        deadline, connect_timeout, read_timeout = self.__timeouts__()
+        try:
+            response = self.__session__().get(uri, headers={"Accept-Encoding": ACCEPT_ENCODING},
+                                              timeout=(connect_timeout, read_timeout), stream=True)
+            with response:
+                if file is None:
+                    content = b"".join(self.__chunks__(response, deadline))
+                    return Response(uri, response.status_code, content, response.headers, response.encoding)
+                length = 0
+                if response.status_code == 200:
+                    for chunk in self.__chunks__(response, deadline):
+                        file.write(chunk)
+                        length += len(chunk)
+                return Response(uri, response.status_code, None, response.headers, response.encoding, length=length)
+        except requests.exceptions.Timeout as err:
+            raise self.__timed_out__(uri, deadline, err) from err
+        except requests.exceptions.ConnectionError as err:
+            # a read timeout while reading the body comes as a ConnectionError
+            if len(err.args) > 0 and isinstance(err.args[0], urllib3.exceptions.ReadTimeoutError):
+                raise self.__timed_out__(uri, deadline, err) from err
+            raise FetchError(str(err)) from err
+        except (requests.exceptions.ContentDecodingError, requests.exceptions.ChunkedEncodingError) as err:
+            # a body that does not decode, or a chunked body cut short
+            raise FetchError(str(err)) from err
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+        self.local = threading.local()
+
+    def __chunks__(self, response, deadline):
+        # the read timeout applies to each chunk; the deadline to the response as a whole
+        for chunk in response.iter_content(CHUNK_SIZE):
+            yield chunk
+            if deadline is not None:
+                deadline.check()
+
+
+class AsyncBackend(FetchBackend):
+    """
+    Fetches with httpx on an asyncio event loop that runs in a daemon thread. Requests of all worker threads are
+    multiplexed over a few connections: HTTP/2 is negotiated with hosts that support it, so one connection per host
+    carries many concurrent requests.
+
+    Needs httpx with HTTP/2 support: pip install httpx[http2]
+    """
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, prior_knowledge=False):
+        """
+        Initialize an AsyncBackend.
+        :param max_connections: the maximum number of connections
+        :param prior_knowledge: True to talk HTTP/2 to hosts without negotiation, also over plain http
+        :return: None
+        """
+        try:
+            import httpx
+        except ImportError as err:
+            raise ImportError("%s needs httpx: pip install httpx[http2]" % self.__class__.__name__) from err
+        self.httpx = httpx
+        self.logger = logging.getLogger(__name__)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="fetch")
+        self.thread.daemon = True
+        self.thread.start()
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.client = self.__run__(self.__open__(limits, prior_knowledge))
+
+    async def __open__(self, limits, prior_knowledge):
+        # timeouts are given with each request
+        return self.httpx.AsyncClient(http1=not prior_knowledge, http2=True, limits=limits, timeout=None,
+                                      follow_redirects=True)
+
+    def __run__(self, coroutine):
+        # run coroutine on the event loop and wait for its result
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def get(self, uri):
+        return self.__get__(uri)
+
+    def get_to_file(self, uri, file):
+        # the content is written in the default executor of the event loop, the loop goes on with other requests
+        return self.__get__(uri, file)
+
+    def __get__(self, uri, file=None):
+        # the deadline belongs to the calling thread, not to the thread of the event loop
+        deadline, connect_timeout, read_timeout = self.__timeouts__()
+        timeout = self.httpx.Timeout(None, connect=connect_timeout, read=read_timeout)
+        return self.__run__(self.__within__(uri, deadline, self.__request__(uri, timeout, file)))
+
+    async def __within__(self, uri, deadline, request):
+        try:
+            if deadline is None or deadline.remaining() is None:
+                return await request
+            return await asyncio.wait_for(request, max(deadline.remaining(), 0.0))
+        except (asyncio.TimeoutError, self.httpx.TimeoutException) as err:
+            raise self.__timed_out__(uri, deadline, err) from err
+        except self.httpx.HTTPError as err:
+            # transport errors, bodies that do not decode, too many redirects
+            raise FetchError(str(err)) from err
+
+    async def __request__(self, uri, timeout, file):
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        if file is None:
+            response = await self.client.get(uri, headers=headers, timeout=timeout)
+            return Response(uri, response.status_code, response.content, response.headers,
+                            response.charset_encoding, response.http_version)
+        async with self.client.stream("GET", uri, headers=headers, timeout=timeout) as response:
+            length = 0
+            if response.status_code == 200:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    await self.loop.run_in_executor(None, file.write, chunk)
+                    length += len(chunk)
+            return Response(uri, response.status_code, None, response.headers, response.charset_encoding,
+                            response.http_version, length=length)
+
+    def close(self):
+        if self.loop.is_running():
+            self.__run__(self.client.aclose())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Write-ahead journal of the synchronisation of a resource list. Each resource that has been written and verified, or
+of which the checksum at the destination has been found equal to the one in the resource list, is appended to the
+journal of the resource list as soon as that is done. When a synchronisation completes its journal is removed.
+
+A journal that is still there when a synchronisation starts is left by an earlier one that was interrupted. The
+resources in it are known to be right at the destination, as long as the resource list still says the same about
+them, so their checksums need not be computed again.
+
+A journal is a text file with a line per resource: uri, timestamp, length, md5 and sha-256, separated by tabs.
+Lines are flushed right away, and synced to disk every SYNC_INTERVAL lines; a line that was not written completely
+before a crash is ignored.
+"""
+
+import hashlib, logging, os, threading
+
+import des.columns
+from des.config import Config
+
+# The default directory of journals.
+JOURNAL_DIR = "resydes-journal"
+# Lines written between syncs to disk.
+SYNC_INTERVAL = 1000
+
+SEPARATOR = "\t"
+
+
+def journal_filename(uri, directory=None):
+    """
+    :param uri: the uri of a resource list
+    :param directory: the directory of journals (default = the configuration parameter "journal_dir")
+    :return: the filename of the journal of uri
+    """
+    if directory is None:
+        directory = Config().prop(Config.key_journal_dir, JOURNAL_DIR)
+    return os.path.join(directory, hashlib.sha1(uri.encode("utf-8")).hexdigest() + ".journal")
+
+
+class Journal(object):
+    """
+    The journal of the synchronisation of one resource list. Several threads may record in it.
+
+        with des.journal.Journal(uri) as journal:
+            ...
+            if not journal.done(entry):
+                ...
+                journal.record(entry)
+            ...
+            journal.remove()
+
+    """
+
+    def __init__(self, uri, directory=None):
+        """
+        Initialize a Journal and open it, reading what an interrupted synchronisation left in it.
+        :param uri: the uri of the resource list
+        :param directory: the directory of journals (default = the configuration parameter "journal_dir")
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.uri = uri
+        self.filename = journal_filename(uri, directory)
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        # resources recorded before, the last record of a uri counts
+        self.recorded = des.columns.ResourceColumns()
+        torn = False
+        if os.path.isfile(self.filename):
+            torn = self.__load__()
+            self.recorded.prune_dupes()
+            self.logger.info("Resuming synchronisation of %s: %d resources in journal %s"
+                             % (uri, len(self.recorded), self.filename))
+        dirname = os.path.dirname(self.filename)
+        if dirname != "":
+            os.makedirs(dirname, exist_ok=True)
+        self.file = open(self.filename, "a", encoding="utf-8")
+        if torn:
+            # end the incomplete line, so that the next one stands on its own
+            self.file.write("\n")
+
+    def __load__(self):
+        # returns True if the last line is incomplete
+        line = "\n"
+        with open(self.filename, "r", encoding="utf-8", errors="replace") as file:
+            for line in file:
+                fields = line.split(SEPARATOR)
+                if not line.endswith("\n") or len(fields) != 5:
+                    self.logger.warn("Ignoring incomplete line in journal %s" % self.filename)
+                    continue
+                uri, timestamp, length, md5, sha256 = (field.strip() for field in fields)
+                try:
+                    self.recorded.append(uri, float(timestamp) if timestamp else None,
+                                         int(length) if length else None, md5 or None, sha256=sha256 or None)
+                except ValueError:
+                    self.logger.warn("Ignoring invalid line in journal %s" % self.filename)
+        return not line.endswith("\n")
+
+    def __len__(self):
+        return len(self.recorded)
+
+    def done(self, entry):
+        """
+        :param entry: des.compare.Entry of a resource in the resource list
+        :return: True if the resource was recorded, with the same attributes, by an earlier synchronisation
+        """
+        index = self.recorded.find(entry.uri)
+        return index is not None and self.recorded.entry(index) == entry
+
+    def record(self, entry):
+        """
+        Record that a resource is right at the destination.
+        :param entry: des.compare.Entry of the resource in the resource list
+        :return: None
+        """
+        line = SEPARATOR.join(("" if value is None else str(value)) for value in entry) + "\n"
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= SYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self.unsynced = 0
+
+    def close(self):
+        """
+        Close the journal, keeping it for the next synchronisation.
+        :return: None
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.file = None
+
+    def remove(self):
+        """
+        Close and remove the journal: the synchronisation has completed.
+        :return: None
+        """
+        self.close()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,331 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect, logging, threading, time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from des.config import Config
+
+# The default metrics report file.
+METRICS_REPORT_FILENAME = "metrics.prom"
+
+# Stages of a round.
+STAGE_ROUND = "round"           # one round over all sources
+STAGE_DISCOVER = "discover"     # discovery of the processor for a source url
+STAGE_FETCH = "fetch"           # http get of a sitemap or dump
+STAGE_PARSE = "parse"           # xml parsing of a sitemap
+STAGE_MAP = "map"               # resolution of the destination in DestinationMap
+STAGE_SYNC = "sync"             # synchronization of a resource list or change list, including the stages below
+STAGE_WRITE = "write"           # http get of a resource and writing it to disk
+
+# Metric names.
+STAGE_SECONDS = "resydes_stage_seconds"
+FETCH_BYTES = "resydes_fetch_bytes_total"
+FETCH_RESPONSES = "resydes_fetch_responses_total"
+RESOURCES_COMPARED = "resydes_resources_compared_total"
+RESOURCES_WRITTEN = "resydes_resources_written_total"
+RESOURCES_VERIFIED = "resydes_resources_verified_total"
+ROUNDS = "resydes_rounds_total"
+ROUND_SOURCES = "resydes_round_sources"
+ROUND_STARTED = "resydes_round_started_timestamp_seconds"
+SOURCES_PROCESSED = "resydes_sources_processed_total"
+SOURCE_LAST_SUCCESS = "resydes_source_last_success_timestamp_seconds"
+CHANGES_OBSERVED = "resydes_changes_observed_total"
+FETCHES_SAVED = "resydes_fetches_saved_total"
+TASKS = "resydes_tasks_total"
+TASKS_STOLEN = "resydes_tasks_stolen_total"
+
+HELP = {
+    STAGE_SECONDS: "Time spent per stage in seconds.",
+    FETCH_BYTES: "Bytes received.",
+    FETCH_RESPONSES: "Http responses received, by status.",
+    RESOURCES_COMPARED: "Resources compared between source and destination.",
+    RESOURCES_WRITTEN: "Resources created, updated or deleted at the destination.",
+    RESOURCES_VERIFIED: "Resources at the destination of which the checksum was compared with the source.",
+    ROUNDS: "Rounds completed.",
+    ROUND_SOURCES: "Source urls in the current round, by state.",
+    ROUND_STARTED: "Start of the current round.",
+    SOURCES_PROCESSED: "Source urls processed, by outcome.",
+    SOURCE_LAST_SUCCESS: "Last time a source url was processed without exceptions.",
+    CHANGES_OBSERVED: "Changes seen at sources: new change list entries, differences found in audits and child "
+                      "documents with a new md:at or md:completed.",
+    FETCHES_SAVED: "Created and updated change list entries not fetched because a later change to the same "
+                   "resource supersedes them.",
+    TASKS: "Tasks run, by kind.",
+    TASKS_STOLEN: "Tasks taken by a worker from the queue of another worker.",
+}
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_instance = None
+_lock = threading.Lock()
+
+
+def instance():
+    """
+    Get the metrics collected by this process.
+    :return: an instance of Metrics
+    """
+    global _instance
+    with _lock:
+        if _instance is None:
+            _instance = Metrics()
+
+    return _instance
+
+
+def reset_instance():
+    """
+    Reset the _instance variable: next time an instance is requested it will start with no metrics.
+    :return: None
+    """
+    global _instance
+    with _lock:
+        _instance = None
+
+
+def host_of(uri):
+    """
+    :param uri: a uri
+    :return: the network location of uri
+    """
+    return urlparse(uri).netloc
+
+
+class Histogram(object):
+    """
+    Counts observations in cumulative buckets, the way Prometheus histograms do.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        :return: list of (upper bound, cumulative count), the last upper bound being float("inf")
+        """
+        result = []
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics(object):
+    """
+    Counters, gauges and histograms, labeled by stage, source and host. Values accumulate over the lifetime of the
+    process. The source label is taken from the source url that is being processed by the current thread (see
+    set_source).
+    Metrics can be exported in the Prometheus text format at any moment, also while a round is running.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        # name -> {labels -> value}, labels being a sorted tuple of (key, value)
+        self.counters = dict()
+        # name -> {labels -> value}
+        self.gauges = dict()
+        # name -> {labels -> Histogram}
+        self.histograms = dict()
+        self.local = threading.local()
+
+    def set_source(self, source):
+        """
+        Set the source url processed by the current thread. Subsequent metrics of this thread are labeled with it.
+        :param source: the source url or None
+        :return: None
+        """
+        self.local.source = source
+
+    def get_source(self):
+        return getattr(self.local, "source", None)
+
+    def __labels__(self, labels):
+        if "source" not in labels:
+            labels["source"] = self.get_source() or ""
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increase the counter name.
+        :param name: the name of the counter
+        :param value: amount to increase with (default = 1)
+        :param labels: labels of the counter
+        :return: None
+        """
+        key = self.__labels__(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, dict())
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """
+        Set the gauge name.
+        :param name: the name of the gauge
+        :param value: the value
+        :param labels: labels of the gauge
+        :return: None
+        """
+        key = self.__labels__(labels)
+        with self.lock:
+            self.gauges.setdefault(name, dict())[key] = value
+
+    def observe(self, name, value, **labels):
+        """
+        Add an observation to the histogram name.
+        :param name: the name of the histogram
+        :param value: the observed value
+        :param labels: labels of the histogram
+        :return: None
+        """
+        key = self.__labels__(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, dict())
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, stage, uri=None, **labels):
+        """
+        Time the enclosed block and add the duration in seconds to the histogram of stage:
+
+            with des.metrics.instance().timer(des.metrics.STAGE_FETCH, uri):
+                ...
+
+        :param stage: the stage
+        :param uri: the uri that is worked on, used for the host label
+        :param labels: additional labels
+        :return: a context manager
+        """
+        labels["stage"] = stage
+        labels["host"] = host_of(uri) if uri is not None else ""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(STAGE_SECONDS, time.perf_counter() - start, **labels)
+
+    def fetched(self, uri, status, size):
+        """
+        Count an http response.
+        :param uri: the uri fetched
+        :param status: the status code of the response
+        :param size: the number of bytes received
+        :return: None
+        """
+        host = host_of(uri)
+        self.inc(FETCH_RESPONSES, host=host, status=status)
+        self.inc(FETCH_BYTES, size, host=host)
+
+    def get(self, name, **labels):
+        """
+        :param name: the name of a counter
+        :param labels: labels of the counter
+        :return: the value of the counter or 0 if it was never increased
+        """
+        key = self.__labels__(labels)
+        with self.lock:
+            return self.counters.get(name, dict()).get(key, 0)
+
+    def total(self, name, **labels):
+        """
+        :param name: the name of a counter
+        :param labels: labels the series must have, the source label is not implied
+        :return: the sum of the series of the counter that have the given labels
+        """
+        match = set((key, str(value)) for key, value in labels.items())
+        with self.lock:
+            return sum(value for key, value in self.counters.get(name, dict()).items() if match.issubset(key))
+
+    def get_gauge(self, name, **labels):
+        """
+        :param name: the name of a gauge
+        :param labels: labels of the gauge
+        :return: the value of the gauge or None if it was never set
+        """
+        key = self.__labels__(labels)
+        with self.lock:
+            return self.gauges.get(name, dict()).get(key)
+
+    def get_histogram(self, name, **labels):
+        """
+        :param name: the name of a histogram
+        :param labels: labels of the histogram
+        :return: the Histogram or None if there were no observations
+        """
+        key = self.__labels__(labels)
+        with self.lock:
+            return self.histograms.get(name, dict()).get(key)
+
+    def to_text(self):
+        """
+        Export all metrics in the Prometheus text exposition format.
+        :return: the metrics as string
+        """
+        lines = []
+        with self.lock:
+            for name in sorted(self.counters):
+                lines.extend(self.__head__(name, "counter"))
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+            for name in sorted(self.gauges):
+                lines.extend(self.__head__(name, "gauge"))
+                for labels, value in sorted(self.gauges[name].items()):
+                    lines.append("%s%s %s" % (name, format_labels(labels), format_value(value)))
+            for name in sorted(self.histograms):
+                lines.extend(self.__head__(name, "histogram"))
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    for bound, count in histogram.cumulative_counts():
+                        lines.append("%s_bucket%s %d" % (name, format_labels(labels + (("le", format_value(bound)),)),
+                                                        count))
+                    lines.append("%s_sum%s %s" % (name, format_labels(labels), format_value(histogram.sum)))
+                    lines.append("%s_count%s %d" % (name, format_labels(labels), histogram.count))
+        return "\n".join(lines) + "\n"
+
+    def to_file(self, filename=None):
+        """
+        Write all metrics to file in the Prometheus text exposition format.
+        :param filename: the file to write to (default = configuration parameter "metrics_report_file")
+        :return: None
+        """
+        if filename is None:
+            filename = Config().prop(Config.key_metrics_report_file, METRICS_REPORT_FILENAME)
+        with open(filename, "w") as file:
+            file.write(self.to_text())
+        self.logger.info("Wrote metrics to %s" % filename)
+
+    @staticmethod
+    def __head__(name, kind):
+        head = []
+        if name in HELP:
+            head.append("# HELP %s %s" % (name, HELP[name]))
+        head.append("# TYPE %s %s" % (name, kind))
+        return head
+
+
+def format_labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, escape(value)) for key, value in labels)
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json, logging, os, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import des.metrics
+
+_instance = None
+_lock = threading.Lock()
+
+
+def instance():
+    """
+    Get the Monitor that follows the progress of the DesRunner in this process.
+    :return: an instance of Monitor
+    """
+    global _instance
+    with _lock:
+        if _instance is None:
+            _instance = Monitor()
+
+    return _instance
+
+
+def reset_instance():
+    """
+    Reset the _instance variable: next time an instance is requested it will be constructed anew.
+    :return: None
+    """
+    global _instance
+    with _lock:
+        _instance = None
+
+
+class Monitor(object):
+    """
+    Follows the progress of rounds and the outcome per source url. Progress is kept as gauges and counters in
+    des.metrics, so it is part of the metrics report, and as a status that can be served as json.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.round = 0
+        self.round_started = None
+        self.last_round_seconds = None
+        self.sources_total = 0
+        self.sources_done = 0
+        self.current_sources = []
+        # source url -> dict with last_success, last_failure, successes and failures
+        self.sources = dict()
+
+    def start_round(self, sources_total):
+        """
+        Register the start of a round.
+        :param sources_total: the number of source urls in the round
+        :return: None
+        """
+        with self.lock:
+            self.round += 1
+            self.round_started = time.time()
+            self.sources_total = sources_total
+            self.sources_done = 0
+        metrics = des.metrics.instance()
+        metrics.set_gauge(des.metrics.ROUND_STARTED, self.round_started, source="")
+        self.__set_round_gauges__()
+
+    def end_round(self):
+        """
+        Register the end of a round.
+        :return: None
+        """
+        with self.lock:
+            if self.round_started is not None:
+                self.last_round_seconds = time.time() - self.round_started
+
+    def start_source(self, uri):
+        """
+        Register the start of processing a source url.
+        :param uri: the source url
+        :return: None
+        """
+        with self.lock:
+            self.current_sources.append(uri)
+
+    def end_source(self, uri, success):
+        """
+        Register the end of processing a source url.
+        :param uri: the source url
+        :param success: True if the source url was processed without exceptions, False otherwise
+        :return: None
+        """
+        now = time.time()
+        with self.lock:
+            if uri in self.current_sources:
+                self.current_sources.remove(uri)
+            self.sources_done += 1
+            state = self.sources.setdefault(uri, {"last_success": None, "last_failure": None,
+                                                  "successes": 0, "failures": 0})
+            if success:
+                state["last_success"] = now
+                state["successes"] += 1
+            else:
+                state["last_failure"] = now
+                state["failures"] += 1
+        metrics = des.metrics.instance()
+        metrics.inc(des.metrics.SOURCES_PROCESSED, source=uri, outcome="success" if success else "failure")
+        if success:
+            metrics.set_gauge(des.metrics.SOURCE_LAST_SUCCESS, now, source=uri)
+        self.__set_round_gauges__()
+
+    def __set_round_gauges__(self):
+        metrics = des.metrics.instance()
+        with self.lock:
+            done, total = self.sources_done, self.sources_total
+        metrics.set_gauge(des.metrics.ROUND_SOURCES, total, source="", state="total")
+        metrics.set_gauge(des.metrics.ROUND_SOURCES, done, source="", state="done")
+        metrics.set_gauge(des.metrics.ROUND_SOURCES, total - done, source="", state="queued")
+
+    def status(self):
+        """
+        :return: the status of this process as a dict
+        """
+        metrics = des.metrics.instance()
+        written = metrics.total(des.metrics.RESOURCES_WRITTEN)
+        fetched = metrics.total(des.metrics.FETCH_RESPONSES)
+        failed = fetched - metrics.total(des.metrics.FETCH_RESPONSES, status=200)
+        with self.lock:
+            uptime = time.time() - self.started
+            return {
+                "pid": os.getpid(),
+                "uptime": uptime,
+                "round": self.round,
+                "round_started": self.round_started,
+                "last_round_seconds": self.last_round_seconds,
+                "sources_total": self.sources_total,
+                "sources_done": self.sources_done,
+                "sources_queued": self.sources_total - self.sources_done,
+                "current_sources": list(self.current_sources),
+                "resources_written_per_second": written / uptime if uptime > 0 else 0.0,
+                "fetch_error_rate": failed / fetched if fetched > 0 else 0.0,
+                "sources": {uri: dict(state) for uri, state in self.sources.items()},
+            }
+
+
+class MonitorServer(object):
+    """
+    Embedded http server that serves metrics in the Prometheus text format at '/metrics' and the status of the
+    Monitor as json at '/status'. The server runs in a daemon thread.
+    """
+
+    def __init__(self, host="localhost", port=0):
+        """
+        Initialize a MonitorServer.
+        :param host: the interface to listen on
+        :param port: the port to listen on (0 = any free port)
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def start(self):
+        """
+        Start serving.
+        :return: None
+        """
+        self.server = ThreadingHTTPServer((self.host, self.port), MonitorRequestHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever, name="monitor")
+        thread.daemon = True
+        thread.start()
+        self.logger.info("Serving metrics and status at http://%s:%d/" % (self.host, self.port))
+
+    def stop(self):
+        """
+        Stop serving.
+        :return: None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class MonitorRequestHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            self.__send__(des.metrics.instance().to_text(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/status":
+            self.__send__(json.dumps(instance().status(), indent=2), "application/json")
+        else:
+            self.send_error(404, "Try /metrics or /status")
+
+    def __send__(self, text, content_type):
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
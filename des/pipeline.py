@@ -0,0 +1,202 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A pipeline of stages that run at the same time, each in threads of its own, connected by bounded queues. A stage
+that produces faster than the next one consumes blocks when the queue in between is full, so no stage runs far
+ahead of the others and memory stays bounded.
+
+The threads of a pipeline work under the des.deadline, and with the des.reporter and des.metrics source, of the
+thread that runs it.
+"""
+
+import logging, queue, threading
+
+import des.deadline
+import des.metrics
+import des.reporter
+
+# Items in the queue before a stage, unless the stage is given another size.
+DEFAULT_QUEUE_SIZE = 1000
+# Seconds a blocked put or get waits before looking whether the pipeline has been cancelled.
+POLL_INTERVAL = 0.1
+
+# Marks the end of the items for one worker of a stage.
+_END = object()
+
+
+class PipelineCancelled(Exception):
+    """
+    Another stage of the pipeline failed.
+    """
+    pass
+
+
+class Stage(object):
+
+    def __init__(self, name, function, workers, stream, queue_size, partition):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.stream = stream
+        self.partition = partition
+        # a partitioned stage has a queue for each worker, other stages one queue for all workers
+        self.inputs = [queue.Queue(maxsize=queue_size) for worker in range(workers if partition else 1)]
+        self.running = workers
+        self.count = 0
+
+    def input_of(self, worker):
+        return self.inputs[worker if self.partition else 0]
+
+
+class Pipeline(object):
+    """
+    Stages connected by bounded queues. A stage is either a function of one item that returns an iterable of the
+    items for the next stage (or None), run by one or more workers; or, with stream=True, a function of an iterator
+    over all its items that yields the items for the next stage, run by one worker. Items that come out of the last
+    stage are dropped.
+
+    The workers of a stage take items in the order they come in, but may finish them in any order. A partitioned
+    stage gives each item to the worker chosen by a key of the item: items with the same key are handled by the same
+    worker, one after the other, in the order they come in.
+
+    If a stage raises an exception, the pipeline is cancelled: all stages stop and run() raises the exception.
+    """
+
+    def __init__(self, name, queue_size=DEFAULT_QUEUE_SIZE):
+        """
+        Initialize a Pipeline.
+        :param name: the name of the pipeline, i.e. the uri of the resource list it synchronizes
+        :param queue_size: the default number of items in the queue before a stage
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.queue_size = queue_size
+        self.stages = []
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.error = None
+
+    def add_stage(self, name, function, workers=1, stream=False, queue_size=None, partition=None):
+        """
+        Add a stage after the stages added before.
+        :param name: the name of the stage
+        :param function: the function of the stage
+        :param workers: the number of threads that run function (ignored if stream)
+        :param stream: True if function takes an iterator over all items of the stage
+        :param queue_size: the number of items in the queue before this stage, or before each worker of a partitioned
+                stage (default = the size of the pipeline)
+        :param partition: function of an item that gives a non-negative int key, or None if any worker may take
+                any item
+        :return: the Pipeline
+        """
+        workers = 1 if stream else max(1, workers)
+        self.stages.append(Stage(name, function, workers, stream,
+                                 self.queue_size if queue_size is None else queue_size, partition))
+        return self
+
+    def run(self, items):
+        """
+        Feed items to the first stage and wait until all stages have finished.
+        :param items: iterable of items, iterated in a thread of its own; may be a generator that does work of its own
+        :return: dict of stage name -> number of items taken in by the stage
+        :raises Exception: the first exception raised in a stage or while iterating items
+        """
+        deadline = des.deadline.current()
+        source = des.metrics.instance().get_source(), des.reporter.instance().get_source()
+        threads = [threading.Thread(target=self.__work__, args=(self.__feed__, items, deadline, source),
+                                    name="%s-feed" % self.name, daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(target=self.__work__,
+                                                args=(self.__serve__, (index, worker), deadline, source),
+                                                name="%s-%s-%d" % (self.name, stage.name, worker), daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        counts = dict((stage.name, stage.count) for stage in self.stages)
+        self.logger.debug("Pipeline %s done: %s" % (self.name, counts))
+        return counts
+
+    def __work__(self, target, argument, deadline, source):
+        des.metrics.instance().set_source(source[0])
+        des.reporter.instance().set_source(source[1])
+        try:
+            with des.deadline.scope(deadline):
+                target(argument)
+        except PipelineCancelled:
+            pass
+        except BaseException as err:
+            with self.lock:
+                if self.error is None:
+                    self.error = err
+            self.cancelled.set()
+
+    def __feed__(self, items):
+        for item in items:
+            self.__put__(0, item)
+        self.__end__(0)
+
+    def __serve__(self, index_and_worker):
+        index, worker = index_and_worker
+        stage = self.stages[index]
+        if stage.stream:
+            self.__put_all__(index + 1, stage.function(self.__take__(stage, worker)))
+        else:
+            for item in self.__take__(stage, worker):
+                self.__put_all__(index + 1, stage.function(item))
+        with self.lock:
+            stage.running -= 1
+            last = stage.running == 0
+        # the last worker of a stage to finish ends the next stage
+        if last:
+            self.__end__(index + 1)
+
+    def __take__(self, stage, worker):
+        while True:
+            item = self.__get__(stage.input_of(worker))
+            if item is _END:
+                return
+            with self.lock:
+                stage.count += 1
+            yield item
+
+    def __put_all__(self, index, items):
+        if items is None:
+            return
+        for item in items:
+            self.__put__(index, item)
+
+    def __end__(self, index):
+        if index < len(self.stages):
+            for worker in range(self.stages[index].workers):
+                self.__put__(index, _END, worker)
+
+    def __put__(self, index, item, worker=None):
+        if index >= len(self.stages):
+            return
+        stage = self.stages[index]
+        if worker is None and stage.partition is not None:
+            worker = stage.partition(item) % stage.workers
+        target = stage.input_of(worker)
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                target.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def __get__(self, source):
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                return source.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
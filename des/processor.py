@@ -7,22 +7,31 @@ import urllib.parse
 import xml
 import xml.etree.ElementTree as ET
 
-import requests
-
+import des.columns
+import des.deadline
 import des.desclient
+import des.fetch
+import des.metrics
 import des.reporter
+import des.state
+import des.taskqueue
+import des.visited
 import resync
 import resync.w3c_datetime as w3c
+from des.config import Config
 from des.status import Status
 from des.sync import Relisync, Chanlisync
 from des.dump import Redump
-from resync.sitemap import Sitemap
-from resync.client_state import ClientState
+from resync.sitemap import Sitemap, SitemapParseError, SITEMAP_NS, RS_NS
 
 WELLKNOWN_RESOURCE = ".well-known/resourcesync"
 
 SITEMAP_ROOT = "{http://www.sitemaps.org/schemas/sitemap/0.9}urlset"
 SITEMAP_INDEX_ROOT = "{http://www.sitemaps.org/schemas/sitemap/0.9}sitemapindex"
+URL_TAG = "{%s}url" % SITEMAP_NS
+SITEMAP_TAG = "{%s}sitemap" % SITEMAP_NS
+MD_TAG = "{%s}md" % RS_NS
+LN_TAG = "{%s}ln" % RS_NS
 
 CAPA_DESCRIPTION = "description"
 CAPA_CAPABILITYLIST = "capabilitylist"
@@ -32,6 +41,18 @@ CAPA_CHANGELIST = "changelist"
 CAPA_CHANGEDUMP = "changedump"
 
 
+def freshness(resource):
+    """
+    Get the moment the document denoted by resource was last changed according to its parent document.
+    :param resource: resource in a parent document pointing to a child document
+    :return: timestamp of md:completed, md:at or lastmod, whichever comes first, or None if not given
+    """
+    for value in (resource.md_completed, resource.md_at):
+        if value is not None:
+            return w3c.str_to_datetime(value)
+    return resource.timestamp
+
+
 class ProcessorListener(object):
 
     def event_sitemap_received(self, uri, capability, text):
@@ -45,6 +66,9 @@ class Processor(object):
     Reads a sitemap from a uri and turns it into a resync.resource_container.ResourceContainer
     """
 
+    # True if the child documents of the source document must be processed in order by one worker.
+    serial = False
+
     def __init__(self, source_uri, expected_capability, report_errors=True):
         """
         Initialize this class.
@@ -57,6 +81,8 @@ class Processor(object):
         self.source_uri = source_uri
         self.capability = expected_capability
         self.report_errors = report_errors
+        # the processor of the document that points to the source document
+        self.parent = None
 
         self.source_status = None
         self.exceptions = []
@@ -70,35 +96,39 @@ class Processor(object):
         Read the source_uri and parse it to source_document.
         :return: True if the document was downloaded and parsed without exceptions, False otherwise.
         """
-        session = requests.Session()
+        metrics = des.metrics.instance()
         try:
-            response = session.get(self.source_uri)
+            with metrics.timer(des.metrics.STAGE_FETCH, self.source_uri):
+                response = des.fetch.instance().get(self.source_uri)
+                content = response.content
             self.source_status = response.status_code
+            metrics.fetched(self.source_uri, self.source_status, len(content))
             self.logger.debug("Read %s, status %s" % (self.source_uri, str(self.source_status)))
             assert self.source_status == 200, "Invalid response status: %d" % self.source_status
 
-            text = response.text
-
-            root = ET.fromstring(text)
-            self.is_index = root.tag == SITEMAP_INDEX_ROOT
-
-            etree = ET.ElementTree(root)
-            sitemap = Sitemap()
-            self.source_document = sitemap.parse_xml(etree=etree)
-            # the source_document is a resync.resource_container.ResourceContainer
+            with metrics.timer(des.metrics.STAGE_PARSE, self.source_uri):
+                self.source_document = self.__parse__(response)
+            # the source_document is a resync.resource_container.ResourceContainer, kept in columns
             capability = self.source_document.capability
             assert capability == self.capability, \
                 "Capability is not %s but %s" % (self.capability, capability)
             # anyone interested in sitemaps?
-            for processor_listener in processor_listeners:
-                processor_listener.event_sitemap_received(self.source_uri, capability, text)
+            if len(processor_listeners) > 0:
+                text = response.text
+                for processor_listener in processor_listeners:
+                    processor_listener.event_sitemap_received(self.source_uri, capability, text)
 
             self.describedby_url = self.source_document.describedby
             self.up_url = self.source_document.up # to a parent non-index document
             self.index_url = self.source_document.index # to a parent index document
             self.status = Status.document
 
-        except requests.exceptions.ConnectionError as err:
+        except (des.deadline.DeadlineExceeded, des.fetch.FetchTimeout) as err:
+            self.logger.info("%s Timed out: %s" % (self.source_uri, str(err)))
+            self.status = Status.timed_out
+            self.__report__(err)
+
+        except des.fetch.FetchError as err:
             self.logger.debug("%s No connection: %s" % (self.source_uri, str(err)))
             self.status = Status.read_error
             self.__report__(err)
@@ -118,11 +148,50 @@ class Processor(object):
             self.status = Status.read_error
             self.__report__(err)
 
-        finally:
-            session.close()
-
         return self.status == Status.document
 
+    def __parse__(self, response):
+        # parse the sitemap or sitemapindex element by element into columns, without building the document tree
+        sitemap = Sitemap()
+        resources = des.columns.ResourceColumns()
+        resource_tag = None
+        in_preamble = True
+        seen_md = False
+        depth = 0
+        try:
+            for event, element in ET.iterparse(response.open_document(), events=("start", "end")):
+                if event == "start":
+                    if depth == 0:
+                        if element.tag not in (SITEMAP_ROOT, SITEMAP_INDEX_ROOT):
+                            raise SitemapParseError("XML is not sitemap or sitemapindex (root element is <%s>)"
+                                                    % element.tag)
+                        self.is_index = element.tag == SITEMAP_INDEX_ROOT
+                        resource_tag = SITEMAP_TAG if self.is_index else URL_TAG
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 1:
+                    # the children of the root are handled and cleared when they end
+                    continue
+                if element.tag == resource_tag:
+                    in_preamble = False
+                    resources.add(sitemap.resource_from_etree(element, sitemap.resource_class))
+                elif element.tag == MD_TAG:
+                    if not in_preamble:
+                        raise SitemapParseError("Found <rs:md> after first <url> in sitemap")
+                    if seen_md:
+                        raise SitemapParseError("Multiple <rs:md> at top level of sitemap")
+                    resources.md = sitemap.md_from_etree(element, "preamble")
+                    seen_md = True
+                elif element.tag == LN_TAG:
+                    if not in_preamble:
+                        raise SitemapParseError("Found <rs:ln> after first <url> in sitemap")
+                    resources.ln.append(sitemap.ln_from_etree(element, "preamble"))
+                element.clear()
+        except (OSError, EOFError) as err:
+            raise des.fetch.FetchError("Can't decompress %s (%s)" % (self.source_uri, str(err))) from err
+        return resources
+
     def __report__(self, err):
         if self.report_errors:
             self.exceptions.append(err)
@@ -139,6 +208,105 @@ class Processor(object):
         """
         raise NotImplementedError
 
+    def process_once(self, on_processed=None):
+        """
+        Process the source document, unless it was visited before in this round. A source document that is visited
+        while one of the documents that lead to it is being processed refers to itself: this is reported as an
+        exception. A source document that is visited while another document that points to it is processing it, or
+        after it was processed, is a duplicate.
+
+        Processing is done by a ProcessorTask. If the current thread runs a task on a des.taskqueue.TaskQueue, the
+        processing may be done by another worker and complete after this method has returned.
+        :param on_processed: function called with this processor when processing has completed (default = None)
+        :return: None
+        """
+        visited = des.visited.instance()
+        visit = visited.enter(self.source_uri)
+        if visit == des.visited.NEW:
+            des.taskqueue.fork(ProcessorTask(self, on_processed))
+            return
+        elif visit == des.visited.IN_PROGRESS and self.__refers_to_itself__():
+            msg = "Cycle detected: %s refers to itself" % self.source_uri
+            self.logger.warn(msg)
+            self.status = Status.duplicate
+            self.exceptions.append(msg)
+            des.reporter.instance().log_status(self.source_uri, exception=msg)
+        else:
+            self.logger.debug("Already processed in this round: %s" % self.source_uri)
+            self.status = Status.duplicate
+            des.reporter.instance().log_status(self.source_uri)
+        if on_processed is not None:
+            on_processed(self)
+
+    def __refers_to_itself__(self):
+        """
+        Is the source document one of the documents that lead to it?
+        :return: True if a parent processor, directly or indirectly, has the same source uri, False otherwise
+        """
+        parent = self.parent
+        while parent is not None:
+            if parent.source_uri == self.source_uri:
+                return True
+            parent = parent.parent
+        return False
+
+    def __finish__(self):
+        """
+        Settle the status after the child documents of the source document have been processed.
+        :return: None
+        """
+        if self.status in (Status.processed, Status.processed_with_exceptions):
+            self.status = Status.processed_with_exceptions if self.has_exceptions() else Status.processed
+
+    def __skip_resource__(self, resource):
+        """
+        Can the child document denoted by resource be skipped? A child document can be skipped if it was processed
+        successfully in an earlier round and it did not change since.
+        :param resource: resource in the source document pointing to a child document
+        :return: True if the child document need not be processed, False otherwise
+        """
+        fresh = freshness(resource)
+        if fresh is None:
+            return False
+        last_processed = des.state.instance().get_state(resource.uri, kind=des.state.FRESHNESS)
+        return last_processed is not None and fresh <= last_processed
+
+    def __process_child__(self, resource, processor):
+        """
+        Let processor process the child document denoted by resource, unless the child document can be skipped.
+        :param resource: resource in the source document pointing to a child document
+        :param processor: the processor for the child document
+        :return: None
+        :raises des.deadline.DeadlineExceeded: if the time budget has been spent
+        """
+        des.deadline.check()
+        if self.__skip_resource__(resource):
+            self.logger.debug("Skipping unchanged %s in %s" % (resource.uri, self.source_uri))
+            des.reporter.instance().log_status(uri=resource.uri, in_sync=True)
+            return
+
+        fresh = freshness(resource)
+        if fresh is not None and des.state.instance().get_state(resource.uri, kind=des.state.FRESHNESS) is not None:
+            # the child document changed since we last processed it
+            des.metrics.instance().inc(des.metrics.CHANGES_OBSERVED)
+
+        processor.parent = self
+        processor.process_once(on_processed=lambda child: self.__child_processed__(resource, fresh, child))
+
+    def __child_processed__(self, resource, fresh, processor):
+        """
+        Called when processor has processed the child document denoted by resource.
+        :param resource: resource in the source document pointing to a child document
+        :param fresh: the freshness of the child document according to the source document
+        :param processor: the processor of the child document
+        :return: None
+        """
+        self.exceptions.extend(processor.exceptions)
+        # An audit does not bring the destination in sync: do not remember it.
+        if fresh is not None and processor.status == Status.processed \
+                and not Config().boolean_prop(Config.key_audit_only, True):
+            des.state.instance().set_state(resource.uri, fresh, kind=des.state.FRESHNESS)
+
     def __assert_document__(self):
         """
         Make sure the source document is loaded and correct.
@@ -186,9 +354,7 @@ class RelayProcessor(Processor):
         for resource in self.source_document.resources:
             capability = resource.capability
             if capability == self.capability: # a index can only point to sitemaps or urlsets with the same capability.
-                processor = self.__get_level_processor__(resource.uri)
-                processor.process_source()
-                self.exceptions.extend(processor.exceptions)
+                self.__process_child__(resource, self.__get_level_processor__(resource.uri))
             else:
                 self.logger.debug("Unexpected capability %s in %s" % (capability, self.source_uri))
                 self.exceptions.append("Unexpected capability %s in %s" % (capability, self.source_uri))
@@ -224,9 +390,7 @@ class Sodesproc(RelayProcessor):
         # the source document is a source description
         for resource in self.source_document.resources:
             # it contains links to capabilitylists
-            capaproc = Capaproc(resource.uri)
-            capaproc.process_source()
-            self.exceptions.extend(capaproc.exceptions)
+            self.__process_child__(resource, Capaproc(resource.uri))
 
 
 class Capaproc(Processor):
@@ -261,8 +425,7 @@ class Capaproc(Processor):
                 self.exceptions.append("Unknown capability %s in %s" % (capability, self.source_uri))
 
             if processor is not None:
-                processor.process_source()
-                self.exceptions.extend(processor.exceptions)
+                self.__process_child__(resource, processor)
 
         self.status = Status.processed_with_exceptions if self.has_exceptions() else Status.processed
 
@@ -279,25 +442,33 @@ class Reliproc(RelayProcessor):
         return Reliproc(uri)
 
     def __process_lower__(self):
-        processor = Relisync(self.source_uri)
-        processor.process_source()
-        self.exceptions.extend(processor.exceptions)
+        des.taskqueue.fork(SyncTask(self, Relisync(self.source_uri)))
 
 
 class Chanliproc(RelayProcessor):
     """
     Chanliproc eats the uri of a change list and processes the contents.
     """
+    # Change lists in a change list index are applied one after the other, in the order of the index.
+    serial = True
+
     def __init__(self, uri):
         super(Chanliproc, self).__init__(uri, CAPA_CHANGELIST)
 
     def __get_level_processor__(self, uri):
         return Chanliproc(uri)
 
+    def __skip_resource__(self, resource):
+        # An archived change list in a changelist index has md:until. If we have seen all changes up to that
+        # datetime, the change list holds nothing new.
+        md_until = w3c.str_to_datetime(resource.md_until)
+        high_water_mark = des.state.instance().get_state(resource.uri)
+        if md_until is not None and high_water_mark is not None and md_until <= high_water_mark:
+            return True
+        return super(Chanliproc, self).__skip_resource__(resource)
+
     def __process_lower__(self):
-        processor = Chanlisync(self.source_uri)
-        processor.process_source()
-        self.exceptions.extend(processor.exceptions)
+        des.taskqueue.fork(SyncTask(self, Chanlisync(self.source_uri)))
 
 
 class Redumpproc(RelayProcessor):
@@ -306,6 +477,8 @@ class Redumpproc(RelayProcessor):
     """
     def __init__(self, uri):
         super(Redumpproc, self).__init__(uri, CAPA_RESOURCEDUMP)
+        # md:at of the source document, once its dumps are being processed
+        self.dumped_at = None
 
     def __get_level_processor__(self, uri):
         return Redumpproc(uri)
@@ -313,13 +486,12 @@ class Redumpproc(RelayProcessor):
     def __process_lower__(self):
         # the source document is a urlset with url/loc's pointing to packaged resources.
         md_at = w3c.str_to_datetime(self.source_document.md_at) # 'must have' at attribute
-        last_synced = ClientState().get_state(self.source_uri)
+        last_synced = des.state.instance().get_state(self.source_uri)
         if last_synced is None or md_at > last_synced:
+            # the dumps are processed by tasks of their own: the state is set when all of them have completed
+            self.dumped_at = md_at
             for resource in self.source_document.resources:
                 self.__process_resource__(resource)
-
-            if len(self.exceptions) == 0:
-                ClientState().set_state(self.source_uri, md_at)
         else:
             self.logger.debug("In sync: %s" % self.source_uri)
             des.reporter.instance().log_status(uri=self.source_uri, in_sync=True)
@@ -327,12 +499,105 @@ class Redumpproc(RelayProcessor):
     def __process_resource__(self, resource):
         # the resource points to a resource dump.
         md_at = w3c.str_to_datetime(resource.md_at) # 'may have' at attribute
-        last_synced = ClientState().get_state(resource.uri)
+        last_synced = des.state.instance().get_state(resource.uri)
         if last_synced is None or md_at is None or md_at > last_synced:
             self.__process_dump__(resource.uri)
         else:
             des.reporter.instance().log_status(uri=resource.uri, in_sync=True)
 
     def __process_dump__(self, uri):
-        redump = Redump(uri)
-        redump.process_dump()
\ No newline at end of file
+        des.taskqueue.fork(DumpTask(self, Redump(uri)))
+
+    def __finish__(self):
+        super(Redumpproc, self).__finish__()
+        if self.dumped_at is not None and not self.has_exceptions():
+            des.state.instance().set_state(self.source_uri, self.dumped_at)
+
+
+class ProcessorTask(des.taskqueue.Task):
+    """
+    Reads the source document of a processor and processes it. Child documents are processed by tasks of their own.
+    """
+
+    kind = des.taskqueue.TASK_FETCH_SITEMAP
+
+    def __init__(self, processor, on_processed=None):
+        super(ProcessorTask, self).__init__()
+        self.processor = processor
+        self.on_processed = on_processed
+        self.serial = processor.serial
+
+    def run(self):
+        self.processor.process_source()
+
+    def failed(self, err):
+        super(ProcessorTask, self).failed(err)
+        self.processor.exceptions.append(err)
+        if isinstance(err, des.deadline.DeadlineExceeded):
+            self.processor.status = Status.timed_out
+
+    def skipped(self, err):
+        super(ProcessorTask, self).skipped(err)
+        self.processor.exceptions.append(err)
+        self.processor.status = Status.timed_out
+
+    def complete(self):
+        self.processor.__finish__()
+        des.visited.instance().leave(self.processor.source_uri)
+        if self.on_processed is not None:
+            self.on_processed(self.processor)
+
+
+class SyncTask(des.taskqueue.Task):
+    """
+    Synchronizes with the resource list or change list of a processor.
+    """
+
+    kind = des.taskqueue.TASK_SYNC_LIST
+
+    def __init__(self, processor, sync):
+        super(SyncTask, self).__init__()
+        self.processor = processor
+        self.sync = sync
+
+    def run(self):
+        self.sync.process_source()
+
+    def failed(self, err):
+        super(SyncTask, self).failed(err)
+        self.sync.exceptions.append(err)
+
+    def skipped(self, err):
+        super(SyncTask, self).skipped(err)
+        self.sync.exceptions.append(err)
+        self.sync.status = Status.timed_out
+
+    def complete(self):
+        self.processor.exceptions.extend(self.sync.exceptions)
+
+
+class DumpTask(des.taskqueue.Task):
+    """
+    Downloads and unpacks a resource dump of a processor.
+    """
+
+    kind = des.taskqueue.TASK_APPLY_DUMP
+
+    def __init__(self, processor, redump):
+        super(DumpTask, self).__init__()
+        self.processor = processor
+        self.redump = redump
+
+    def run(self):
+        self.redump.process_dump()
+
+    def failed(self, err):
+        super(DumpTask, self).failed(err)
+        self.redump.exceptions.append(err)
+
+    def skipped(self, err):
+        super(DumpTask, self).skipped(err)
+        self.redump.exceptions.append(err)
+
+    def complete(self):
+        self.processor.exceptions.extend(self.redump.exceptions)
@@ -1,27 +1,122 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, logging
+import gzip, os, logging, hashlib, stat, tempfile
 from des.processor import ProcessorListener
 from des.config import Config
 from des.location_mapper import DestinationMap
 
 SITEMAP_FOLDER = "sitemaps"
+GZIP_SUFFIX = ".gz"
+
+# The umask of this process, read once: reading it means setting it, which is not safe when threads create files.
+_umask = os.umask(0)
+os.umask(_umask)
 
 
 class SitemapWriter(ProcessorListener):
+    """
+    Saves received sitemaps under the 'sitemaps' folder of their destination. A sitemap is only written if its
+    content differs from the copy already on disk. Writes go to a temporary file in the same folder that is renamed
+    over the old copy, so readers never see a half-written sitemap. With compress_sitemaps on, sitemaps are stored
+    gzipped, i.e. 'changelist.xml' as 'changelist.xml.gz'; otherwise a gzipped sitemap such as 'sitemap.xml.gz' is
+    stored decompressed as 'sitemap.xml'.
+    """
 
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # directories we know to exist
+        self.created_dirs = set()
+        # local_path -> digest of the content last written to or found on local_path
+        self.digests = dict()
 
     def event_sitemap_received(self, uri, capability, text):
         config = Config()
         netloc = config.boolean_prop(Config.key_use_netloc, False)
         baser_uri, local_path = DestinationMap().find_local_path(uri, netloc=netloc, infix=SITEMAP_FOLDER)
         if local_path is not None:
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            with open(local_path, "w") as file:
-                file.write(text)
-            self.logger.debug("Saved %s '%s'" % (capability, local_path))
+            if local_path.endswith(GZIP_SUFFIX):
+                local_path = local_path[:-len(GZIP_SUFFIX)]
+            compress = config.boolean_prop(Config.key_compress_sitemaps, False)
+            if compress:
+                local_path += GZIP_SUFFIX
+            data = text.encode("utf-8")
+            digest = hashlib.md5(data).hexdigest()
+            if self.__is_unchanged__(local_path, data, digest, compress):
+                self.logger.debug("Unchanged %s '%s'" % (capability, local_path))
+            else:
+                # mtime=0: the same sitemap always gives the same file
+                self.__write__(local_path, gzip.compress(data, mtime=0) if compress else data)
+                self.digests[local_path] = digest
+                self.logger.debug("Saved %s '%s'" % (capability, local_path))
         else:
             self.logger.warn("Could not save %s. No local path for %s" % (capability, uri))
+
+    def __is_unchanged__(self, local_path, data, digest, compressed=False):
+        """
+        Compare data with the copy stored at local_path.
+        :param local_path: the path of the stored copy
+        :param data: the bytes of the received sitemap
+        :param digest: the md5 hex digest of data
+        :param compressed: True if the stored copy is gzipped
+        :return: True if the stored copy has the same content, False otherwise
+        """
+        try:
+            size = os.stat(local_path).st_size
+        except FileNotFoundError:
+            self.digests.pop(local_path, None)
+            return False
+
+        if not compressed and size != len(data):
+            return False
+
+        stored_digest = self.digests.get(local_path)
+        if stored_digest is None:
+            try:
+                with (gzip.open if compressed else open)(local_path, "rb") as file:
+                    stored_digest = hashlib.md5(file.read()).hexdigest()
+            except (OSError, EOFError):
+                # not a readable gzip file: overwrite it
+                return False
+            self.digests[local_path] = stored_digest
+        return stored_digest == digest
+
+    def __write__(self, local_path, data):
+        """
+        Write data to local_path by way of a temporary file in the same directory and an atomic rename. The file gets
+        the mode of the file it replaces, or the mode a new file would get.
+        :param local_path: the path to write to
+        :param data: the bytes to write
+        :return: None
+        """
+        dirname = os.path.dirname(local_path)
+        self.__makedirs__(dirname)
+        try:
+            tmp = tempfile.NamedTemporaryFile(dir=dirname, prefix=".", suffix=".tmp", delete=False)
+        except FileNotFoundError:
+            # directory was removed behind our back
+            self.created_dirs.discard(dirname)
+            self.__makedirs__(dirname)
+            tmp = tempfile.NamedTemporaryFile(dir=dirname, prefix=".", suffix=".tmp", delete=False)
+        try:
+            with tmp:
+                tmp.write(data)
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            # a temporary file is only readable by its owner
+            os.chmod(tmp.name, self.__mode__(local_path))
+            os.replace(tmp.name, local_path)
+        except:
+            os.unlink(tmp.name)
+            raise
+
+    def __mode__(self, local_path):
+        try:
+            return stat.S_IMODE(os.stat(local_path).st_mode)
+        except FileNotFoundError:
+            return 0o666 & ~_umask
+
+    def __makedirs__(self, dirname):
+        if dirname not in self.created_dirs:
+            os.makedirs(dirname, exist_ok=True)
+            self.created_dirs.add(dirname)
@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import cProfile, datetime, enum, inspect, io, linecache, logging, os.path, pstats, sys, threading, tracemalloc
+from des.config import Config
+
+# Modules whose classes get their own section in the summary.
+PROCESSOR_MODULES = ["des.processor", "des.sync", "des.dump", "des.discover", "des.desclient"]
+
+# From Python 3.12 on a cProfile.Profile profiles all threads, and only one can be enabled at a time.
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+def profile_directory():
+    """
+    Profiles are written next to the sync status report.
+    :return: the directory of the file denoted by the configuration parameter "sync_status_report_file"
+    """
+    filename = Config().prop(Config.key_sync_status_report_file, "sync-status.csv")
+    return os.path.dirname(os.path.abspath(filename))
+
+
+def class_index(module_names=PROCESSOR_MODULES):
+    """
+    Map the code of methods to the classes that define them.
+    :param module_names: names of the modules to index
+    :return: dict of (filename, first line number, function name) -> class name
+    """
+    index = dict()
+    for module_name in module_names:
+        module = __import__(module_name, fromlist=["_"])
+        for class_name, clas in inspect.getmembers(module, inspect.isclass):
+            if clas.__module__ != module_name or issubclass(clas, enum.Enum):
+                continue
+            for name, function in clas.__dict__.items():
+                code = getattr(function, "__code__", None)
+                if code is not None:
+                    index[(code.co_filename, code.co_firstlineno, code.co_name)] = class_name
+    return index
+
+
+class RoundProfiler(object):
+    """
+    Profiles one round with cProfile and tracemalloc. Most of a round runs on the workers of a des.taskqueue.TaskQueue
+    and the threads of des.pipeline.Pipeline stages: threads started while profiling are profiled too, and their
+    profiles are merged with the one of the thread that started profiling. On stop() it writes, with the same base
+    name:
+        - <base>.prof: the cProfile statistics, to be read with pstats or a viewer like snakeviz;
+        - <base>.snapshot: the tracemalloc snapshot, to be read with tracemalloc.Snapshot.load;
+        - <base>.txt: a summary with the top functions overall, per processor class and the top allocations.
+    """
+
+    def __init__(self, directory=None, top=20):
+        """
+        Initialize a RoundProfiler.
+        :param directory: the directory to write to (default = the directory of the sync status report)
+        :param top: the number of entries in each section of the summary
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.directory = profile_directory() if directory is None else directory
+        self.top = top
+        self.profile = None
+        # the profiles of the threads started while profiling
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.stats = None
+        self.started_tracemalloc = False
+        self.base_name = None
+
+    def start(self):
+        """
+        Start profiling.
+        :return: None
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        if not PROFILES_ALL_THREADS:
+            threading.setprofile(self.__profile_thread__)
+        self.profile.enable()
+
+    def __profile_thread__(self, frame, event, arg):
+        # the profile function threading gives to a thread it starts: replace it with a profile of the thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self.lock:
+            self.thread_profiles.append(profile)
+        profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the results.
+        :return: the base name of the files written
+        """
+        self.profile.disable()
+        threading.setprofile(None)
+        self.stats = pstats.Stats(self.profile)
+        with self.lock:
+            for profile in self.thread_profiles:
+                self.stats.add(profile)
+        snapshot = tracemalloc.take_snapshot()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.base_name = os.path.join(self.directory,
+                                      "profile_%s" % datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+        self.stats.dump_stats(self.base_name + ".prof")
+        snapshot.dump(self.base_name + ".snapshot")
+        with open(self.base_name + ".txt", "w") as file:
+            file.write(self.summary(snapshot))
+        self.logger.info("Wrote profile of round to %s.{prof,snapshot,txt}" % self.base_name)
+        return self.base_name
+
+    def summary(self, snapshot):
+        """
+        Summarize the profile and snapshot.
+        :param snapshot: a tracemalloc.Snapshot
+        :return: the summary as string
+        """
+        out = io.StringIO()
+        stats = self.stats
+        stats.stream = out
+        out.write("Top %d functions by cumulative time\n\n" % self.top)
+        stats.sort_stats("cumulative").print_stats(self.top)
+
+        out.write("\nTop %d methods by cumulative time per processor class\n\n" % self.top)
+        out.write(self.__class_summary__(stats))
+
+        out.write("\nTop %d allocations by line\n\n" % self.top)
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, linecache.__file__)])
+        for stat in snapshot.statistics("lineno")[:self.top]:
+            out.write("%s\n" % stat)
+        return out.getvalue()
+
+    def __class_summary__(self, stats):
+        index = class_index()
+        # class name -> list of (cumulative time, calls, function name)
+        per_class = dict()
+        for key, (cc, nc, tt, ct, callers) in stats.stats.items():
+            class_name = index.get(key)
+            if class_name is not None:
+                per_class.setdefault(class_name, []).append((ct, nc, key[2]))
+
+        s = ""
+        for class_name in sorted(per_class, key=lambda name: -max(per_class[name])[0]):
+            s += "%s\n" % class_name
+            for ct, nc, name in sorted(per_class[class_name], reverse=True)[:self.top]:
+                s += "    %10.3fs %8d calls  %s\n" % (ct, nc, name)
+        return s
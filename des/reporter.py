@@ -1,23 +1,26 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import logging, datetime, inspect
+import logging, datetime, inspect, threading
 from des.config import Config
 
 _instance = None
+_lock = threading.Lock()
 
 
 def instance():
     global _instance
-    if _instance is None:
-        _instance = Reporter()
+    with _lock:
+        if _instance is None:
+            _instance = Reporter()
 
     return _instance
 
 
 def reset_instance():
     global _instance
-    _instance = None
+    with _lock:
+        _instance = None
 
 
 class Reporter(object):
@@ -26,19 +29,41 @@ class Reporter(object):
         self.logger = logging.getLogger(__name__)
         self.logger.info("Creating new %s" % self.__class__.__name__)
         self.sync_status = []
+        self.local = threading.local()
+
+    def set_source(self, source):
+        """
+        Set the source url processed by the current thread. Subsequent statuses of this thread are attributed to it.
+        :param source: the source url or None
+        :return: None
+        """
+        self.local.source = source
+
+    def get_source(self):
+        return getattr(self.local, "source", None)
+
+    def statuses_of(self, source):
+        """
+        :param source: a source url
+        :return: the statuses attributed to source
+        """
+        return [status for status in self.sync_status if status.source == source]
 
     def log_status(self, uri, origin=None, in_sync=None, incremental=False, audit=False,
-                   same=None, created=0, updated=0, deleted=0, to_delete=0, exception=None):
+                   same=None, created=0, updated=0, deleted=0, to_delete=0, exception=None, verified=None,
+                   coverage=None):
         if origin is None:
             origin = "%s:%s" % (inspect.stack()[1][1], inspect.stack()[1][2])
         self.sync_status.append(SourceStatus(uri, origin, in_sync, incremental, audit, same,
-                                             created, updated, deleted, to_delete, exception))
+                                             created, updated, deleted, to_delete, exception, self.get_source(),
+                                             verified, coverage))
 
     def sync_status_to_file(self, filename=None):
         if filename is None:
             filename = Config().prop(Config.key_sync_status_report_file, "sync-status.csv")
         with open(filename, 'w') as file:
-            file.write("%s\n" % "date,uri,in_sync,incremental,audit,same,created,updated,deleted,to_delete,exception,origin")
+            file.write("%s\n" % ("date,uri,in_sync,incremental,audit,same,created,updated,deleted,to_delete,exception,"
+                                 "origin,verified,coverage"))
             for item in self.sync_status:
                 file.write("%s\n" % item)
             file.close()
@@ -54,7 +79,12 @@ class Reporter(object):
 
 class SourceStatus(object):
 
-    def __init__(self, uri, origin, in_sync, incremental, audit, same, created, updated, deleted, to_delete, exception):
+    def __init__(self, uri, origin, in_sync, incremental, audit, same, created, updated, deleted, to_delete, exception,
+                 source=None, verified=None, coverage=None):
+        """
+        :param verified: number of resources at the destination of which the checksum was verified in an audit
+        :param coverage: fraction of the resources of which the checksum was verified in the last audits
+        """
         self.datetime = datetime.datetime.now()
         self.uri = uri
         self.origin = origin
@@ -67,6 +97,9 @@ class SourceStatus(object):
         self.deleted = deleted
         self.to_delete = to_delete
         self.exception = exception
+        self.source = source
+        self.verified = verified
+        self.coverage = coverage
 
     def __str__(self):
         s = "\""
@@ -93,6 +126,10 @@ class SourceStatus(object):
         s += str(self.exception)
         s += "\",\""
         s += self.origin
+        s += "\",\""
+        s += str(self.verified)
+        s += "\",\""
+        s += str(self.coverage)
         s += "\""
         return s
 
@@ -0,0 +1,153 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq, itertools, logging, time
+
+# Weight of the latest observation in the smoothed change rate of a source.
+SMOOTHING = 0.5
+# Aim for this many changes to be waiting at a source when we poll it.
+TARGET_CHANGES = 1.0
+# Without observed changes the interval grows with this factor.
+BACKOFF = 2.0
+
+
+class SourceSchedule(object):
+    """
+    The schedule of one source url.
+    """
+
+    def __init__(self, uri, interval, due):
+        self.uri = uri
+        self.interval = interval
+        self.due = due
+        self.last_poll = None
+        # smoothed number of changes per second, None until observed
+        self.rate = None
+
+    def __repr__(self):
+        return "SourceSchedule(%s, interval=%.1f, due=%.1f, rate=%s)" % (self.uri, self.interval, self.due, self.rate)
+
+
+class Scheduler(object):
+    """
+    Priority queue of source urls keyed on the time they are due. After each poll the interval of a source is
+    adapted to the changes observed since its previous poll: busy sources are polled more often, static sources
+    less often, within the bounds of min_interval and max_interval.
+    """
+
+    def __init__(self, min_interval, max_interval, initial_interval=None):
+        """
+        Initialize a Scheduler.
+        :param min_interval: minimum number of seconds between two polls of a source
+        :param max_interval: maximum number of seconds between two polls of a source
+        :param initial_interval: number of seconds between the first and the second poll (default = min_interval)
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.initial_interval = self.__clamp__(min_interval if initial_interval is None else initial_interval)
+        # heap of (due, sequence number, uri). Entries that no longer match a schedule are discarded when popped.
+        self.queue = []
+        self.sequence = itertools.count()
+        # uri -> SourceSchedule
+        self.schedules = dict()
+
+    def set_sources(self, uris, now=None):
+        """
+        Set the source urls to schedule. New source urls are due immediately, schedules of known source urls are
+        kept and source urls that are no longer given are dropped.
+        :param uris: the source urls
+        :param now: the current time (default = time.time())
+        :return: None
+        """
+        now = time.time() if now is None else now
+        for uri in list(self.schedules):
+            if uri not in uris:
+                del self.schedules[uri]
+        for uri in uris:
+            if uri not in self.schedules:
+                schedule = SourceSchedule(uri, self.initial_interval, now)
+                self.schedules[uri] = schedule
+                self.__push__(schedule)
+
+    def __len__(self):
+        return len(self.schedules)
+
+    def __push__(self, schedule):
+        heapq.heappush(self.queue, (schedule.due, next(self.sequence), schedule.uri))
+
+    def __head__(self):
+        """
+        :return: the SourceSchedule that is due first or None if there are no sources
+        """
+        while len(self.queue) > 0:
+            due, sequence, uri = self.queue[0]
+            schedule = self.schedules.get(uri)
+            if schedule is not None and schedule.due == due:
+                return schedule
+            heapq.heappop(self.queue)
+        return None
+
+    def wait_time(self, now=None):
+        """
+        :param now: the current time (default = time.time())
+        :return: seconds until the next source is due, 0 if a source is due or None if there are no sources
+        """
+        now = time.time() if now is None else now
+        schedule = self.__head__()
+        if schedule is None:
+            return None
+        return max(0.0, schedule.due - now)
+
+    def due_count(self, now=None):
+        """
+        :param now: the current time (default = time.time())
+        :return: the number of sources that are due
+        """
+        now = time.time() if now is None else now
+        return len([s for s in self.schedules.values() if s.due <= now])
+
+    def pop(self, now=None):
+        """
+        Take the source url that is due first, if it is due.
+        :param now: the current time (default = time.time())
+        :return: the source url or None if no source is due
+        """
+        now = time.time() if now is None else now
+        schedule = self.__head__()
+        if schedule is None or schedule.due > now:
+            return None
+        heapq.heappop(self.queue)
+        return schedule.uri
+
+    def reschedule(self, uri, changes, now=None):
+        """
+        Schedule the next poll of a source url that has just been polled.
+        :param uri: the source url
+        :param changes: the number of changes observed during the poll
+        :param now: the current time (default = time.time())
+        :return: the SourceSchedule of uri or None if uri is not scheduled
+        """
+        now = time.time() if now is None else now
+        schedule = self.schedules.get(uri)
+        if schedule is None:
+            return None
+
+        if schedule.last_poll is not None and now > schedule.last_poll:
+            observed = changes / (now - schedule.last_poll)
+            schedule.rate = observed if schedule.rate is None \
+                else SMOOTHING * observed + (1 - SMOOTHING) * schedule.rate
+            if schedule.rate > 0:
+                schedule.interval = self.__clamp__(TARGET_CHANGES / schedule.rate)
+            else:
+                schedule.interval = self.__clamp__(schedule.interval * BACKOFF)
+
+        schedule.last_poll = now
+        schedule.due = now + schedule.interval
+        self.__push__(schedule)
+        self.logger.debug("Rescheduled %s after %d changes" % (schedule, changes))
+        return schedule
+
+    def __clamp__(self, interval):
+        return min(self.max_interval, max(self.min_interval, interval))
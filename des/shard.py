@@ -0,0 +1,188 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect, hashlib, logging, os, signal, subprocess, sys, tempfile, threading
+from des.config import Config
+from des.control import Control
+
+# Points per shard on the hash ring. More points give a more even spread of source urls over shards.
+DEFAULT_REPLICAS = 128
+
+# How often the coordinator looks after its workers, unit is seconds.
+COORDINATOR_INTERVAL = 1.0
+
+
+def parse_shard(value):
+    """
+    Parse a shard given as 'index/count', index counting from 0.
+    :param value: the shard as string, i.e. '0/4'
+    :return: tuple (index, count)
+    """
+    index, count = [int(x) for x in value.split("/")]
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Invalid shard '%s': expected index/count with 0 <= index < count" % value)
+    return index, count
+
+
+def shard_filename(filename, index, count):
+    """
+    The name of the shard of a file.
+    :param filename: the file, i.e. 'logs/sync_status.csv'
+    :param index: the index of the shard
+    :param count: the number of shards
+    :return: the name of the shard, i.e. 'logs/sync_status.shard-0-of-4.csv'
+    """
+    base, ext = os.path.splitext(filename)
+    return "%s.shard-%d-of-%d%s" % (base, index, count, ext)
+
+
+def ring_hash(key):
+    """
+    :param key: a string
+    :return: the position of key on the hash ring
+    """
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys over shards. When the number of shards changes, only a small part of the keys moves
+    to another shard.
+    """
+
+    def __init__(self, count, replicas=DEFAULT_REPLICAS):
+        """
+        Initialize a HashRing.
+        :param count: the number of shards
+        :param replicas: the number of points on the ring per shard
+        :return: None
+        """
+        self.count = count
+        points = sorted((ring_hash("%d-%d" % (index, replica)), index)
+                        for index in range(count) for replica in range(replicas))
+        self.hashes = [point[0] for point in points]
+        self.shards = [point[1] for point in points]
+
+    def shard_of(self, key):
+        """
+        :param key: the key, i.e. a source url
+        :return: the index of the shard the key belongs to
+        """
+        position = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.shards[position]
+
+
+def configure_shard(index, count):
+    """
+    Give the shard its own files: state store, sync status report, metrics report and journal directory each get a
+    shard-specific name. A monitor port is shifted by the index of the shard.
+    :param index: the index of the shard
+    :param count: the number of shards
+    :return: None
+    """
+    config = Config()
+    for key, default in ((Config.key_state_store_file, "resydes-state.db"),
+                         (Config.key_sync_status_report_file, "sync-status.csv"),
+                         (Config.key_metrics_report_file, "metrics.prom"),
+                         (Config.key_journal_dir, "resydes-journal")):
+        config.__set_prop__(key, shard_filename(config.prop(key, default).rstrip("/"), index, count))
+    port = config.int_prop(Config.key_monitor_port, 0)
+    if port > 0:
+        config.__set_prop__(Config.key_monitor_port, str(port + index))
+
+
+def merge_reports(filename, count):
+    """
+    Merge the sync status reports of all shards into one report, ordered by date.
+    :param filename: the name of the merged report
+    :param count: the number of shards
+    :return: the number of statuses in the merged report
+    """
+    header = None
+    lines = []
+    for index in range(count):
+        try:
+            with open(shard_filename(filename, index, count)) as file:
+                shard_lines = file.read().splitlines()
+        except FileNotFoundError:
+            continue
+        if len(shard_lines) > 0:
+            header = shard_lines[0]
+            lines.extend(shard_lines[1:])
+    if header is None:
+        return 0
+
+    lines.sort()
+    dirname = os.path.dirname(os.path.abspath(filename))
+    with tempfile.NamedTemporaryFile("w", dir=dirname, prefix=".", suffix=".tmp", delete=False) as file:
+        file.write("%s\n" % header)
+        for line in lines:
+            file.write("%s\n" % line)
+    os.replace(file.name, filename)
+    return len(lines)
+
+
+class Coordinator(object):
+    """
+    Runs a DesRunner in each of count worker processes, each worker processing its shard of the source urls,
+    and merges the sync status reports of the workers. Signals are passed on to the workers.
+    """
+
+    def __init__(self, count, config_filename="conf/config.txt"):
+        """
+        Initialize a Coordinator.
+        :param count: the number of worker processes
+        :param config_filename: the configuration file of the workers
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.count = count
+        self.config_filename = config_filename
+        self.report_filename = Config().prop(Config.key_sync_status_report_file, "sync-status.csv")
+        self.processes = []
+
+    def run(self, sources, task="discover", once=False, profile=False):
+        """
+        Start the workers and look after them until they have all exited.
+        :return: the highest exit code of the workers
+        """
+        import des.desrunner
+        script = os.path.abspath(des.desrunner.__file__)
+        for index in range(self.count):
+            command = [sys.executable, script, sources, "-c", self.config_filename, "-t", task,
+                       "--shard", "%d/%d" % (index, self.count)]
+            if once:
+                command.append("-o")
+            if profile:
+                command.append("-p")
+            self.processes.append(subprocess.Popen(command))
+            self.logger.info("Started shard %d/%d with pid %d" % (index, self.count, self.processes[-1].pid))
+
+        reports = [shard_filename(self.report_filename, index, self.count) for index in range(self.count)]
+        control = Control(watched_files=reports)
+        control.start()
+        signal_sent = False
+        try:
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGHUP, lambda signum, frame: self.__send__(signal.SIGHUP))
+            while any(process.poll() is None for process in self.processes):
+                if control.stop_requested and not signal_sent:
+                    self.__send__(signal.SIGTERM)
+                    signal_sent = True
+                if control.take_reload():
+                    self.__merge__()
+                control.wait(COORDINATOR_INTERVAL)
+        finally:
+            control.close()
+        self.__merge__()
+        return max(process.returncode for process in self.processes)
+
+    def __send__(self, signum):
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signum)
+        self.logger.info("Sent signal %d to %d shards" % (signum, self.count))
+
+    def __merge__(self):
+        statuses = merge_reports(self.report_filename, self.count)
+        self.logger.debug("Merged %d statuses of %d shards into %s" % (statuses, self.count, self.report_filename))
@@ -0,0 +1,337 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections, hashlib, logging, os.path, sqlite3, threading
+from configparser import ConfigParser
+
+import des.compare
+from des.config import Config
+from resync.client_state import ClientState
+
+# The default state store file.
+STATE_STORE_FILENAME = "resydes-state.db"
+
+# Kinds of state.
+INCREMENTAL = "incremental"     # high-water marks of change lists and md:at of dumps
+FRESHNESS = "freshness"         # md:completed, md:at or lastmod of child documents that were processed
+AUDIT = "audit"                 # number of sampled audits done on resource lists
+LISTED = "listed"               # fingerprint of resource lists at their last completed synchronisation
+
+
+class Retry(collections.namedtuple("Retry", "entry attempts next_attempt")):
+    """
+    A resource that could not be fetched: its des.compare.Entry in the resource list, the number of attempts to
+    fetch it and the time of the next attempt.
+    """
+    __slots__ = ()
+
+_instance = None
+_lock = threading.Lock()
+
+
+def instance():
+    """
+    Get the one StateStore shared by all processors. The store is created from the file denoted by the
+    configuration parameter "state_store_file".
+    :return: an instance of StateStore
+    """
+    global _instance
+    with _lock:
+        if _instance is None:
+            filename = Config().prop(Config.key_state_store_file, STATE_STORE_FILENAME)
+            _instance = StateStore(filename)
+
+    return _instance
+
+
+def fingerprint(content):
+    """
+    :param content: the content of a document as bytes
+    :return: a number, kept as state, that is different for different content
+    """
+    return digest_fingerprint(hashlib.sha256(content).digest())
+
+
+def digest_fingerprint(digest):
+    """
+    :param digest: the sha-256 digest of the content of a document
+    :return: the fingerprint of the document, as fingerprint gives it for the content
+    """
+    # 48 bits fit in a float without loss
+    return float(int.from_bytes(digest[:6], "big"))
+
+
+def legacy_name(uri):
+    """
+    :param uri: the uri
+    :return: the name under which resync.client_state.ClientState keeps the state of uri
+    """
+    # ConfigParser lower-cases option names
+    return ClientState().config_site_to_name(uri).lower()
+
+
+def reset_instance():
+    """
+    Commit and close the current instance: next time an instance is requested it will be constructed anew.
+    :return: None
+    """
+    global _instance
+    with _lock:
+        if _instance is not None:
+            _instance.close()
+        _instance = None
+
+
+class StateStore(object):
+    """
+    Persistent store of per-uri timestamps, kept in a SQLite database in WAL mode. Values are cached in memory.
+    Changes are collected in memory and written in one short transaction by calling commit(), normally once per
+    round. Several threads may share the store; several processes may share the database file. The cache is dropped
+    by commit() if another process wrote to the database since, so each round sees the state of the rounds of the
+    other processes that committed before it.
+
+    The state file of resync.client_state.ClientState, in which earlier versions kept high-water marks, is copied to
+    the database when a store is first opened on it, so that state is not lost. The copy is kept under the names
+    ClientState gives to uris; a high-water mark that is set or removed replaces it.
+
+    The store also keeps, per source url, the queue of resources to retry (see Retry) and the uris of the changes at
+    the high-water mark of a change list, in the same way.
+    """
+
+    def __init__(self, filename=STATE_STORE_FILENAME, legacy_filename=None):
+        """
+        Initialize a StateStore.
+        :param filename: the SQLite database file
+        :param legacy_filename: the state file of resync.client_state.ClientState (default = its status_file)
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.filename = filename
+        self.legacy_filename = ClientState().status_file if legacy_filename is None else legacy_filename
+        self.lock = threading.RLock()
+        self.cache = dict()
+        dirname = os.path.dirname(filename)
+        if dirname != "":
+            os.makedirs(dirname, exist_ok=True)
+        # isolation_level=None: we begin and commit transactions ourselves.
+        self.connection = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS state "
+                                "(kind TEXT NOT NULL, uri TEXT NOT NULL, timestamp REAL NOT NULL, "
+                                "PRIMARY KEY (kind, uri))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS retry "
+                                "(source TEXT NOT NULL, uri TEXT NOT NULL, timestamp REAL, length INTEGER, md5 TEXT, "
+                                "sha256 TEXT, attempts INTEGER NOT NULL, next_attempt REAL NOT NULL, "
+                                "PRIMARY KEY (source, uri))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS marked "
+                                "(source TEXT NOT NULL, uri TEXT NOT NULL, PRIMARY KEY (source, uri))")
+        self.__migrate_legacy__()
+        # (kind, uri) -> timestamp of changes not yet committed
+        self.pending = dict()
+        # source -> uri -> Retry, and (source, uri) -> Retry or None of changes not yet committed
+        self.retries = dict()
+        self.pending_retries = dict()
+        # source -> frozenset of uris, and the same of changes not yet committed
+        self.marked = dict()
+        self.pending_marked = dict()
+        # changes when another connection commits to the database
+        self.data_version = self.__data_version__()
+        self.logger.debug("Opened state store '%s'" % filename)
+
+    def get_state(self, uri, kind=INCREMENTAL):
+        """
+        Get the timestamp for the given uri.
+        :param uri: the uri
+        :param kind: the kind of state (default = INCREMENTAL)
+        :return: timestamp as float or None if there is no state for uri
+        """
+        key = (kind, uri)
+        with self.lock:
+            try:
+                return self.cache[key]
+            except KeyError:
+                pass
+            row = self.connection.execute("SELECT timestamp FROM state WHERE kind = ? AND uri = ?",
+                                          key).fetchone()
+            if row is None and kind == INCREMENTAL:
+                row = self.connection.execute("SELECT timestamp FROM legacy WHERE name = ?",
+                                              (legacy_name(uri),)).fetchone()
+            timestamp = row[0] if row is not None else None
+            self.cache[key] = timestamp
+            return timestamp
+
+    def set_state(self, uri, timestamp=None, kind=INCREMENTAL):
+        """
+        Set the timestamp for the given uri. The change is durable after the next call to commit().
+        :param uri: the uri
+        :param timestamp: timestamp as float or None to remove state for uri
+        :param kind: the kind of state (default = INCREMENTAL)
+        :return: None
+        """
+        key = (kind, uri)
+        with self.lock:
+            self.cache[key] = timestamp
+            self.pending[key] = timestamp
+
+    def get_retries(self, source):
+        """
+        Get the resources of source to retry.
+        :param source: the source url, i.e. the uri of a resource list
+        :return: list of Retry
+        """
+        with self.lock:
+            return list(self.__retries_of__(source).values())
+
+    def __retries_of__(self, source):
+        retries = self.retries.get(source)
+        if retries is None:
+            rows = self.connection.execute("SELECT uri, timestamp, length, md5, sha256, attempts, next_attempt "
+                                           "FROM retry WHERE source = ?", (source,)).fetchall()
+            retries = self.retries[source] = dict((row[0], Retry(des.compare.Entry(*row[:5]), row[5], row[6]))
+                                                  for row in rows)
+        return retries
+
+    def set_retry(self, source, entry, attempts, next_attempt):
+        """
+        Queue a resource of source to retry, or update its place in the queue. The change is durable after the next
+        call to commit().
+        :param source: the source url
+        :param entry: des.compare.Entry of the resource
+        :param attempts: the number of attempts so far
+        :param next_attempt: the time of the next attempt
+        :return: None
+        """
+        retry = Retry(entry, attempts, next_attempt)
+        with self.lock:
+            self.__retries_of__(source)[entry.uri] = retry
+            self.pending_retries[(source, entry.uri)] = retry
+
+    def remove_retries(self, source, uris=None):
+        """
+        Remove resources of source from the queue to retry. The change is durable after the next call to commit().
+        :param source: the source url
+        :param uris: the uris of the resources or None for all resources of source
+        :return: None
+        """
+        with self.lock:
+            retries = self.__retries_of__(source)
+            for uri in list(retries) if uris is None else uris:
+                if retries.pop(uri, None) is not None:
+                    self.pending_retries[(source, uri)] = None
+
+    def get_marked(self, source):
+        """
+        Get the uris of the changes at the high-water mark of source.
+        :param source: the source url, i.e. the uri of a change list
+        :return: frozenset of uris
+        """
+        with self.lock:
+            marked = self.marked.get(source)
+            if marked is None:
+                rows = self.connection.execute("SELECT uri FROM marked WHERE source = ?", (source,)).fetchall()
+                marked = self.marked[source] = frozenset(row[0] for row in rows)
+            return marked
+
+    def set_marked(self, source, uris):
+        """
+        Set the uris of the changes at the high-water mark of source. The change is durable after the next call to
+        commit().
+        :param source: the source url
+        :param uris: the uris
+        :return: None
+        """
+        marked = frozenset(uris)
+        with self.lock:
+            self.marked[source] = marked
+            self.pending_marked[source] = marked
+
+    def commit(self):
+        """
+        Write all changes since the last commit to the database in one transaction. Drop the cache if another
+        process wrote to the database since the last commit.
+        :return: None
+        """
+        with self.lock:
+            self.__write__()
+            data_version = self.__data_version__()
+            if data_version != self.data_version:
+                self.data_version = data_version
+                self.cache = dict()
+                self.retries = dict()
+                self.marked = dict()
+                self.logger.debug("Dropped the cache of '%s', changed by another process" % self.filename)
+
+    def __data_version__(self):
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def __write__(self):
+        if len(self.pending) == 0 and len(self.pending_retries) == 0 and len(self.pending_marked) == 0:
+            return
+        removals = [key for key, timestamp in self.pending.items() if timestamp is None]
+        updates = [(kind, uri, float(timestamp)) for (kind, uri), timestamp in self.pending.items()
+                   if timestamp is not None]
+        # a high-water mark that is set or removed replaces the one copied from the state file of ClientState
+        legacy_removals = [(legacy_name(uri),) for kind, uri in self.pending if kind == INCREMENTAL]
+        retry_removals = [key for key, retry in self.pending_retries.items() if retry is None]
+        retry_updates = [(source, uri) + tuple(retry.entry[1:]) + (retry.attempts, float(retry.next_attempt))
+                         for (source, uri), retry in self.pending_retries.items() if retry is not None]
+        marked_updates = [(source, uri) for source, uris in self.pending_marked.items() for uri in uris]
+        # BEGIN IMMEDIATE takes the write lock now, waiting for other writers up to the connection timeout.
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany("DELETE FROM state WHERE kind = ? AND uri = ?", removals)
+            self.connection.executemany("INSERT OR REPLACE INTO state (kind, uri, timestamp) VALUES (?, ?, ?)",
+                                        updates)
+            self.connection.executemany("DELETE FROM legacy WHERE name = ?", legacy_removals)
+            self.connection.executemany("DELETE FROM retry WHERE source = ? AND uri = ?", retry_removals)
+            self.connection.executemany("INSERT OR REPLACE INTO retry (source, uri, timestamp, length, md5, "
+                                        "sha256, attempts, next_attempt) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        retry_updates)
+            self.connection.executemany("DELETE FROM marked WHERE source = ?",
+                                        [(source,) for source in self.pending_marked])
+            self.connection.executemany("INSERT INTO marked (source, uri) VALUES (?, ?)", marked_updates)
+            self.connection.execute("COMMIT")
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.logger.debug("Committed %d state changes and %d retry changes to '%s'"
+                          % (len(self.pending), len(self.pending_retries), self.filename))
+        self.pending = dict()
+        self.pending_retries = dict()
+        self.pending_marked = dict()
+
+    def close(self):
+        """
+        Commit all changes and close the store.
+        :return: None
+        """
+        with self.lock:
+            self.commit()
+            self.connection.close()
+
+    def __migrate_legacy__(self):
+        # BEGIN IMMEDIATE: of several processes opening the database, one copies the state file
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            tables = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+            if ("legacy",) not in tables:
+                self.connection.execute("CREATE TABLE legacy (name TEXT NOT NULL PRIMARY KEY, timestamp REAL NOT NULL)")
+                parser = ConfigParser()
+                parser.read(self.legacy_filename)
+                rows = []
+                if parser.has_section("incremental"):
+                    for name, value in parser.items("incremental"):
+                        try:
+                            rows.append((name, float(value)))
+                        except ValueError:
+                            self.logger.warn("Ignoring invalid state of %s in '%s'" % (name, self.legacy_filename))
+                self.connection.executemany("INSERT INTO legacy (name, timestamp) VALUES (?, ?)", rows)
+                if len(rows) > 0:
+                    self.logger.info("Copied %d states from '%s' to '%s'"
+                                     % (len(rows), self.legacy_filename, self.filename))
+            self.connection.execute("COMMIT")
+        except:
+            self.connection.execute("ROLLBACK")
+            raise
+
@@ -12,4 +12,6 @@ class Status(Enum):
     document = 3                    # processor has read and parsed its assigned uri.
     processed_with_exceptions = 4   # processor has done implied actions according to document from assigned uri
                                     # but did not succeed completely.
-    processed = 5                   # processor has done implied actions according to document from assigned uri.
\ No newline at end of file
+    processed = 5                   # processor has done implied actions according to document from assigned uri.
+    duplicate = 6                   # processor did nothing because its assigned uri was visited before in this round.
+    timed_out = 7                   # processor stopped because a request timed out or its time budget was spent.
\ No newline at end of file
@@ -2,15 +2,64 @@
 # -*- coding: utf-8 -*-
 import abc
 import logging
+import math
+import os.path
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
 
+import des.checksum
+import des.columns
+import des.compare
+import des.deadline
 import des.desclient
+import des.fetch
+import des.journal
+import des.metrics
+import des.pipeline
 import des.reporter
+import des.shard
+import des.state
+import resync.w3c_datetime as w3c
 
 from des.config import Config
 from des.location_mapper import DestinationMap
 from des.status import Status
 from resync.client import ClientFatalError
-from resync.client_state import ClientState
+from resync.resource import Resource
+from resync.sitemap import Sitemap, SitemapParseError, SITEMAP_NS, RS_NS
+from resync.url_authority import UrlAuthority
+
+URL_TAG = "{%s}url" % SITEMAP_NS
+LOC_TAG = "{%s}loc" % SITEMAP_NS
+LASTMOD_TAG = "{%s}lastmod" % SITEMAP_NS
+MD_TAG = "{%s}md" % RS_NS
+
+MEGABYTE = 1024 * 1024
+
+# Audit modes of a resource list, given by the configuration parameter "audit_mode". Checksums are only compared
+# if "use_checksum" is True and the resource list has them.
+AUDIT_FULL = "full"         # compare length, lastmod and the checksums of all resources
+AUDIT_FAST = "fast"         # compare length and lastmod only
+AUDIT_SAMPLED = "sampled"   # compare length and lastmod, and the checksums of a rotating part of the resources
+AUDIT_MODES = (AUDIT_FULL, AUDIT_FAST, AUDIT_SAMPLED)
+# In sampled mode, the checksums of all resources have been compared after this many audits.
+DEFAULT_AUDIT_SAMPLE_ROUNDS = 10
+
+# Threads that fetch the resources of one resource list.
+DEFAULT_FETCH_WORKERS = 4
+# Threads that apply the changes of one change list.
+DEFAULT_CHANGE_WORKERS = 4
+# Count of resources of which the checksum was compared.
+VERIFIED = "verified"
+# Count of resources of which the checksum was not compared, because the journal says they are done.
+RESUMED = "resumed"
+
+# Seconds before the first retry of a resource that could not be fetched; the wait doubles with each attempt.
+DEFAULT_RETRY_BACKOFF = 300.0
+# The longest wait between retries.
+DEFAULT_RETRY_BACKOFF_MAX = 86400.0
 
 
 class Resync(object):
@@ -39,7 +88,8 @@ class Resync(object):
     def process_source(self):
         config = Config()
         netloc = config.boolean_prop(Config.key_use_netloc, False)
-        base_uri, destination = DestinationMap().find_destination(self.uri, netloc=netloc, infix="resources")
+        with des.metrics.instance().timer(des.metrics.STAGE_MAP, self.uri):
+            base_uri, destination = DestinationMap().find_destination(self.uri, netloc=netloc, infix="resources")
         if destination is None:
             self.logger.debug("No destination for %s" % self.uri)
             self.exceptions.append("No destination for %s" % self.uri)
@@ -48,7 +98,8 @@ class Resync(object):
         else:
             self.__synchronize__(destination)
 
-        self.status = Status.processed_with_exceptions if self.has_exceptions() else Status.processed
+        if self.status != Status.timed_out:
+            self.status = Status.processed_with_exceptions if self.has_exceptions() else Status.processed
 
     def __synchronize__(self, destination):
         config = Config()
@@ -59,11 +110,18 @@ class Resync(object):
         desclient = des.desclient.instance()
         try:
             desclient.set_mappings((self.uri, destination))
-            self.do_synchronize(desclient, allow_deletion, audit_only)
+            with des.metrics.instance().timer(des.metrics.STAGE_SYNC, self.uri):
+                self.do_synchronize(desclient, allow_deletion, audit_only)
         except ClientFatalError as err:
             self.logger.warn("EXCEPTION while syncing %s" % self.uri, exc_info=True)
             desclient.log_status(exception=err)
             self.exceptions.append(err)
+        except (des.deadline.DeadlineExceeded, des.fetch.FetchTimeout) as err:
+            # stop cleanly: what has been synchronized so far stays
+            self.logger.info("Stopped syncing %s: %s" % (self.uri, str(err)))
+            desclient.log_status(exception=err)
+            self.exceptions.append(err)
+            self.status = Status.timed_out
         finally:
             # A side effect (or a bug ;) is messing around with the
             # class-level property Client.checksum. Make sure it is always set to initial value before the next
@@ -73,8 +131,29 @@ class Resync(object):
 
 class Relisync(Resync):
     """
-    Synchronisation of a resource list. Synchronisation is eventually done with the resync.client.Client
+    Synchronisation of a resource list. The resource list is compared with the resources at the destination and
+    differences are resolved with the resync.client.Client, as in its baseline_or_audit.
+
+    The synchronisation is a des.pipeline.Pipeline: resources are parsed, compared with their files at the
+    destination, fetched (by "pipeline_fetch_workers" threads), verified and written, all at the same time, with at
+    most "pipeline_queue_size" resources waiting between stages. The first resource can be written while the resource
+    list is still being read. Resources at the destination that are not in the resource list are found afterwards:
+    both inventories are sorted on uri with a des.compare.ExternalSort, which spills to disk beyond
+    "compare_memory_budget" megabytes, and merged in one pass.
+
+    Resources that are written and verified, or of which the checksum is compared, are recorded in a
+    des.journal.Journal. If the synchronisation is interrupted the next one does not compute the checksums of the
+    resources in the journal again.
+
+    A resource that cannot be fetched does not stop the synchronisation: it is queued in the des.state.StateStore to
+    be retried later, waiting "retry_backoff" seconds, doubled with each attempt up to "retry_backoff_max". As long
+    as the resource list stays the same as at the last completed synchronisation, the next synchronisations only
+    fetch the resources in the queue that are due.
 
+    How many checksums of local files are computed depends on the "audit_mode": all of them (full), none (fast), or
+    those of one in "audit_sample_rounds" resources (sampled). In sampled mode the resources are divided in as many
+    parts by a hash of their uri, and each audit takes the next part: after that many audits all checksums have been
+    compared once.
     """
     def __init__(self, uri):
         """
@@ -85,13 +164,320 @@ class Relisync(Resync):
         super(Relisync, self).__init__(uri)
 
     def do_synchronize(self, desclient, allow_deletion, audit_only):
-        desclient.baseline_or_audit(allow_deletion, audit_only)
+        config = Config()
+        budget = config.int_prop(Config.key_compare_memory_budget,
+                                 des.compare.DEFAULT_MEMORY_BUDGET // MEGABYTE) * MEGABYTE
+        queue_size = config.int_prop(Config.key_pipeline_queue_size, des.pipeline.DEFAULT_QUEUE_SIZE)
+        fetch_workers = max(1, config.int_prop(Config.key_pipeline_fetch_workers, DEFAULT_FETCH_WORKERS))
+        self.backoff = (config.float_prop(Config.key_retry_backoff, DEFAULT_RETRY_BACKOFF),
+                        config.float_prop(Config.key_retry_backoff_max, DEFAULT_RETRY_BACKOFF_MAX))
+        # uri -> attempts before, of the resources retried; uris of resources that could not be fetched
+        self.attempts = dict()
+        self.failed = []
+
+        store = des.state.instance()
+        # the resource list is kept in a temporary file, not in memory
+        with tempfile.TemporaryFile(prefix="resydes-list-") as listing:
+            listed = self.__fetch_resource_list__(listing)
+            if not audit_only:
+                retries = store.get_retries(self.uri)
+                if len(retries) > 0 and store.get_state(self.uri, kind=des.state.LISTED) == listed:
+                    self.__retry__(desclient, retries, fetch_workers, queue_size)
+                    return
+                # all differences are found anew
+                store.remove_retries(self.uri)
+                store.set_state(self.uri, None, kind=des.state.LISTED)
+
+            checksum, sample, rotation, coverage = self.__audit_sample__(desclient.checksum)
+            # counted by the compare stage and the write stage, each in a thread of its own
+            found = dict.fromkeys((des.compare.SAME, des.compare.UPDATED, des.compare.DELETED, des.compare.CREATED,
+                                   VERIFIED, RESUMED), 0)
+            done = dict.fromkeys((des.compare.UPDATED, des.compare.DELETED, des.compare.CREATED), 0)
+            # resync.client.Client keeps track of the last timestamp while updating and deleting
+            desclient.last_timestamp = 0
+
+            with des.compare.ExternalSort(budget) as source, des.compare.ExternalSort(budget) as destination, \
+                    des.journal.Journal(self.uri) as journal:
+                pipeline = des.pipeline.Pipeline(self.uri, queue_size)
+                pipeline.add_stage("compare", lambda entries: self.__compare__(desclient, entries, checksum, sample,
+                                                                               found, journal), stream=True)
+                if not audit_only:
+                    self.__add_fetch_stages__(pipeline, desclient, fetch_workers, done, journal)
+                pipeline.run(self.__read_source__(desclient, source, audit_only, self.__parse__(listing)))
+                if len(source) == 0:
+                    raise ClientFatalError("Aborting as there are no resources to sync")
+
+                # resources at the destination that are not in the resource list can only be known at the end
+                destination.extend(des.compare.iter_disk(desclient.mapper))
+                for change, entry in des.compare.compare(destination, source):
+                    if change == des.compare.DELETED:
+                        found[change] += 1
+                        if not audit_only:
+                            done[change] += self.__apply_difference__(desclient, change, entry, allow_deletion)
+                # completed: the next synchronisation starts afresh
+                journal.remove()
+                if not audit_only:
+                    store.set_state(self.uri, listed, kind=des.state.LISTED)
+
+        if found[RESUMED] > 0:
+            self.logger.info("Did not compute checksums of %d resources verified by an interrupted synchronisation "
+                             "of %s" % (found[RESUMED], self.uri))
+        if checksum and self.digests == 0:
+            coverage = 0.0
+            self.logger.info("Not calculating checksums on destination as not present in source resource list")
+        elif rotation is not None:
+            des.state.instance().set_state(self.uri, rotation + 1, kind=des.state.AUDIT)
+        des.metrics.instance().inc(des.metrics.RESOURCES_VERIFIED, found[VERIFIED])
+        in_sync = found[des.compare.UPDATED] + found[des.compare.CREATED] + found[des.compare.DELETED] == 0
+        desclient.log_status(in_sync=in_sync, audit=True, same=found[des.compare.SAME],
+                             created=found[des.compare.CREATED], updated=found[des.compare.UPDATED],
+                             deleted=found[des.compare.DELETED], verified=found[VERIFIED], coverage=coverage)
+        if not (audit_only or in_sync):
+            desclient.log_status(in_sync=False, same=found[des.compare.SAME], created=done[des.compare.CREATED],
+                                 updated=done[des.compare.UPDATED], deleted=done[des.compare.DELETED],
+                                 to_delete=found[des.compare.DELETED])
+        if len(self.failed) > 0:
+            raise ClientFatalError("%d resources of %s could not be fetched, they are retried later"
+                                   % (len(self.failed), self.uri))
+
+    def __retry__(self, desclient, retries, fetch_workers, queue_size):
+        """
+        Fetch the resources in the queue to retry that are due, and only those: the resource list is the same as at
+        the last completed synchronisation.
+        :param retries: list of des.state.Retry of this resource list
+        :return: None
+        :raises ClientFatalError: if resources are left in the queue
+        """
+        now = time.time()
+        due = [retry for retry in retries if retry.next_attempt <= now]
+        self.logger.info("Resource list %s unchanged, retrying %d of %d resources that could not be fetched"
+                         % (self.uri, len(due), len(retries)))
+        self.attempts = dict((retry.entry.uri, retry.attempts) for retry in due)
+        done = dict.fromkeys((des.compare.UPDATED, des.compare.CREATED), 0)
+        desclient.last_timestamp = 0
+
+        def differences():
+            for retry in due:
+                filename = desclient.mapper.src_to_dst(retry.entry.uri)
+                change = des.compare.UPDATED if os.path.isfile(filename) else des.compare.CREATED
+                yield change, retry.entry, filename
+
+        written = []
+        pipeline = des.pipeline.Pipeline(self.uri, queue_size)
+        self.__add_fetch_stages__(pipeline, desclient, fetch_workers, done, None, written)
+        try:
+            pipeline.run(differences())
+        finally:
+            des.state.instance().remove_retries(self.uri, written)
+        left = len(des.state.instance().get_retries(self.uri))
+        desclient.log_status(in_sync=left == 0, created=done[des.compare.CREATED], updated=done[des.compare.UPDATED])
+        if left > 0:
+            raise ClientFatalError("%d resources of %s could not be fetched yet, they are retried later"
+                                   % (left, self.uri))
+
+    def __retry_later__(self, entry):
+        attempts = self.attempts.get(entry.uri, 0) + 1
+        backoff, backoff_max = self.backoff
+        wait = min(backoff_max, backoff * 2 ** (attempts - 1))
+        des.state.instance().set_retry(self.uri, entry, attempts, time.time() + wait)
+        # list.append is atomic: several fetch workers may get here
+        self.failed.append(entry.uri)
+
+    def __add_fetch_stages__(self, pipeline, desclient, fetch_workers, done, journal, written=None):
+        # fetched content is held in the queues after the fetch stage: keep them short
+        pipeline.add_stage("fetch", lambda difference: self.__fetch__(desclient, difference),
+                           workers=fetch_workers)
+        pipeline.add_stage("verify", lambda fetched: self.__verify__(desclient, fetched),
+                           queue_size=fetch_workers)
+        pipeline.add_stage("write", lambda verified: self.__write__(desclient, verified, done, journal, written),
+                           queue_size=fetch_workers)
+
+    def __compare__(self, desclient, entries, checksum, sample, found, journal):
+        """
+        The compare stage: compare each resource in the resource list with its file at the destination, computing
+        checksums with the des.checksum.Checksummer, unless the resource is done according to the journal.
+        :param entries: iterator over des.compare.Entry of the resource list
+        :param found: dict of counts per kind of comparison result, of VERIFIED and of RESUMED
+        :param journal: the des.journal.Journal of this synchronisation
+        :return: generator of differences: tuples (des.compare.CREATED or UPDATED, entry, filename)
+        """
+        mapper = desclient.mapper
+
+        def located():
+            for entry in entries:
+                filename = mapper.src_to_dst(entry.uri)
+                local = des.compare.entry_of_file(mapper, filename)
+                algorithms = ()
+                if checksum and local is not None and len(journal) > 0 and journal.done(entry):
+                    # timestamp and length are still compared
+                    found[RESUMED] += 1
+                elif checksum and local is not None and (sample is None or sample(entry.uri)):
+                    algorithms = tuple(algorithm for algorithm, digest in ((des.checksum.MD5, entry.md5),
+                                                                           (des.checksum.SHA256, entry.sha256))
+                                       if digest is not None)
+                yield filename, local.length if len(algorithms) > 0 else 0, (entry, local, algorithms)
+
+        for (filename, size, (entry, local, algorithms)), digests in \
+                des.checksum.instance().digests(located(), lambda item: item[2][2]):
+            if isinstance(digests, OSError):
+                self.logger.warn("Ignoring file %s (%s)" % (filename, str(digests)))
+                local = None
+            elif len(algorithms) > 0:
+                local = des.compare.with_digests(local, algorithms, digests)
+                found[VERIFIED] += 1
+            if local is None:
+                change = des.compare.CREATED
+            elif des.compare.equal(local, entry):
+                change = des.compare.SAME
+            else:
+                change = des.compare.UPDATED
+            found[change] += 1
+            if change != des.compare.SAME:
+                yield change, entry, filename
+            elif len(algorithms) > 0:
+                journal.record(entry)
+
+    def __fetch__(self, desclient, difference):
+        # the fetch stage
+        change, entry, filename = difference
+        resource = entry.to_resource()
+        self.logger.info("%s: %s -> %s" % (change, resource.uri, filename))
+        try:
+            with des.metrics.instance().timer(des.metrics.STAGE_WRITE, resource.uri):
+                content = desclient.fetch_resource(resource)
+        except ClientFatalError as err:
+            self.logger.warn("%s, retrying later" % str(err))
+            self.__retry_later__(entry)
+            return
+        if content is not None:
+            yield change, entry, resource, filename, content
+
+    def __verify__(self, desclient, fetched):
+        # the verify stage
+        yield fetched + (desclient.verify_resource(fetched[2], fetched[4]),)
+
+    def __write__(self, desclient, verified, done, journal, written):
+        # the write stage; written, if given, collects the uris of the resources written
+        change, entry, resource, filename, content, is_verified = verified
+        # writing is timed with the fetch stage
+        num_written = desclient.write_resource(resource, filename, content, change)
+        des.metrics.instance().inc(des.metrics.RESOURCES_WRITTEN, num_written, change=change)
+        done[change] += num_written
+        if journal is not None and num_written > 0 and is_verified:
+            journal.record(entry)
+        if written is not None and num_written > 0:
+            written.append(entry.uri)
+
+    def __audit_sample__(self, checksum):
+        """
+        Decide which checksums of local files to compute in this audit.
+        :param checksum: True if checksums can be compared at all
+        :return: tuple (compute checksums, function of a uri that tells whether to compute its checksum or None for
+                all uris, number of sampled audits done before or None if not sampling, fraction of the resources
+                of which the checksum has been compared in this and the previous audits)
+        """
+        mode = Config().prop(Config.key_audit_mode, AUDIT_FULL)
+        if mode not in AUDIT_MODES:
+            self.logger.warn("Unknown audit_mode '%s', doing a %s audit" % (mode, AUDIT_FULL))
+            mode = AUDIT_FULL
+        if not checksum or mode == AUDIT_FAST:
+            return False, None, None, 0.0
+        if mode == AUDIT_FULL:
+            return True, None, None, 1.0
+
+        rounds = max(1, Config().int_prop(Config.key_audit_sample_rounds, DEFAULT_AUDIT_SAMPLE_ROUNDS))
+        rotation = int(des.state.instance().get_state(self.uri, kind=des.state.AUDIT) or 0)
+        part = rotation % rounds
+        self.logger.debug("Comparing checksums of part %d of %d of %s" % (part + 1, rounds, self.uri))
+        return True, lambda uri: des.shard.ring_hash(uri) % rounds == part, rotation, \
+            min(rotation + 1, rounds) / rounds
+
+    def __read_source__(self, desclient, source, audit_only, entries):
+        """
+        The parse stage: read the resource list into source, checking authority over the resources unless auditing,
+        and counting the resources with a checksum in self.digests.
+        :param entries: iterator over des.compare.Entry of the resource list, parsed while iterating
+        :return: generator of des.compare.Entry, as they are read
+        """
+        uauth = None if desclient.noauth or audit_only else UrlAuthority(self.uri, desclient.strictauth)
+        self.digests = 0
+        # time spent waiting for the next stages does not count
+        parsing = 0.0
+        start = time.perf_counter()
+        for entry in entries:
+            if uauth is not None and not uauth.has_authority_over(entry.uri):
+                raise ClientFatalError("Resource list %s mentions resource at a location it does not have "
+                                       "authority over (%s)" % (self.uri, entry.uri))
+            if entry.md5 is not None or entry.sha256 is not None:
+                self.digests += 1
+            source.add(entry)
+            parsing += time.perf_counter() - start
+            yield entry
+            start = time.perf_counter()
+        parsing += time.perf_counter() - start
+        des.metrics.instance().observe(des.metrics.STAGE_SECONDS, parsing, stage=des.metrics.STAGE_PARSE,
+                                       host=des.metrics.host_of(self.uri))
+        self.logger.info("Read source resource list, %d resources listed" % len(source))
+
+    def read_resource_list(self):
+        """
+        Read the resource list. A resource list that is a gzip file, such as a resourcelist.xml.gz, is decompressed
+        while it is parsed.
+        :return: generator of des.compare.Entry, parsed while iterating
+        """
+        with tempfile.TemporaryFile(prefix="resydes-list-") as listing:
+            self.__fetch_resource_list__(listing)
+            yield from self.__parse__(listing)
+
+    def __fetch_resource_list__(self, file):
+        """
+        Get the resource list and write it to file, computing its fingerprint on the way.
+        :param file: the binary file to write to
+        :return: the fingerprint of the resource list (see des.state.fingerprint)
+        """
+        metrics = des.metrics.instance()
+        digester = des.checksum.Digester(file, (des.checksum.SHA256,))
+        try:
+            with metrics.timer(des.metrics.STAGE_FETCH, self.uri):
+                response = des.fetch.instance().get_to_file(self.uri, digester)
+            metrics.fetched(self.uri, response.status_code, response.length)
+            if response.status_code != 200:
+                raise ClientFatalError("Invalid response status: %d on %s" % (response.status_code, self.uri))
+        except des.fetch.FetchTimeout:
+            raise
+        except des.fetch.FetchError as err:
+            raise ClientFatalError("Can't read source resource list from %s (%s)" % (self.uri, str(err)))
+        return des.state.digest_fingerprint(digester.hashes[des.checksum.SHA256].digest())
+
+    def __parse__(self, file):
+        try:
+            file.seek(0)
+            yield from des.compare.iter_sitemap(des.fetch.open_document(file), capability="resourcelist")
+        except (ET.ParseError, SitemapParseError, ValueError, OSError, EOFError) as err:
+            raise ClientFatalError("Can't parse source resource list from %s (%s)" % (self.uri, str(err)))
+
+    def __apply_difference__(self, desclient, change, entry, allow_deletion):
+        """
+        Resolve one difference between source and destination.
+        :return: the number of resources created, updated or deleted
+        """
+        resource = entry.to_resource()
+        filename = desclient.mapper.src_to_dst(resource.uri)
+        if change == des.compare.DELETED:
+            return desclient.delete_resource(resource, filename, allow_deletion)
+        self.logger.info("%s: %s -> %s" % (change, resource.uri, filename))
+        return desclient.update_resource(resource, filename, change)
 
 
 class Chanlisync(Resync):
     """
-    Synchronisation of a change list. Synchronisation is eventually done with the resync.client.Client
+    Synchronisation of a change list. Changes newer than the high-water mark of the change list are applied with the
+    resync.client.Client. The changes to a resource since the mark are first coalesced into the final one, so that
+    a resource updated several times is fetched once, and a resource created and deleted not at all.
 
+    Changes to different resources are applied in parallel, by "change_workers" threads; changes to the same resource
+    always by the same thread, in order of time. If synchronisation stops halfway, the mark is moved up to where all
+    changes have been applied.
     """
     def __init__(self, uri):
         """
@@ -103,13 +489,196 @@ class Chanlisync(Resync):
 
     def do_synchronize(self, desclient, allow_deletion, audit_only):
         #
-        # State is now kept for the full url of resourcelist and changelist (whatever there names may be).
-        # The first time we go from baseline to incremental there will be no state for that particular url.
+        # State is kept for the full url of the change list (whatever its name may be). It is the high-water mark:
+        # the latest change datetime of this change list we have processed. Entries below the mark are skipped while
+        # parsing. Several changes may have the datetime of the mark, and some of them may have been added to the
+        # change list after we read it: the uris of the changes at the mark are kept, and only those are skipped.
+        # The first time we go from baseline to incremental there will be no mark: all entries count.
         #
-        from_datetime = ClientState().get_state(self.uri)
-        if from_datetime is None:
-            from_datetime = "1999"
-        else:
-            from_datetime = None # only set this parameter when no state is present
+        store = des.state.instance()
+        high_water_mark = store.get_state(self.uri)
+        marked = store.get_marked(self.uri) if high_water_mark is not None else frozenset()
+        change_list, skipped, latest, at_latest = self.read_change_list(high_water_mark, marked)
+        if skipped > 0:
+            self.logger.debug("Skipped %d changes at or before %s in %s"
+                              % (skipped, w3c.datetime_to_str(high_water_mark), self.uri))
+
+        if not desclient.noauth:
+            uauth = UrlAuthority(self.uri, desclient.strictauth)
+            for resource in change_list:
+                if not uauth.has_authority_over(resource.uri):
+                    raise ClientFatalError("Change list %s mentions resource at a location it does not have "
+                                           "authority over (%s)" % (self.uri, resource.uri))
+
+        # of all changes to a resource since the mark only the final one is applied
+        changes = len(change_list)
+        removed, saved = change_list.coalesce()
+        if removed > 0:
+            self.logger.info("Coalesced %d changes in %s to %d, saving %d fetches"
+                             % (changes, self.uri, len(change_list), saved))
+        des.metrics.instance().inc(des.metrics.FETCHES_SAVED, saved)
+        des.metrics.instance().inc(des.metrics.CHANGES_OBSERVED, len(change_list))
+        to_create, to_update, to_delete = 0, 0, 0
+        for resource in change_list:
+            if resource.change == "created":
+                to_create += 1
+            elif resource.change == "updated":
+                to_update += 1
+            elif resource.change == "deleted":
+                to_delete += 1
+            else:
+                raise ClientFatalError("Unknown change type %s for %s" % (resource.change, resource.uri))
+
+        in_sync = to_create + to_update + to_delete == 0
+        desclient.log_status(in_sync=in_sync, incremental=True, created=to_create, updated=to_update,
+                             deleted=to_delete)
+        if not (in_sync or (to_create + to_update == 0 and not allow_deletion)):
+            try:
+                created, updated, deleted = self.__apply_changes__(desclient, change_list, allow_deletion)
+            except BaseException:
+                # Changes are applied in parallel: up to where have all of them been applied?
+                if not audit_only and self.applied_until is not None:
+                    at_mark = set(resource.uri for resource in change_list
+                                  if resource.timestamp == self.applied_until)
+                    if self.applied_until == high_water_mark:
+                        at_mark.update(marked)
+                    self.__set_high_water_mark__(self.applied_until, at_mark)
+                raise
+            desclient.log_status(incremental=True, created=created, updated=updated, deleted=deleted,
+                                 to_delete=to_delete)
+
+        # Do not move the mark while auditing: nothing has been applied.
+        if not audit_only:
+            self.__set_high_water_mark__(latest, at_latest)
+
+    def __set_high_water_mark__(self, mark, marked):
+        if mark is not None:
+            des.state.instance().set_state(self.uri, mark)
+            des.state.instance().set_marked(self.uri, marked)
+            self.logger.debug("High-water mark for %s set to %s" % (self.uri, w3c.datetime_to_str(mark)))
+
+    def read_change_list(self, high_water_mark=None, marked=()):
+        """
+        Read the change list and parse its entries, skipping entries before the high-water mark and entries at the
+        mark of which the uri is marked.
+        :param high_water_mark: timestamp of the latest change already processed or None
+        :param marked: the uris of the changes at the high-water mark that were processed
+        :return: tuple of des.columns.ResourceColumns with the remaining entries, the number of skipped entries,
+                the timestamp up to which changes have been read (None if no entries or md:until beyond the
+                high-water mark were found) and the set of uris of the changes at that timestamp
+        """
+        metrics = des.metrics.instance()
+        try:
+            with metrics.timer(des.metrics.STAGE_FETCH, self.uri):
+                response = des.fetch.instance().get(self.uri)
+                content = response.content
+            metrics.fetched(self.uri, response.status_code, len(content))
+            if response.status_code != 200:
+                raise ClientFatalError("Invalid response status: %d on %s" % (response.status_code, self.uri))
+        except des.fetch.FetchTimeout:
+            raise
+        except des.fetch.FetchError as err:
+            raise ClientFatalError("Can't read change list from %s (%s)" % (self.uri, str(err)))
+
+        sitemap = Sitemap()
+        change_list = des.columns.ResourceColumns(capability_name="changelist")
+        skipped = 0
+        latest = None
+        at_latest = set()
+        md_until = None
+        in_preamble = True
+        try:
+            with metrics.timer(des.metrics.STAGE_PARSE, self.uri):
+                for event, element in ET.iterparse(response.open_document(), events=("start", "end")):
+                    if event == "start":
+                        in_preamble = in_preamble and element.tag != URL_TAG
+                    elif element.tag == MD_TAG and in_preamble:
+                        # md:until of an archived change list
+                        md_until = w3c.str_to_datetime(element.get("until"))
+                    elif element.tag == URL_TAG:
+                        timestamp = element_timestamp(element)
+                        if timestamp is None:
+                            raise ClientFatalError("Missing datetime for change in %s" % self.uri)
+                        if high_water_mark is not None and timestamp <= high_water_mark \
+                                and (timestamp < high_water_mark or element.findtext(LOC_TAG, "").strip() in marked):
+                            skipped += 1
+                        else:
+                            resource = sitemap.resource_from_etree(element, Resource)
+                            change_list.add(resource)
+                            if latest is None or timestamp > latest:
+                                latest = timestamp
+                                at_latest = set()
+                            if timestamp == latest:
+                                at_latest.add(resource.uri)
+                        element.clear()
+        except (ET.ParseError, OSError, EOFError) as err:
+            raise ClientFatalError("Can't parse change list from %s (%s)" % (self.uri, str(err)))
+
+        # an archived change list has no changes after md:until
+        if md_until is not None and (latest is None or md_until > latest) \
+                and (high_water_mark is None or md_until > high_water_mark):
+            latest = md_until
+            at_latest = set()
+        elif latest is not None and latest == high_water_mark:
+            # more changes at the mark
+            at_latest.update(marked)
+        return change_list, skipped, latest, at_latest
+
+    def __apply_changes__(self, desclient, change_list, allow_deletion):
+        """
+        Apply the changes in a des.pipeline.Pipeline with one partitioned stage: the changes are divided over
+        "change_workers" threads by a hash of their uri, and each thread applies its changes in order of time.
+        On return, or when an exception is raised, self.applied_until is the timestamp up to which all changes have
+        been applied, or None if not even the first change has been applied.
+        :return: tuple of the number of resources created, updated and deleted
+        """
+        workers = max(1, Config().int_prop(Config.key_change_workers, DEFAULT_CHANGE_WORKERS))
+        done = {"created": 0, "updated": 0, "deleted": 0}
+        applied = set()
+        lock = threading.Lock()
+        self.applied_until = None
+        # resync.client.Client keeps track of the last timestamp while updating and deleting
+        desclient.last_timestamp = 0
+
+        def apply(index_and_resource):
+            index, resource = index_and_resource
+            filename = desclient.mapper.src_to_dst(resource.uri)
+            if resource.change == "deleted":
+                count = desclient.delete_resource(resource, filename, allow_deletion)
+            else:
+                self.logger.info("%s: %s -> %s" % (resource.change, resource.uri, filename))
+                count = desclient.update_resource(resource, filename, resource.change)
+            with lock:
+                done[resource.change] += count
+                applied.add(index)
+
+        order = sorted(range(len(change_list)), key=lambda index: change_list.timestamps[index])
+        pipeline = des.pipeline.Pipeline(self.uri)
+        pipeline.add_stage("apply", apply, workers=workers,
+                           partition=lambda index_and_resource: des.shard.ring_hash(index_and_resource[1].uri))
+        try:
+            pipeline.run((index, change_list.resource(index)) for index in order)
+        finally:
+            timestamps = change_list.timestamps
+            # the earliest change not applied; workers may have applied later ones
+            lowest = next((timestamps[index] for index in order if index not in applied), math.inf)
+            self.applied_until = max((timestamps[index] for index in applied if timestamps[index] < lowest),
+                                     default=None)
+        return done["created"], done["updated"], done["deleted"]
+
+
+def element_timestamp(element):
+    """
+    Get the change timestamp of a <url> element in a change list without parsing it into a resource.
+    The rs:md datetime attribute takes precedence over lastmod.
+    :param element: xml.etree.ElementTree.Element of a <url>
+    :return: timestamp as float or None if element has no datetime
+    """
+    value = None
+    md = element.find(MD_TAG)
+    if md is not None:
+        value = md.get("datetime")
+    if value is None:
+        value = element.findtext(LASTMOD_TAG)
+    return w3c.str_to_datetime(value.strip()) if value is not None else None
 
-        desclient.incremental(allow_deletion=allow_deletion, from_datetime=from_datetime)
\ No newline at end of file
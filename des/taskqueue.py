@@ -0,0 +1,254 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections, logging, threading
+import des.deadline, des.metrics, des.reporter
+
+# Kinds of tasks.
+TASK_SOURCE = "source"                  # discover and start processing a source url
+TASK_FETCH_SITEMAP = "fetch-sitemap"    # read a sitemap and fork tasks for the documents it points to
+TASK_SYNC_LIST = "sync-list"            # synchronize with a resource list or change list
+TASK_APPLY_DUMP = "apply-dump"          # unpack a resource dump
+
+_local = threading.local()
+# guards the pending counts of all tasks
+_lock = threading.Lock()
+
+
+def current_task():
+    """
+    :return: the Task run by the current thread or None
+    """
+    return getattr(_local, "task", None)
+
+
+def fork(task):
+    """
+    Run task as part of the task run by the current thread. If the current task runs on a TaskQueue, task is
+    queued and may be run by any worker of the queue; otherwise, or if the current task is serial, task is run
+    right away. The current task completes only after task has completed.
+    :param task: the Task to run
+    :return: None
+    """
+    parent = current_task()
+    task.parent = parent
+    if parent is not None:
+        task.queue = parent.queue
+        task.serial = task.serial or parent.serial
+        if task.source is None:
+            task.source = parent.source
+        if task.deadline is None:
+            task.deadline = parent.deadline
+        with _lock:
+            parent.pending += 1
+    if parent is None or parent.queue is None or parent.serial:
+        execute(task)
+    else:
+        parent.queue.push(task)
+
+
+def execute(task):
+    """
+    Run task in the current thread under its deadline and settle it. If the budget of the deadline was spent before
+    the task started, the task is skipped.
+    :param task: the Task to run
+    :return: None
+    """
+    des.metrics.instance().inc(des.metrics.TASKS, source="", kind=task.kind)
+    previous = current_task()
+    _local.task = task
+    try:
+        with des.deadline.scope(task.deadline):
+            try:
+                des.deadline.check()
+            except des.deadline.DeadlineExceeded as err:
+                task.skipped(err)
+            else:
+                task.run()
+    except Exception as err:
+        task.failed(err)
+    finally:
+        _local.task = previous
+    __settle__(task)
+
+
+def __settle__(task):
+    # run() of task, or of a task it forked, has ended. Complete the tasks that have nothing pending anymore.
+    while task is not None:
+        with _lock:
+            task.pending -= 1
+            done = task.pending == 0
+        if not done:
+            return
+        try:
+            task.complete()
+        except Exception:
+            task.logger.warn("Failure while completing %s" % task, exc_info=True)
+        if task.parent is None and task.queue is not None:
+            task.queue.completed(task)
+        task = task.parent
+
+
+class Task(object):
+    """
+    A unit of work on behalf of a source url. A task can fork other tasks; it completes when its run() has
+    ended and all the tasks it forked have completed.
+    """
+
+    kind = None
+
+    def __init__(self, source=None):
+        """
+        Initialize a Task.
+        :param source: the source url the task works for (default = the source url of the task that forks it)
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.source = source
+        # des.deadline.Deadline the task runs under (default = the deadline of the task that forks it)
+        self.deadline = None
+        self.parent = None
+        self.queue = None
+        # tasks forked by a serial task are run right away, in order, by the same thread
+        self.serial = False
+        # run() itself and the forked tasks that have not completed
+        self.pending = 1
+
+    def run(self):
+        raise NotImplementedError
+
+    def failed(self, err):
+        """
+        Called when run() raised err.
+        :param err: the exception raised
+        :return: None
+        """
+        if isinstance(err, des.deadline.DeadlineExceeded):
+            self.logger.info("Stopped %s: %s" % (self, str(err)))
+        else:
+            self.logger.warn("Failure while running %s" % self, exc_info=True)
+        des.reporter.instance().log_status(self.source, exception=err)
+
+    def skipped(self, err):
+        """
+        Called instead of run() when the budget of the deadline of the task was spent before the task started.
+        :param err: the des.deadline.DeadlineExceeded
+        :return: None
+        """
+        self.logger.debug("Skipped %s: %s" % (self, str(err)))
+
+    def complete(self):
+        """
+        Called when run() has ended and all tasks forked by it have completed.
+        :return: None
+        """
+        pass
+
+    def __repr__(self):
+        return "%s(%s, source=%s)" % (self.__class__.__name__, self.kind, self.source)
+
+
+class TaskQueue(object):
+    """
+    Runs tasks on a number of workers. Each worker keeps its own deque of the tasks it forked and takes the
+    most recent one first, which keeps the work on one source url together. A worker that has nothing left takes
+    the oldest task of another worker (work stealing) before it starts on a new source url, so one large source url
+    is spread over all workers instead of keeping one worker busy while the others sit idle.
+
+    The first worker is the thread that calls run(); the others are daemon threads.
+    """
+
+    def __init__(self, workers=1):
+        """
+        Initialize a TaskQueue.
+        :param workers: the number of workers
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.workers = max(1, workers)
+        self.condition = threading.Condition()
+        self.deques = [collections.deque() for index in range(self.workers)]
+        # tasks given to run() that have not been started
+        self.inbox = collections.deque()
+        # tasks given to run() that have been started and have not completed
+        self.running = 0
+        self.stop = None
+
+    def run(self, tasks, stop=None):
+        """
+        Run tasks and all the tasks they fork. Returns when all started tasks have completed.
+        :param tasks: the tasks to run, started in the given order
+        :param stop: a function that returns True if no more of the given tasks should be started (default = None)
+        :return: list of the given tasks that were not started
+        """
+        with self.condition:
+            self.stop = stop
+            for task in tasks:
+                task.queue = self
+                self.inbox.append(task)
+        threads = [threading.Thread(target=self.__work__, args=(index,), name="worker-%d" % index)
+                   for index in range(1, self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.__work__(0)
+        for thread in threads:
+            thread.join()
+        with self.condition:
+            left = list(self.inbox)
+            self.inbox.clear()
+        return left
+
+    def push(self, task):
+        """
+        Queue a task forked by the task that runs on the current worker.
+        :param task: the forked task
+        :return: None
+        """
+        with self.condition:
+            self.deques[getattr(_local, "worker", 0)].append(task)
+            self.condition.notify()
+
+    def completed(self, task):
+        """
+        Called when a task given to run() has completed.
+        :param task: the completed task
+        :return: None
+        """
+        with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+
+    def __take__(self, index):
+        with self.condition:
+            while True:
+                if len(self.deques[index]) > 0:
+                    return self.deques[index].pop()
+                for offset in range(1, self.workers):
+                    victim = self.deques[(index + offset) % self.workers]
+                    if len(victim) > 0:
+                        des.metrics.instance().inc(des.metrics.TASKS_STOLEN, source="")
+                        return victim.popleft()
+                if len(self.inbox) > 0 and not (self.stop is not None and self.stop()):
+                    self.running += 1
+                    return self.inbox.popleft()
+                if self.running == 0:
+                    return None
+                self.condition.wait()
+
+    def __work__(self, index):
+        _local.worker = index
+        metrics = des.metrics.instance()
+        try:
+            while True:
+                task = self.__take__(index)
+                if task is None:
+                    break
+                metrics.set_source(task.source)
+                des.reporter.instance().set_source(task.source)
+                execute(task)
+        finally:
+            metrics.set_source(None)
+            des.reporter.instance().set_source(None)
+            with self.condition:
+                self.condition.notify_all()
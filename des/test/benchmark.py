@@ -0,0 +1,194 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmark of DesRunner. Generates synthetic sources with des.test.simulator, serves them locally and runs
+a number of DesRunner rounds against them. Reports wall time, requests per second, peak RSS and bytes moved for each
+round.
+
+usage: python3 des/test/benchmark.py [-h] [options]     (from the root directory of the project)
+"""
+
+import sys, argparse, json, os, resource, shutil, tempfile, time
+sys.path.append(".")
+
+from des.desrunner import DesRunner
+from des.test.simulator import SourceSimulator
+
+CONFIG = """
+logging_configuration_file=%(logging)s
+location_mapper_destination_file=%(desmap)s
+destination_root=%(destination)s
+use_netloc=True
+use_checksum=%(checksum)s
+audit_only=False
+sync_status_report_file=%(report)s
+metrics_report_file=%(metrics)s
+state_store_file=%(state)s
+worker_threads=%(workers)d
+fetch_backend=%(backend)s
+sync_pause=0
+des_processor_listeners=des.processor_listener.SitemapWriter
+des_dump_listeners=des.processor_listener.SitemapWriter
+"""
+
+LOGGING = """
+[loggers]
+keys=root
+
+[handlers]
+keys=consoleHandler
+
+[formatters]
+keys=simpleFormatter
+
+[logger_root]
+level=%s
+handlers=consoleHandler
+
+[handler_consoleHandler]
+class=StreamHandler
+level=%s
+formatter=simpleFormatter
+args=(sys.stderr,)
+
+[formatter_simpleFormatter]
+format=%%(asctime)s - %%(levelname)-8s %%(message)s [%%(filename)s:%%(lineno)d]
+datefmt=
+"""
+
+
+def peak_rss():
+    """
+    :return: peak resident set size of this process in bytes
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def run_benchmark(work_dir, sources=1, resources=1000, per_sitemap=50000, changes=0, dumps=0, resource_size=256,
+                  rounds=2, task="wellknown", latency=0.0, error_rate=0.0, checksum=True, log_level="WARNING",
+                  profile=False, workers=1, backend="des.fetch.RequestsBackend", compress=False, gzip_sitemaps=False,
+                  capability_index=False):
+    """
+    Generate sources in work_dir, serve them and run DesRunner rounds against them.
+    :return: list of dicts with the measurements of each round
+    """
+    simulator = SourceSimulator(os.path.join(work_dir, "www"), latency=latency, error_rate=error_rate,
+                                compress=compress)
+    simulator.start()
+    try:
+        start = time.time()
+        simulator.generate(sources=sources, resources=resources, per_sitemap=per_sitemap, changes=changes,
+                           dumps=dumps, resource_size=resource_size, gzip_sitemaps=gzip_sitemaps,
+                           capability_index=capability_index)
+        generate_time = time.time() - start
+
+        files = {"logging": os.path.join(work_dir, "logging.conf"),
+                 "desmap": os.path.join(work_dir, "desmap.txt"),
+                 "destination": os.path.join(work_dir, "destination"),
+                 "report": os.path.join(work_dir, "sync_status.csv"),
+                 "metrics": os.path.join(work_dir, "metrics.prom"),
+                 "state": os.path.join(work_dir, "resydes-state.db"),
+                 "checksum": str(checksum),
+                 "workers": workers,
+                 "backend": backend}
+        with open(files["logging"], "w") as file:
+            file.write(LOGGING % (log_level, log_level))
+        with open(files["desmap"], "w") as file:
+            file.write("# mapped by netloc\n")
+        config_filename = os.path.join(work_dir, "config.txt")
+        with open(config_filename, "w") as file:
+            file.write(CONFIG % files)
+        sources_filename = os.path.join(work_dir, "sources.txt")
+        with open(sources_filename, "w") as file:
+            file.write("\n".join(simulator.source_urls()) + "\n")
+
+        runner = DesRunner(config_filename=config_filename)
+        results = []
+        for r in range(rounds):
+            simulator.reset_counters()
+            start = time.time()
+            runner.run(sources_filename, task=task, once=True, profile=profile)
+            wall_time = time.time() - start
+            results.append({"round": r + 1,
+                            "generate_time": generate_time,
+                            "wall_time": wall_time,
+                            "requests": simulator.requests,
+                            "errors": simulator.errors,
+                            "requests_per_second": simulator.requests / wall_time if wall_time > 0 else 0.0,
+                            "bytes_moved": simulator.bytes_sent,
+                            "peak_rss": peak_rss()})
+        return results
+    finally:
+        simulator.stop()
+
+
+def print_results(results, out=sys.stdout):
+    out.write("%5s %10s %10s %8s %10s %14s %14s\n" %
+              ("round", "wall(s)", "requests", "errors", "req/s", "bytes moved", "peak rss"))
+    for result in results:
+        out.write("%5d %10.3f %10d %8d %10.1f %14d %14d\n" %
+                  (result["round"], result["wall_time"], result["requests"], result["errors"],
+                   result["requests_per_second"], result["bytes_moved"], result["peak_rss"]))
+
+
+if __name__ == '__main__':
+    task_choices = ['discover', 'wellknown', 'capability']
+
+    parser = argparse.ArgumentParser(description="Benchmark a ResourceSync Destination against simulated sources.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-s", "--sources", help="number of sources", type=int, default=1, metavar="")
+    parser.add_argument("-r", "--resources", help="number of resources per source", type=int, default=1000,
+                        metavar="")
+    parser.add_argument("-p", "--per-sitemap", help="maximum number of entries per sitemap", type=int,
+                        default=50000, metavar="")
+    parser.add_argument("--changes", help="number of change list entries per source", type=int, default=0,
+                        metavar="")
+    parser.add_argument("--dumps", help="number of ZIP files in the resource dump of each source", type=int,
+                        default=0, metavar="")
+    parser.add_argument("--resource-size", help="size of each resource in bytes", type=int, default=256,
+                        metavar="")
+    parser.add_argument("-n", "--rounds", help="number of rounds to run", type=int, default=2, metavar="")
+    parser.add_argument("-t", "--task", help="the task that should be run. " + str(task_choices),
+                        default="wellknown", choices=task_choices, metavar="")
+    parser.add_argument("--latency", help="seconds of latency per request", type=float, default=0.0, metavar="")
+    parser.add_argument("--error-rate", help="fraction of requests answered with 503", type=float, default=0.0,
+                        metavar="")
+    parser.add_argument("-w", "--workers", help="number of worker threads of the runner", type=int, default=1,
+                        metavar="")
+    parser.add_argument("-b", "--backend", help="the fetch backend of the runner", default="des.fetch.RequestsBackend",
+                        metavar="")
+    parser.add_argument("--compress", help="send sitemaps with Content-Encoding: gzip", action="store_true")
+    parser.add_argument("--gzip-sitemaps", help="write the sitemaps of a sitemapindex as .xml.gz files",
+                        action="store_true")
+    parser.add_argument("--capability-index", help="write the capability list as a sitemapindex of capability lists",
+                        action="store_true")
+    parser.add_argument("--no-checksum", help="do not compare checksums", action="store_true")
+    parser.add_argument("--profile", help="profile each round, results are written to the work directory",
+                        action="store_true")
+    parser.add_argument("-l", "--log-level", help="log level of the runner", default="WARNING", metavar="")
+    parser.add_argument("-d", "--work-dir", help="directory for sources and destination (default: a temporary "
+                                                 "directory that is removed afterwards)", metavar="")
+    parser.add_argument("-o", "--output", help="also write results as json to this file", metavar="")
+
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir else tempfile.mkdtemp(prefix="resydes_benchmark_")
+    try:
+        results = run_benchmark(work_dir, sources=args.sources, resources=args.resources,
+                                per_sitemap=args.per_sitemap, changes=args.changes, dumps=args.dumps,
+                                resource_size=args.resource_size, rounds=args.rounds, task=args.task,
+                                latency=args.latency, error_rate=args.error_rate, checksum=not args.no_checksum,
+                                log_level=args.log_level, profile=args.profile, workers=args.workers,
+                                backend=args.backend, compress=args.compress, gzip_sitemaps=args.gzip_sitemaps,
+                                capability_index=args.capability_index)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"arguments": vars(args), "results": results}, file, indent=2)
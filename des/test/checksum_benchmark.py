@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of des.checksum. Writes a number of files of random bytes and computes their digests with 1, 2, 4 ...
+worker processes, up to the number asked for. Reports wall time, megabytes per second and the speedup over one
+worker, next to resync.utils.compute_md5_for_file on one core.
+
+usage: python3 des/test/checksum_benchmark.py [-h] [options]     (from the root directory of the project)
+"""
+
+import sys, argparse, json, os, shutil, tempfile, time
+sys.path.append(".")
+
+from resync.utils import compute_md5_for_file
+
+from des.checksum import Checksummer, MD5, SHA256
+
+
+def write_files(directory, count, size):
+    filenames = []
+    for i in range(count):
+        filename = os.path.join(directory, "f%06d.bin" % i)
+        with open(filename, "wb") as file:
+            file.write(os.urandom(size))
+        filenames.append(filename)
+    return filenames
+
+
+def run(filenames, size, workers, algorithms):
+    checksummer = Checksummer(workers)
+    try:
+        # start the workers before the clock runs
+        list(checksummer.digests([(filenames[0], size, None)], algorithms))
+        start = time.time()
+        for item, digests in checksummer.digests([(filename, size, None) for filename in filenames], algorithms):
+            pass
+        return time.time() - start
+    finally:
+        checksummer.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark checksums of local files with a pool of processes.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-f", "--files", help="number of files", type=int, default=200, metavar="")
+    parser.add_argument("--file-size", help="size of each file in bytes", type=int, default=4 * 1024 * 1024,
+                        metavar="")
+    parser.add_argument("-w", "--workers", help="maximum number of worker processes", type=int,
+                        default=os.cpu_count() or 1, metavar="")
+    parser.add_argument("--sha256", help="compute sha-256 next to md5", action="store_true")
+    parser.add_argument("-d", "--work-dir", help="directory for the files (default: a temporary directory)",
+                        metavar="")
+    parser.add_argument("-o", "--output", help="also write results as json to this file", metavar="")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="resydes_checksum_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    algorithms = (MD5, SHA256) if args.sha256 else (MD5,)
+    megabytes = args.files * args.file_size / (1024 * 1024)
+    try:
+        filenames = write_files(work_dir, args.files, args.file_size)
+        start = time.time()
+        for filename in filenames:
+            compute_md5_for_file(filename)
+        baseline = time.time() - start
+        print("%-24s %10s %10s %8s" % ("", "seconds", "MB/s", "speedup"))
+        print("%-24s %10.2f %10.1f %8s" % ("resync md5, one core", baseline, megabytes / baseline, ""))
+
+        results = []
+        counts = []
+        workers = 1
+        while workers < args.workers:
+            counts.append(workers)
+            workers *= 2
+        counts.append(args.workers)
+        single = None
+        for workers in counts:
+            seconds = run(filenames, args.file_size, workers, algorithms)
+            single = single or seconds
+            results.append({"workers": workers, "seconds": seconds, "mb_per_second": megabytes / seconds,
+                            "speedup": single / seconds})
+            print("%-24s %10.2f %10.1f %8.2f" % ("%d workers" % workers, seconds, megabytes / seconds,
+                                                 single / seconds))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"baseline_seconds": baseline, "runs": results}, file, indent=2)
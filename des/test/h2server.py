@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A minimal HTTP/2 server that stands in for an HTTP/2-capable frontend in tests. It talks HTTP/2 over plain tcp
+with prior knowledge (h2c), serves the files in a directory and counts connections, requests and the maximum
+number of streams that were open on one connection at the same time.
+
+Needs h2: pip install h2
+"""
+
+import asyncio, logging, mimetypes, os, threading
+
+import h2.config, h2.connection, h2.events
+
+
+class H2Server(object):
+    """
+    Serves the files in root over HTTP/2 on localhost.
+    """
+
+    def __init__(self, root, port=0, latency=0.0):
+        """
+        Initialize a H2Server.
+        :param root: the directory to serve
+        :param port: the port to serve on (default = 0, any free port)
+        :param latency: seconds to wait before answering each request
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.root = os.path.abspath(root)
+        self.port = port
+        self.latency = latency
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.connections = 0
+        self.requests = 0
+        self.max_streams = 0
+        # path -> Content-Encoding sent with the file, the file is sent as it is
+        self.content_encodings = dict()
+
+    @property
+    def base_url(self):
+        return "http://localhost:%d" % self.port
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="h2server")
+        self.thread.daemon = True
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self.__serve__, "localhost", self.port), self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.logger.info("Serving %s over HTTP/2 at %s" % (self.root, self.base_url))
+
+    def stop(self):
+        async def close():
+            self.server.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def __respond__(self, path):
+        filename = os.path.normpath(os.path.join(self.root, path.split("?")[0].lstrip("/")))
+        if not filename.startswith(self.root) or not os.path.isfile(filename):
+            return 404, "text/plain", b"Not Found"
+        with open(filename, "rb") as file:
+            return 200, mimetypes.guess_type(filename)[0] or "application/octet-stream", file.read()
+
+    async def __serve__(self, reader, writer):
+        self.connections += 1
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False,
+                                                                          header_encoding="utf-8"))
+        connection.initiate_connection()
+        writer.write(connection.data_to_send())
+        # stream id -> body still to send
+        pending = dict()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for event in connection.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        self.requests += 1
+                        self.max_streams = max(self.max_streams, connection.open_inbound_streams)
+                        asyncio.ensure_future(self.__answer__(connection, writer, pending, event))
+                    elif isinstance(event, h2.events.WindowUpdated):
+                        self.__flush__(connection, writer, pending)
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+                writer.write(connection.data_to_send())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def __answer__(self, connection, writer, pending, event):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        path = dict(event.headers)[":path"]
+        status, content_type, body = self.__respond__(path)
+        headers = [(":status", str(status)), ("content-type", content_type), ("content-length", str(len(body)))]
+        if path in self.content_encodings:
+            headers.append(("content-encoding", self.content_encodings[path]))
+        connection.send_headers(event.stream_id, headers)
+        pending[event.stream_id] = body
+        self.__flush__(connection, writer, pending)
+
+    def __flush__(self, connection, writer, pending):
+        # send as much of the pending bodies as flow control allows
+        for stream_id in list(pending):
+            body = pending[stream_id]
+            while len(body) > 0:
+                size = min(len(body), connection.local_flow_control_window(stream_id),
+                           connection.max_outbound_frame_size)
+                if size <= 0:
+                    break
+                connection.send_data(stream_id, body[:size])
+                body = body[size:]
+            if len(body) == 0:
+                connection.end_stream(stream_id)
+                del pending[stream_id]
+            else:
+                pending[stream_id] = body
+        writer.write(connection.data_to_send())
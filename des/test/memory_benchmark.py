@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the memory resource lists take. Builds the same synthetic resource list as a resync ResourceList, a
+resync ChangeList, a list of des.compare.Entry and a des.columns.ResourceColumns, and reports the bytes per resource
+each of them takes, as measured by tracemalloc.
+
+usage: python3 des/test/memory_benchmark.py [-h] [options]     (from the root directory of the project)
+"""
+
+import sys, argparse, gc, json, random, tracemalloc
+sys.path.append(".")
+
+from resync.change_list import ChangeList
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+
+from des.columns import ResourceColumns
+from des.compare import Entry
+
+MD5S = ["1B2M2Y8AsgTpgAmY7PhCfg==", "XUFAKrxLKna5cZ2REBfFkg==", "rL0Y20zC+Fzt72VPzMSk2A=="]
+CHANGES = ["created", "updated", "deleted"]
+
+
+def generate(count, directories, seed=0):
+    """
+    :return: generator of tuples (uri, timestamp, length, md5, change)
+    """
+    rand = random.Random(seed)
+    for i in range(count):
+        uri = "http://source%d.example.com/resources/d%04d/r%08d.txt" % (i % 3, i % directories, i)
+        yield uri, 1451606400.0 + rand.randint(0, 10 ** 8), rand.randint(0, 10 ** 6), rand.choice(MD5S), \
+            rand.choice(CHANGES)
+
+
+def build_resource_list(rows):
+    resource_list = ResourceList()
+    for uri, timestamp, length, md5, change in rows:
+        resource_list.add(Resource(uri=uri, timestamp=timestamp, length=length, md5=md5))
+    return resource_list
+
+
+def build_change_list(rows):
+    change_list = ChangeList()
+    for uri, timestamp, length, md5, change in rows:
+        change_list.add(Resource(uri=uri, timestamp=timestamp, length=length, md5=md5, change=change))
+    return change_list
+
+
+def build_entries(rows):
+    return [Entry(uri, timestamp, length, md5) for uri, timestamp, length, md5, change in rows]
+
+
+def build_columns(rows):
+    columns = ResourceColumns()
+    for uri, timestamp, length, md5, change in rows:
+        columns.append(uri, timestamp, length, md5, change)
+    return columns
+
+
+CONTAINERS = [("ResourceList", build_resource_list), ("ChangeList", build_change_list),
+              ("list of Entry", build_entries), ("ResourceColumns", build_columns)]
+
+
+def measure(build, count, directories):
+    """
+    :return: tuple (bytes retained, peak bytes while building)
+    """
+    gc.collect()
+    tracemalloc.start()
+    # rows are made while building: the strings a container keeps count, the ones it lets go do not
+    container = build(generate(count, directories))
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del container
+    return retained, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the memory per resource of resource list containers.",
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-r", "--resources", help="number of resources", type=int, default=100000, metavar="")
+    parser.add_argument("--directories", help="number of directories the resources are in", type=int, default=100,
+                        metavar="")
+    parser.add_argument("-o", "--output", help="also write results as json to this file", metavar="")
+    args = parser.parse_args()
+
+    results = []
+    print("%-16s %14s %14s %12s" % ("container", "retained", "peak", "bytes/res"))
+    for name, build in CONTAINERS:
+        retained, peak = measure(build, args.resources, args.directories)
+        per_resource = retained / args.resources
+        results.append({"container": name, "resources": args.resources, "retained": retained, "peak": peak,
+                        "bytes_per_resource": per_resource})
+        print("%-16s %14d %14d %12.1f" % (name, retained, peak, per_resource))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,335 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A local ResourceSync source simulator. It generates synthetic sources of configurable size on disk and serves them
+over http with injectable latency and errors. Resources themselves are not stored: their content is derived from their
+uri when requested, so sources with millions of resources only cost disk space for their sitemaps.
+
+Usage: start() the simulator, so that its base url is known, then generate() sources.
+"""
+
+import base64, gzip, hashlib, logging, os, random, threading, time, zipfile
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+
+import resync.w3c_datetime as w3c
+
+XML_HEAD = "<?xml version='1.0' encoding='UTF-8'?>\n"
+URLSET = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" ' \
+         'xmlns:rs="http://www.openarchives.org/rs/terms/">\n'
+SITEMAPINDEX = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" ' \
+               'xmlns:rs="http://www.openarchives.org/rs/terms/">\n'
+
+# resources get lastmod values counting from here, one second apart.
+EPOCH = 1451606400.0  # 2016-01-01T00:00:00Z
+
+RESOURCE_FOLDER = "files"
+
+
+def resource_content(source, index, size):
+    """
+    The content of resource number index of source.
+    :param source: name of the source
+    :param index: number of the resource
+    :param size: size of the content in bytes
+    :return: content as bytes
+    """
+    line = ("%s resource %d\n" % (source, index)).encode("utf-8")
+    return (line * (size // len(line) + 1))[:size]
+
+
+def md5_of(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode("utf-8")
+
+
+class SourceSimulator(object):
+    """
+    Generates and serves synthetic ResourceSync sources. Each source has a source description, a capability list
+    (optionally a capability index with a capability list per capability), a resource list (a sitemapindex if the
+    source has more resources than fit in one sitemap) and optionally a change list and a resource dump.
+    """
+
+    def __init__(self, root, port=0, latency=0.0, error_rate=0.0, seed=0, compress=False):
+        """
+        Initialize a SourceSimulator.
+        :param root: the directory to generate sources in
+        :param port: the port to serve on (default = 0, any free port)
+        :param latency: seconds to wait before answering each request
+        :param error_rate: fraction of requests that will be answered with '503 Service Unavailable'
+        :param seed: seed for the random generator that decides on errors
+        :param compress: True to send sitemaps with 'Content-Encoding: gzip' to clients that accept it
+        :return: None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.root = os.path.abspath(root)
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.compress = compress
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.sources = []
+        self.resource_size = 256
+        self.gzip_sitemaps = False
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+
+    @property
+    def base_url(self):
+        return "http://localhost:%d" % self.server.server_address[1]
+
+    def source_urls(self):
+        """
+        :return: list of base urls of the generated sources
+        """
+        return ["%s/%s" % (self.base_url, source) for source in self.sources]
+
+    def generate(self, sources=1, resources=1000, per_sitemap=50000, changes=0, dumps=0, resource_size=256,
+                 gzip_sitemaps=False, capability_index=False):
+        """
+        Generate sources.
+        :param sources: number of sources
+        :param resources: number of resources per source
+        :param per_sitemap: maximum number of entries per sitemap
+        :param changes: number of entries in the change list of each source (0 = no change list)
+        :param dumps: number of ZIP files in the resource dump of each source (0 = no resource dump)
+        :param resource_size: size of each resource in bytes
+        :param gzip_sitemaps: True to write the sitemaps listed in a sitemapindex as gzip files, i.e.
+                resourcelist_00000.xml.gz
+        :param capability_index: True to write the capability list as a sitemapindex of capability lists with one
+                capability each, i.e. capabilitylist_00000.xml
+        :return: None
+        """
+        assert self.server is not None, "Start the simulator before generating sources"
+        self.resource_size = resource_size
+        self.gzip_sitemaps = gzip_sitemaps
+        for s in range(sources):
+            source = "source%d" % s
+            self.sources.append(source)
+            path = os.path.join(self.root, source)
+            os.makedirs(os.path.join(path, ".well-known"), exist_ok=True)
+            capabilities = [("resourcelist.xml", "resourcelist")]
+            self.__write_sitemaps__(path, source, "resourcelist", resources, per_sitemap, self.__resource_entry__)
+            if changes > 0:
+                capabilities.append(("changelist.xml", "changelist"))
+                self.__write_sitemaps__(path, source, "changelist", changes, per_sitemap, self.__change_entry__,
+                                        resources=resources)
+            if dumps > 0:
+                capabilities.append(("resourcedump.xml", "resourcedump"))
+                self.__write_dump__(path, source, resources, dumps)
+            if capability_index:
+                self.__write_capabilityindex__(path, source, capabilities)
+            else:
+                self.__write_capabilitylist__(path, source, capabilities)
+            with open(os.path.join(path, ".well-known", "resourcesync"), "w") as file:
+                file.write(XML_HEAD + URLSET)
+                file.write('<rs:md capability="description"/>\n')
+                file.write('<url><loc>%s/%s/capabilitylist.xml</loc><rs:md capability="capabilitylist"/></url>\n'
+                           % (self.base_url, source))
+                file.write("</urlset>\n")
+            self.logger.info("Generated %s with %d resources and %d changes" % (source, resources, changes))
+
+    def __write_capabilityindex__(self, path, source, capabilities):
+        with open(os.path.join(path, "capabilitylist.xml"), "w") as file:
+            file.write(XML_HEAD + SITEMAPINDEX)
+            file.write('<rs:ln rel="up" href="%s/%s/.well-known/resourcesync"/>\n' % (self.base_url, source))
+            file.write('<rs:md capability="capabilitylist"/>\n')
+            for part, capability in enumerate(capabilities):
+                name = "capabilitylist_%05d.xml" % part
+                file.write('<sitemap><loc>%s/%s/%s</loc><rs:md capability="capabilitylist"/></sitemap>\n'
+                           % (self.base_url, source, name))
+                self.__write_capabilitylist__(path, source, [capability], name)
+            file.write("</sitemapindex>\n")
+
+    def __write_capabilitylist__(self, path, source, capabilities, name="capabilitylist.xml"):
+        with open(os.path.join(path, name), "w") as file:
+            file.write(XML_HEAD + URLSET)
+            file.write('<rs:ln rel="up" href="%s/%s/.well-known/resourcesync"/>\n' % (self.base_url, source))
+            file.write('<rs:md capability="capabilitylist"/>\n')
+            for name, capability in capabilities:
+                file.write('<url><loc>%s/%s/%s</loc><rs:md capability="%s"/></url>\n'
+                           % (self.base_url, source, name, capability))
+            file.write("</urlset>\n")
+
+    def __write_sitemaps__(self, path, source, capability, count, per_sitemap, entry, resources=None):
+        at = w3c.datetime_to_str(EPOCH + count)
+        if count <= per_sitemap:
+            self.__write_urlset__(os.path.join(path, capability + ".xml"), capability, at, range(count),
+                                  source, entry, resources)
+            return
+
+        with open(os.path.join(path, capability + ".xml"), "w") as file:
+            file.write(XML_HEAD + SITEMAPINDEX)
+            file.write('<rs:md capability="%s" at="%s"/>\n' % (capability, at))
+            for part, start in enumerate(range(0, count, per_sitemap)):
+                name = "%s_%05d.xml%s" % (capability, part, ".gz" if self.gzip_sitemaps else "")
+                file.write('<sitemap><loc>%s/%s/%s</loc><rs:md capability="%s" at="%s"/></sitemap>\n'
+                           % (self.base_url, source, name, capability, at))
+                self.__write_urlset__(os.path.join(path, name), capability, at,
+                                      range(start, min(start + per_sitemap, count)), source, entry, resources)
+            file.write("</sitemapindex>\n")
+
+    def __write_urlset__(self, filename, capability, at, indexes, source, entry, resources):
+        with (gzip.open if filename.endswith(".gz") else open)(filename, "wt") as file:
+            file.write(XML_HEAD + URLSET)
+            file.write('<rs:md capability="%s" at="%s"/>\n' % (capability, at))
+            for index in indexes:
+                file.write(entry(source, index, resources))
+            file.write("</urlset>\n")
+
+    def __resource_entry__(self, source, index, resources=None):
+        data = resource_content(source, index, self.resource_size)
+        return '<url><loc>%s/%s/%s/r%d.txt</loc><lastmod>%s</lastmod>' \
+               '<rs:md hash="md5:%s" length="%d"/></url>\n' \
+               % (self.base_url, source, RESOURCE_FOLDER, index, w3c.datetime_to_str(EPOCH + index), md5_of(data),
+                  len(data))
+
+    def __change_entry__(self, source, index, resources):
+        # changes touch the resources round robin, all of them are updates of the existing content.
+        resource = index % resources
+        data = resource_content(source, resource, self.resource_size)
+        return '<url><loc>%s/%s/%s/r%d.txt</loc><lastmod>%s</lastmod>' \
+               '<rs:md change="updated" hash="md5:%s" length="%d"/></url>\n' \
+               % (self.base_url, source, RESOURCE_FOLDER, resource, w3c.datetime_to_str(EPOCH + resources + index),
+                  md5_of(data), len(data))
+
+    def __write_dump__(self, path, source, resources, dumps):
+        at = w3c.datetime_to_str(EPOCH + resources)
+        per_dump = max(1, -(-resources // dumps))
+        with open(os.path.join(path, "resourcedump.xml"), "w") as file:
+            file.write(XML_HEAD + URLSET)
+            file.write('<rs:md capability="resourcedump" at="%s"/>\n' % at)
+            for part, start in enumerate(range(0, resources, per_dump)):
+                name = "rd_%05d.zip" % part
+                zip_name = os.path.join(path, name)
+                with zipfile.ZipFile(zip_name, "w") as z:
+                    manifest = [XML_HEAD, URLSET, '<rs:md capability="resourcedump-manifest" at="%s"/>\n' % at]
+                    for index in range(start, min(start + per_dump, resources)):
+                        data = resource_content(source, index, self.resource_size)
+                        z.writestr("%s/r%d.txt" % (RESOURCE_FOLDER, index), data)
+                        manifest.append('<url><loc>%s/%s/%s/r%d.txt</loc><lastmod>%s</lastmod>'
+                                        '<rs:md hash="md5:%s" length="%d" path="/%s/r%d.txt"/></url>\n'
+                                        % (self.base_url, source, RESOURCE_FOLDER, index,
+                                           w3c.datetime_to_str(EPOCH + index), md5_of(data), len(data),
+                                           RESOURCE_FOLDER, index))
+                    manifest.append("</urlset>\n")
+                    z.writestr("manifest.xml", "".join(manifest))
+                file.write('<url><loc>%s/%s/%s</loc><rs:md type="application/zip" length="%d" at="%s"/></url>\n'
+                           % (self.base_url, source, name, os.path.getsize(zip_name), at))
+            file.write("</urlset>\n")
+
+    def start(self):
+        """
+        Start serving the generated sources in a background thread.
+        :return: None
+        """
+        handler = partial(SimulatorRequestHandler, self, directory=self.root)
+        self.server = ThreadingHTTPServer(("localhost", self.port), handler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.logger.info("Serving %d sources from %s at %s" % (len(self.sources), self.root, self.base_url))
+
+    def stop(self):
+        """
+        Stop serving.
+        :return: None
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes_sent = 0
+
+    def __count__(self, sent=0, request=False, error=False):
+        with self.lock:
+            self.bytes_sent += sent
+            self.requests += 1 if request else 0
+            self.errors += 1 if error else 0
+
+    def __fail__(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+class CountingWriter(object):
+
+    def __init__(self, simulator, wfile):
+        self.simulator = simulator
+        self.wfile = wfile
+
+    def write(self, data):
+        self.simulator.__count__(sent=len(data))
+        return self.wfile.write(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
+
+class SimulatorRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the sitemaps and dumps of the simulator from disk and the content of resources from their uri.
+    """
+
+    def __init__(self, simulator, *args, **kwargs):
+        self.simulator = simulator
+        super(SimulatorRequestHandler, self).__init__(*args, **kwargs)
+
+    def setup(self):
+        super(SimulatorRequestHandler, self).setup()
+        self.wfile = CountingWriter(self.simulator, self.wfile)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.simulator.__count__(request=True)
+        if self.simulator.latency > 0:
+            time.sleep(self.simulator.latency)
+        if self.simulator.__fail__():
+            self.simulator.__count__(error=True)
+            self.send_error(503)
+            return
+
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) == 3 and parts[1] == RESOURCE_FOLDER and parts[2].startswith("r") and parts[2].endswith(".txt"):
+            try:
+                index = int(parts[2][1:-4])
+            except ValueError:
+                self.send_error(404)
+                return
+            self.__send__(resource_content(parts[0], index, self.simulator.resource_size), "text/plain")
+        elif self.__accepts_gzip__() and (parts[-1].endswith(".xml") or parts[-1] == "resourcesync"):
+            filename = self.translate_path(self.path)
+            if not os.path.isfile(filename):
+                self.send_error(404)
+                return
+            with open(filename, "rb") as file:
+                self.__send__(gzip.compress(file.read()), "application/xml", encoding="gzip")
+        else:
+            super(SimulatorRequestHandler, self).do_GET()
+
+    def __accepts_gzip__(self):
+        accepted = [coding.split(";")[0].strip() for coding in self.headers.get("Accept-Encoding", "").split(",")]
+        return self.simulator.compress and "gzip" in accepted
+
+    def __send__(self, data, content_type, encoding=None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
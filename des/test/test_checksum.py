@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64, hashlib, logging, logging.config, os, shutil, tempfile, unittest
+
+from resync.mapper import Mapper
+from resync.utils import compute_md5_for_file
+
+import des.checksum
+from des.checksum import Checksummer, MD5, SHA256, file_digests
+from des.config import Config
+from des.compare import Entry, equal, iter_disk
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+def sha256_of(filename):
+    with open(filename, "rb") as file:
+        return base64.b64encode(hashlib.sha256(file.read()).digest()).decode("ascii")
+
+
+class TestChecksum(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        self.tmpdir = tempfile.mkdtemp(prefix="resydes_checksum_")
+        self.filenames = []
+        for i, size in enumerate((0, 1, 1000, 100000, 3 * 1024 * 1024 + 7)):
+            filename = os.path.join(self.tmpdir, "f%d.bin" % i)
+            with open(filename, "wb") as file:
+                file.write(os.urandom(size))
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        des.checksum.reset_instance()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test01_file_digests(self):
+        threshold = des.checksum.MMAP_THRESHOLD
+        try:
+            # read with a buffer and memory-mapped
+            for des.checksum.MMAP_THRESHOLD in (threshold, 1):
+                for filename in self.filenames:
+                    self.assertEqual((compute_md5_for_file(filename), sha256_of(filename)),
+                                     file_digests(filename, (MD5, SHA256)))
+        finally:
+            des.checksum.MMAP_THRESHOLD = threshold
+        self.assertRaises(OSError, file_digests, os.path.join(self.tmpdir, "missing"), (MD5,))
+
+    def test02_checksummer(self):
+        items = [(filename, os.path.getsize(filename), i) for i, filename in enumerate(self.filenames)]
+        missing = os.path.join(self.tmpdir, "missing")
+        items.insert(2, (missing, 0, -1))
+        for workers in (1, 2):
+            checksummer = Checksummer(workers)
+            try:
+                results = list(checksummer.digests(items, (SHA256,)))
+            finally:
+                checksummer.close()
+            # in the order of items
+            self.assertEqual(items, [item for item, digests in results])
+            for item, digests in results:
+                if item[0] == missing:
+                    self.assertIsInstance(digests, OSError)
+                else:
+                    self.assertEqual((sha256_of(item[0]),), digests)
+
+    def test03_iter_disk(self):
+        mapper = Mapper(["http://example.com/", self.tmpdir])
+        entries = sorted(iter_disk(mapper, set_md5=True, set_sha256=True))
+        self.assertEqual(["http://example.com/f%d.bin" % i for i in range(5)], [e.uri for e in entries])
+        for filename, entry in zip(self.filenames, entries):
+            self.assertEqual(compute_md5_for_file(filename), entry.md5)
+            self.assertEqual(sha256_of(filename), entry.sha256)
+        entries = list(iter_disk(mapper, set_sha256=True))
+        self.assertTrue(all(entry.md5 is None and entry.sha256 is not None for entry in entries))
+
+    def test04_equal(self):
+        self.assertTrue(equal(Entry("a", None, 1, None, "x"), Entry("a", None, 1, "m")))
+        self.assertTrue(equal(Entry("a", None, 1, None, "x"), Entry("a", None, 1, None, "x")))
+        self.assertFalse(equal(Entry("a", None, 1, None, "x"), Entry("a", None, 1, None, "y")))
+
+
+if __name__ == "__main__":
+    unittest.main()
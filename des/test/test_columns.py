@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io, logging, logging.config, unittest
+
+from resync.change_list import ChangeList
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+from resync.sitemap import Sitemap
+
+from des.columns import ResourceColumns
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+CHANGE_LIST = b"""<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:ln href="http://example.com/capabilitylist.xml" rel="up"/>
+<rs:md capability="changelist" from="2016-01-01T00:00:00Z"/>
+<url><loc>http://example.com/a.txt</loc><lastmod>2016-01-01T00:00:01Z</lastmod>
+<rs:md change="created" hash="md5:1B2M2Y8AsgTpgAmY7PhCfg==" length="0"/></url>
+<url><loc>http://example.com/b/c.txt</loc><lastmod>2016-01-01T00:00:02Z</lastmod><rs:md change="updated"/></url>
+<url><loc>http://example.com/a.txt</loc><lastmod>2016-01-01T00:00:03Z</lastmod><rs:md change="deleted"/></url>
+<url><loc>http://example.com/d.txt</loc><lastmod>2016-01-01T00:00:04Z</lastmod>
+<rs:md change="updated" hash="sha-256:47DEQpj8"/></url>
+</urlset>"""
+
+
+class TestResourceColumns(unittest.TestCase):
+
+    def test01_round_trip(self):
+        resources = [
+            Resource(uri="http://example.com/a/b.txt", timestamp=1451606401.5, length=10,
+                     md5="1B2M2Y8AsgTpgAmY7PhCfg=="),
+            Resource(uri="http://example.com/a/c.txt"),
+            Resource(uri="http://example.com/ü.txt", lastmod="2016-01-01T00:00:01Z", length=0, change="deleted"),
+            # not base64 of 16 bytes
+            Resource(uri="http://example.com/a/d.txt", md5="not-an-md5"),
+            Resource(uri="http://example.com/a/e.txt", capability="resourcelist", md_at="2016-01-01T00:00:01Z"),
+        ]
+        columns = ResourceColumns()
+        columns.add(resources)
+        self.assertEqual(5, len(columns))
+        self.assertEqual([r.uri for r in resources], columns.uris())
+        for resource, column in zip(resources, columns):
+            self.assertEqual(resource, column)
+            self.assertEqual(resource.md5, column.md5)
+            self.assertEqual(resource.length, column.length)
+            self.assertEqual(resource.change, column.change)
+        self.assertEqual("resourcelist", columns[-1].capability)
+        self.assertEqual("2016-01-01T00:00:01Z", columns[-1].md_at)
+        self.assertRaises(IndexError, columns.__getitem__, 5)
+        # one prefix shared by four uris
+        self.assertEqual(2, len(columns.prefixes))
+
+    def test02_find(self):
+        columns = ResourceColumns()
+        for i in (5, 3, 9, 1, 3):
+            columns.append("http://example.com/r%d" % i, timestamp=float(i))
+        self.assertEqual(1, columns.find("http://example.com/r3"))
+        self.assertIsNone(columns.find("http://example.com/r4"))
+        self.assertTrue("http://example.com/r9" in columns)
+        self.assertEqual(1.0, columns.get("http://example.com/r1").timestamp)
+        columns.append("http://example.com/r4")
+        self.assertEqual(5, columns.find("http://example.com/r4"))
+
+    def test03_parse_and_prune_as_resync(self):
+        columns = Sitemap().parse_xml(fh=io.BytesIO(CHANGE_LIST), resources=ResourceColumns())
+        change_list = Sitemap().parse_xml(fh=io.BytesIO(CHANGE_LIST), resources=ChangeList())
+        self.assertEqual("changelist", columns.capability)
+        self.assertEqual(change_list.up, columns.up)
+        self.assertEqual(change_list.md_from, columns.md_from)
+        # nothing is kept whole; the sha-256, too short, is kept on the side
+        self.assertEqual({}, columns.extras)
+        self.assertEqual([3], list(columns.odd_sha256s))
+
+        self.assertEqual(change_list.prune_dupes(), columns.prune_dupes())
+        self.assertEqual([(r.uri, r.change, r.timestamp) for r in change_list],
+                         [(r.uri, r.change, r.timestamp) for r in columns])
+        self.assertEqual("sha-256:47DEQpj8", columns[-1].hash)
+
+    def test04_sha256(self):
+        sha256 = "47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU="
+        columns = ResourceColumns()
+        columns.add(Resource(uri="http://example.com/a.txt", md5="1B2M2Y8AsgTpgAmY7PhCfg=="))
+        self.assertIsNone(columns.sha256s)
+        columns.add(Resource(uri="http://example.com/b.txt", sha256=sha256))
+        self.assertEqual(64, len(columns.sha256s))
+        self.assertEqual({}, columns.extras)
+        self.assertIsNone(columns[0].sha256)
+        self.assertEqual(sha256, columns[1].sha256)
+        self.assertEqual(sha256, columns.entry(1).sha256)
+        self.assertIsNone(columns.entry(1).md5)
+
+    def test05_memory(self):
+        columns = ResourceColumns()
+        resource_list = ResourceList()
+        for i in range(1000):
+            resource = Resource(uri="http://example.com/resources/r%06d.txt" % i, timestamp=1451606400.0 + i,
+                                length=i, md5="1B2M2Y8AsgTpgAmY7PhCfg==")
+            columns.add(resource)
+            resource_list.add(resource)
+        self.assertEqual([r.uri for r in resource_list], columns.uris())
+        # 4 prefix id, 8 offset, 8 timestamp, 8 length, 16 md5, 1 flags and 11 suffix bytes per resource
+        self.assertEqual(56, (columns.nbytes() - len("http://example.com/resources/") - 8) // 1000)
+
+    def test06_coalesce(self):
+        columns = ResourceColumns(capability_name="changelist")
+        changes = [("a", 1.0, "updated"), ("b", 1.0, "created"), ("a", 3.0, "updated"), ("c", 1.0, "created"),
+                   ("b", 2.0, "updated"), ("d", 1.0, "updated"), ("a", 2.0, "updated"), ("c", 2.0, "deleted"),
+                   ("d", 2.0, "deleted"), ("e", 2.0, "deleted"), ("e", 2.0, "created")]
+        for uri, timestamp, change in changes:
+            columns.append("http://example.com/" + uri, timestamp, change=change)
+        # 8 created or updated changes, 3 of them are fetched
+        self.assertEqual((7, 5), columns.coalesce())
+        self.assertEqual([("http://example.com/a", 3.0, "updated"), ("http://example.com/b", 2.0, "created"),
+                          ("http://example.com/d", 2.0, "deleted"), ("http://example.com/e", 2.0, "created")],
+                         [(r.uri, r.timestamp, r.change) for r in columns])
+        self.assertEqual((0, 0), columns.coalesce())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io, logging, logging.config, os, random, shutil, tempfile, unittest
+
+from resync.mapper import Mapper
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+from resync.resource_list_builder import ResourceListBuilder
+from resync.sitemap import SitemapParseError
+
+import des.compare
+from des.config import Config
+from des.compare import Entry, ExternalSort, compare, iter_disk, iter_sitemap
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+RESOURCE_LIST = b"""<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md capability="resourcelist" at="2016-01-01T00:00:00Z"/>
+<url><loc>http://example.com/b.txt</loc><lastmod>2016-01-01T00:00:02Z</lastmod>
+<rs:md hash="md5:1B2M2Y8AsgTpgAmY7PhCfg== sha-256:47DEQpj8" length="0"/></url>
+<url><loc>http://example.com/a.txt</loc><lastmod>2016-01-01T00:00:01Z</lastmod></url>
+</urlset>"""
+
+
+class TestCompare(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        self.tmpdir = tempfile.mkdtemp(prefix="resydes_compare_")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test01_external_sort(self):
+        uris = ["http://example.com/r%d" % i for i in range(1000)]
+        random.Random(0).shuffle(uris)
+        # a budget of a few entries spills many runs
+        with ExternalSort(memory_budget=2000, tmpdir=self.tmpdir) as entries:
+            entries.extend(Entry(uri, None, None, None) for uri in uris)
+            # duplicates: the first one added is kept
+            entries.add(Entry(uris[0], 1.0, None, None))
+            self.assertTrue(len(entries.runs) > 10)
+            self.assertEqual(1001, len(entries))
+            result = list(entries)
+        self.assertEqual(sorted(uris), [entry.uri for entry in result])
+        self.assertTrue(all(entry.timestamp is None for entry in result))
+        # runs are removed
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+    def test01_memory_budget_counts_sorting(self):
+        with ExternalSort(tmpdir=self.tmpdir) as entries:
+            entries.extend(Entry("http://example.com/r%d" % i, None, None, None) for i in range(10))
+            # the list of indexes and the key strings of the sort are counted beside the columns
+            self.assertTrue(entries.nbytes() >= entries.buffer.nbytes() + 10 * des.compare.SORT_OVERHEAD)
+
+    def test02_compare_as_resync(self):
+        rand = random.Random(1)
+        dst, src = [], []
+        for i in range(500):
+            uri = "http://example.com/r%03d" % i
+            if rand.random() < 0.8:
+                dst.append(Entry(uri, float(i), 10, "md5-%d" % i))
+            if rand.random() < 0.8:
+                changed = rand.random() < 0.2
+                src.append(Entry(uri, float(i + (5 if changed else 0)), 10, "md5-%d" % i))
+
+        with ExternalSort(memory_budget=1000, tmpdir=self.tmpdir) as dst_sort, \
+                ExternalSort(memory_budget=1000, tmpdir=self.tmpdir) as src_sort:
+            dst_sort.extend(reversed(dst))
+            src_sort.extend(reversed(src))
+            result = dict((kind, []) for kind in (des.compare.SAME, des.compare.UPDATED, des.compare.DELETED,
+                                                  des.compare.CREATED))
+            for kind, entry in compare(dst_sort, src_sort):
+                result[kind].append(entry.uri)
+
+        dst_list, src_list = ResourceList(), ResourceList()
+        for entry in dst:
+            dst_list.add(entry.to_resource())
+        for entry in src:
+            src_list.add(entry.to_resource())
+        same, updated, deleted, created = dst_list.compare(src_list)
+        self.assertEqual([r.uri for r in same], result[des.compare.SAME])
+        self.assertEqual([r.uri for r in updated], result[des.compare.UPDATED])
+        self.assertEqual([r.uri for r in deleted], result[des.compare.DELETED])
+        self.assertEqual([r.uri for r in created], result[des.compare.CREATED])
+
+    def test03_iter_sitemap(self):
+        entries = list(iter_sitemap(io.BytesIO(RESOURCE_LIST), capability="resourcelist"))
+        self.assertEqual(["http://example.com/b.txt", "http://example.com/a.txt"], [e.uri for e in entries])
+        self.assertEqual("1B2M2Y8AsgTpgAmY7PhCfg==", entries[0].md5)
+        self.assertEqual(0, entries[0].length)
+        self.assertIsNone(entries[1].md5)
+        self.assertEqual(Resource(uri="http://example.com/a.txt", lastmod="2016-01-01T00:00:01Z"),
+                         entries[1].to_resource())
+
+        with self.assertRaises(SitemapParseError):
+            list(iter_sitemap(io.BytesIO(RESOURCE_LIST), capability="changelist"))
+        index = b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"></sitemapindex>'
+        with self.assertRaises(SitemapParseError):
+            list(iter_sitemap(io.BytesIO(index)))
+
+    def test04_iter_disk_as_resync(self):
+        for name in ("a.txt", "sub/b.txt", "sub/c.txt", "sitemap.xml", ".git/config"):
+            filename = os.path.join(self.tmpdir, name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, "w") as file:
+                file.write(name)
+        mapper = Mapper(["http://example.com/", self.tmpdir])
+        entries = sorted(iter_disk(mapper, set_md5=True))
+        resource_list = ResourceListBuilder(mapper=mapper, set_md5=True).from_disk()
+        self.assertEqual([r.uri for r in resource_list], [e.uri for e in entries])
+        for resource, entry in zip(resource_list, entries):
+            self.assertEqual(resource, entry.to_resource())
+            self.assertEqual(resource.md5, entry.md5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os, shutil, signal, tempfile, time, unittest
+
+from des.control import Control
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestControl(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="resydes_")
+        self.sources = os.path.join(self.directory, "sources.txt")
+        with open(self.sources, "w") as file:
+            file.write("http://example.com/rs1\n")
+        self.stop_filename = os.path.join(self.directory, "stop")
+        self.control = Control(watched_files=[self.sources], stop_filename=self.stop_filename, watch_interval=0.05)
+        self.control.start()
+
+    def tearDown(self):
+        self.control.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test01_reload_on_change(self):
+        self.assertTrue(self.control.take_reload())
+        self.assertFalse(self.control.take_reload())
+        with open(self.sources, "a") as file:
+            file.write("http://example.com/rs2\n")
+        start = time.time()
+        self.assertTrue(self.control.wait(10))
+        self.assertTrue(time.time() - start < 5)
+        self.assertTrue(self.control.take_reload())
+        self.assertFalse(self.control.stop_requested)
+
+    def test02_stop_file(self):
+        self.assertFalse(self.control.wait(0.1))
+        open(self.stop_filename, "w").close()
+        self.assertTrue(self.control.wait(10))
+        self.assertTrue(self.control.stop_requested)
+
+    def test03_signals(self):
+        os.kill(os.getpid(), signal.SIGHUP)
+        self.control.take_reload()
+        os.kill(os.getpid(), signal.SIGHUP)
+        self.assertTrue(self.control.wait(10))
+        self.assertTrue(self.control.take_reload())
+        os.kill(os.getpid(), signal.SIGTERM)
+        self.assertTrue(self.control.wait(10))
+        self.assertTrue(self.control.stop_requested)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, shutil, tempfile, time, unittest
+
+import des.deadline, des.fetch, des.reporter
+from des.deadline import Deadline, DeadlineExceeded
+from des.fetch import FetchTimeout, RequestsBackend
+from des.processor import Capaproc
+from des.status import Status
+from des.taskqueue import Task, TaskQueue, fork
+from des.test.simulator import SourceSimulator
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class ForkingTask(Task):
+    """
+    Sleeps, then forks a task that records whether it ran or was skipped.
+    """
+
+    kind = "forking"
+
+    def __init__(self, log, sleep=0.0, source=None):
+        super(ForkingTask, self).__init__(source=source)
+        self.log = log
+        self.sleep = sleep
+
+    def run(self):
+        time.sleep(self.sleep)
+        fork(RecordingTask(self.log))
+
+
+class RecordingTask(Task):
+
+    kind = "recording"
+
+    def __init__(self, log):
+        super(RecordingTask, self).__init__()
+        self.log = log
+
+    def run(self):
+        self.log.append("run")
+
+    def skipped(self, err):
+        self.log.append("skipped")
+
+
+class TestDeadline(unittest.TestCase):
+
+    def setUp(self):
+        des.reporter.reset_instance()
+
+    def test01_budget(self):
+        self.assertIsNone(Deadline(0, "none").remaining())
+        self.assertFalse(Deadline(0, "none").expired())
+        self.assertEqual(5, Deadline(0, "none").timeout(5))
+
+        round_deadline = Deadline(0.2, "round")
+        source_deadline = Deadline(60, "source", parent=round_deadline)
+        # the round budget is the smaller one
+        self.assertTrue(source_deadline.remaining() <= 0.2)
+        self.assertTrue(source_deadline.timeout(10) <= 0.2)
+        time.sleep(0.25)
+        self.assertTrue(source_deadline.expired())
+        self.assertEqual(0.0, source_deadline.timeout(10))
+        with self.assertRaises(DeadlineExceeded) as context:
+            source_deadline.check()
+        self.assertTrue("round" in str(context.exception))
+
+    def test02_scope(self):
+        self.assertIsNone(des.deadline.current())
+        deadline = Deadline(0.01, "source")
+        with des.deadline.scope(deadline):
+            self.assertIs(deadline, des.deadline.current())
+            time.sleep(0.02)
+            self.assertRaises(DeadlineExceeded, des.deadline.check)
+        self.assertIsNone(des.deadline.current())
+        des.deadline.check()
+
+    def test03_skip_forked_tasks(self):
+        log = []
+        task = ForkingTask(log, source="http://example.com/a")
+        task.deadline = Deadline(10, "a")
+        TaskQueue(2).run([task])
+        self.assertEqual(["run"], log)
+
+        log = []
+        task = ForkingTask(log, sleep=0.1, source="http://example.com/b")
+        task.deadline = Deadline(0.05, "b")
+        TaskQueue(2).run([task])
+        self.assertEqual(["skipped"], log)
+
+
+class TestStalledSource(unittest.TestCase):
+
+    def setUp(self):
+        des.reporter.reset_instance()
+        self.root = tempfile.mkdtemp(prefix="resydes_deadline_")
+        # the server waits a second before it answers
+        self.simulator = SourceSimulator(self.root, latency=1.0)
+        self.simulator.start()
+        self.simulator.generate(sources=1, resources=1)
+        self.uri = self.simulator.source_urls()[0] + "/capabilitylist.xml"
+
+    def tearDown(self):
+        des.fetch.reset_instance()
+        self.simulator.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test01_read_timeout(self):
+        backend = RequestsBackend()
+        backend.set_timeouts(1.0, 0.2)
+        start = time.time()
+        self.assertRaises(FetchTimeout, backend.get, self.uri)
+        self.assertTrue(time.time() - start < 0.9)
+
+    def test02_budget(self):
+        backend = RequestsBackend()
+        start = time.time()
+        with des.deadline.scope(Deadline(0.2, "source")):
+            self.assertRaises(DeadlineExceeded, backend.get, self.uri)
+            # no requests once the budget has been spent
+            self.assertRaises(DeadlineExceeded, backend.get, self.uri)
+        self.assertTrue(time.time() - start < 0.9)
+
+    def test03_processor(self):
+        processor = Capaproc(self.uri)
+        with des.deadline.scope(Deadline(0.2, "source")):
+            self.assertFalse(processor.read_source())
+        self.assertEqual(Status.timed_out, processor.status)
+        self.assertEqual(1, len(processor.exceptions))
+
+
+if __name__ == "__main__":
+    unittest.main()
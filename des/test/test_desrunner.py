@@ -3,6 +3,7 @@
 
 
 import unittest, des.processor
+from des.control import Control
 from des.desrunner import DesRunner
 from des.config import Config
 
@@ -26,3 +27,23 @@ class TestDesrunner(unittest.TestCase):
         runner = DesRunner()
         self.assertEqual(2, len(des.processor.processor_listeners))
 
+
+    def test_scheduled_round(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        runner = DesRunner()
+        runner.control = Control()
+        rounds = []
+
+        def prepare_round(sources):
+            runner.sources = ["http://a.com", "http://b.com", "http://c.com"]
+
+        def do_round(task, uris, profile):
+            rounds.append(uris)
+            runner.control.request_stop("test")
+
+        runner.__prepare_round__ = prepare_round
+        runner.__do_round__ = do_round
+        runner.__do_report__ = lambda task: None
+        runner.__run_scheduled__("sources.txt", "discover", False, 60, 3600)
+        # the source urls that are due are visited in one round
+        self.assertEqual([["http://a.com", "http://b.com", "http://c.com"]], rounds)
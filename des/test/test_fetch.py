@@ -0,0 +1,226 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os, shutil, socket, tempfile, threading, time, unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import des.fetch, des.reporter
+from des.fetch import AsyncBackend, FetchError, RequestsBackend
+from des.processor import Sodesproc
+from des.status import Status
+from des.sync import Relisync
+from des.test.simulator import SourceSimulator
+
+try:
+    import httpx, h2
+    from des.test.h2server import H2Server
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+class CorruptGzipHandler(BaseHTTPRequestHandler):
+    # answers 'Content-Encoding: gzip' with a body that is not gzip
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        data = b"this is not gzip"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TestRequestsBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="resydes_fetch_")
+        self.simulator = SourceSimulator(self.root)
+        self.simulator.start()
+        self.simulator.generate(sources=1, resources=3)
+
+    def tearDown(self):
+        self.simulator.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test01_get(self):
+        backend = RequestsBackend()
+        base = self.simulator.source_urls()[0]
+        response = backend.get(base + "/capabilitylist.xml")
+        self.assertEqual(200, response.status_code)
+        self.assertTrue("capabilitylist" in response.text)
+        self.assertEqual(404, backend.get(base + "/nothing.xml").status_code)
+        self.assertRaises(FetchError, backend.get, "http://localhost:%d/" % free_port())
+
+    def test02_compressed(self):
+        self.simulator.compress = True
+        self.simulator.generate(sources=1, resources=25, per_sitemap=10, gzip_sitemaps=True)
+        base = self.simulator.source_urls()[1]
+        backend = RequestsBackend()
+        # sent with Content-Encoding: gzip and decoded while read
+        response = backend.get(base + "/resourcelist.xml")
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertFalse(response.is_gzipped())
+        self.assertTrue("resourcelist_00002.xml.gz" in response.text)
+
+        # a gzip file is decompressed by the response
+        response = backend.get(base + "/resourcelist_00002.xml.gz")
+        self.assertTrue(response.is_gzipped())
+        self.assertTrue(response.text.startswith("<?xml"))
+        self.assertTrue(response.document.startswith(b"<?xml"))
+
+        des.fetch.set_instance(backend)
+        try:
+            resource_list = list(Relisync(base + "/resourcelist_00002.xml.gz").read_resource_list())
+        finally:
+            des.fetch.reset_instance()
+        self.assertEqual(5, len(resource_list))
+
+    def test03_get_to_file(self):
+        backend = RequestsBackend()
+        base = self.simulator.source_urls()[0]
+        with tempfile.TemporaryFile() as file:
+            response = backend.get_to_file(base + "/capabilitylist.xml", file)
+            self.assertEqual(200, response.status_code)
+            self.assertIsNone(response.content)
+            file.seek(0)
+            content = file.read()
+        self.assertEqual(backend.get(base + "/capabilitylist.xml").content, content)
+        self.assertEqual(len(content), response.length)
+
+        # the body of an error is not written
+        with tempfile.TemporaryFile() as file:
+            response = backend.get_to_file(base + "/nothing.xml", file)
+            self.assertEqual(404, response.status_code)
+            self.assertEqual(0, file.tell())
+
+    def test04_session_per_thread(self):
+        backend = RequestsBackend()
+        base = self.simulator.source_urls()[0]
+        backend.get(base + "/capabilitylist.xml")
+        backend.get(base + "/capabilitylist.xml")
+        thread = threading.Thread(target=backend.get, args=(base + "/capabilitylist.xml",))
+        thread.start()
+        thread.join()
+        # one session for the requests of this thread, one for the other thread
+        self.assertEqual(2, len(backend.sessions))
+        backend.close()
+        self.assertEqual([], backend.sessions)
+        self.assertEqual(200, backend.get(base + "/capabilitylist.xml").status_code)
+
+    def test05_corrupt_encoding(self):
+        server = ThreadingHTTPServer(("localhost", 0), CorruptGzipHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            backend = RequestsBackend()
+            uri = "http://localhost:%d/resourcelist.xml" % server.server_address[1]
+            self.assertRaises(FetchError, backend.get, uri)
+            with tempfile.TemporaryFile() as file:
+                self.assertRaises(FetchError, backend.get_to_file, uri, file)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+
+@unittest.skipUnless(HTTP2, "httpx[http2] is not installed")
+class TestAsyncBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="resydes_fetch_")
+        for i in range(16):
+            with open(os.path.join(self.root, "r%d.txt" % i), "w") as file:
+                file.write("resource %d\n" % i * 10000)
+        self.server = H2Server(self.root, latency=0.1)
+        self.server.start()
+        self.backend = AsyncBackend(prior_knowledge=True)
+
+    def tearDown(self):
+        des.fetch.reset_instance()
+        self.backend.close()
+        self.server.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test01_multiplex(self):
+        responses = dict()
+
+        def get(i):
+            responses[i] = self.backend.get("%s/r%d.txt" % (self.server.base_url, i))
+
+        start = time.time()
+        threads = [threading.Thread(target=get, args=(i,)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 16 requests of 0.1 seconds each in much less than 1.6 seconds
+        self.assertTrue(time.time() - start < 1.0)
+
+        for i in range(16):
+            self.assertEqual(200, responses[i].status_code)
+            self.assertEqual("HTTP/2", responses[i].http_version)
+            self.assertEqual("resource %d\n" % i * 10000, responses[i].text)
+        self.assertEqual(1, self.server.connections)
+        self.assertTrue(self.server.max_streams > 1)
+        self.assertEqual(404, self.backend.get(self.server.base_url + "/nothing.xml").status_code)
+
+    def test02_processor(self):
+        os.makedirs(os.path.join(self.root, ".well-known"))
+        with open(os.path.join(self.root, ".well-known", "resourcesync"), "w") as file:
+            file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+                       'xmlns:rs="http://www.openarchives.org/rs/terms/">\n'
+                       '<rs:md capability="description"/>\n'
+                       '<url><loc>%s/capabilitylist.xml</loc><rs:md capability="capabilitylist"/></url>\n'
+                       '</urlset>\n' % self.server.base_url)
+        des.fetch.set_instance(self.backend)
+        processor = Sodesproc(self.server.base_url)
+        self.assertTrue(processor.read_source())
+        self.assertEqual(Status.document, processor.status)
+        self.assertEqual(1, len(processor.source_document.resources))
+
+    def test03_no_connection(self):
+        self.assertRaises(FetchError, self.backend.get, "http://localhost:%d/" % free_port())
+
+    def test04_get_to_file(self):
+        with tempfile.TemporaryFile() as file:
+            response = self.backend.get_to_file(self.server.base_url + "/r3.txt", file)
+            file.seek(0)
+            self.assertEqual(b"resource 3\n" * 10000, file.read())
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(len(b"resource 3\n" * 10000), response.length)
+
+        # the thread of the event loop does not write
+        threads = set()
+
+        class Recorder(object):
+            def write(self, chunk):
+                threads.add(threading.current_thread())
+
+        self.backend.get_to_file(self.server.base_url + "/r3.txt", Recorder())
+        self.assertTrue(len(threads) > 0)
+        self.assertFalse(self.backend.thread in threads)
+
+    def test05_corrupt_encoding(self):
+        self.server.content_encodings["/r3.txt"] = "gzip"
+        self.assertRaises(FetchError, self.backend.get, self.server.base_url + "/r3.txt")
+        with tempfile.TemporaryFile() as file:
+            self.assertRaises(FetchError, self.backend.get_to_file, self.server.base_url + "/r3.txt", file)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os, shutil, tempfile, unittest
+
+from des.compare import Entry
+from des.config import Config
+from des.journal import Journal, journal_filename
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+URI = "http://example.com/resourcelist.xml"
+MD5 = "1B2M2Y8AsgTpgAmY7PhCfg=="
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        self.directory = tempfile.mkdtemp(prefix="resydes_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test01_resume(self):
+        entries = [Entry("http://example.com/r%d" % i, 1451606400.25 + i, i, MD5 if i % 2 else None)
+                   for i in range(10)]
+        with Journal(URI, self.directory) as journal:
+            self.assertEqual(0, len(journal))
+            for entry in entries[:5]:
+                journal.record(entry)
+            self.assertFalse(journal.done(entries[0]))
+        self.assertTrue(os.path.isfile(journal_filename(URI, self.directory)))
+
+        with Journal(URI, self.directory) as journal:
+            self.assertEqual(5, len(journal))
+            for entry in entries[:5]:
+                self.assertTrue(journal.done(entry))
+            self.assertFalse(journal.done(entries[5]))
+            # the resource list says something else about the resource now
+            self.assertFalse(journal.done(entries[1]._replace(length=2)))
+            self.assertFalse(journal.done(entries[1]._replace(md5=None)))
+            # the last record of a uri counts
+            journal.record(entries[1]._replace(length=2))
+
+        with Journal(URI, self.directory) as journal:
+            self.assertEqual(5, len(journal))
+            self.assertTrue(journal.done(entries[1]._replace(length=2)))
+            self.assertFalse(journal.done(entries[1]))
+            journal.remove()
+        self.assertFalse(os.path.exists(journal_filename(URI, self.directory)))
+        self.assertEqual(0, len(Journal(URI, self.directory)))
+
+    def test02_torn_line(self):
+        entries = [Entry("http://example.com/r%d" % i, 1.0, 1, MD5) for i in range(3)]
+        with Journal(URI, self.directory) as journal:
+            journal.record(entries[0])
+        # a crash while writing the second line
+        with open(journal_filename(URI, self.directory), "a") as file:
+            file.write("http://example.com/r1\t1.0\t1\t1B2M")
+
+        with Journal(URI, self.directory) as journal:
+            self.assertEqual(1, len(journal))
+            self.assertFalse(journal.done(entries[1]))
+            journal.record(entries[2])
+
+        with Journal(URI, self.directory) as journal:
+            self.assertEqual(2, len(journal))
+            self.assertTrue(journal.done(entries[0]))
+            self.assertTrue(journal.done(entries[2]))
@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os, tempfile, unittest
+
+import des.metrics
+from des.metrics import Metrics, Histogram
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test01_counters(self):
+        metrics = Metrics()
+        metrics.inc(des.metrics.RESOURCES_WRITTEN, change="created")
+        metrics.inc(des.metrics.RESOURCES_WRITTEN, 2, change="created")
+        self.assertEqual(3, metrics.get(des.metrics.RESOURCES_WRITTEN, change="created"))
+        self.assertEqual(0, metrics.get(des.metrics.RESOURCES_WRITTEN, change="deleted"))
+
+        # the source of the current thread is a label
+        metrics.set_source("http://example.com/rs")
+        metrics.inc(des.metrics.RESOURCES_WRITTEN, change="created")
+        self.assertEqual(1, metrics.get(des.metrics.RESOURCES_WRITTEN, change="created"))
+        metrics.set_source(None)
+        self.assertEqual(3, metrics.get(des.metrics.RESOURCES_WRITTEN, change="created"))
+
+    def test02_histogram(self):
+        histogram = Histogram(buckets=(1.0, 2.0))
+        for value in (0.5, 1.0, 1.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual([(1.0, 2), (2.0, 3), (float("inf"), 4)], histogram.cumulative_counts())
+        self.assertEqual(6.0, histogram.sum)
+        self.assertEqual(4, histogram.count)
+
+    def test03_timer(self):
+        metrics = Metrics()
+        with metrics.timer(des.metrics.STAGE_FETCH, "http://example.com/rs/resourcelist.xml"):
+            pass
+        histogram = metrics.get_histogram(des.metrics.STAGE_SECONDS, stage=des.metrics.STAGE_FETCH,
+                                          host="example.com")
+        self.assertEqual(1, histogram.count)
+
+    def test04_to_text(self):
+        metrics = Metrics()
+        metrics.set_source("http://example.com/rs")
+        metrics.fetched("http://example.com/rs/resourcelist.xml", 200, 1024)
+        with metrics.timer(des.metrics.STAGE_PARSE, "http://example.com/rs/resourcelist.xml"):
+            pass
+
+        text = metrics.to_text()
+        self.assertTrue("# TYPE resydes_fetch_bytes_total counter" in text)
+        self.assertTrue('resydes_fetch_bytes_total{host="example.com",source="http://example.com/rs"} 1024' in text)
+        self.assertTrue('resydes_stage_seconds_bucket{host="example.com",source="http://example.com/rs",'
+                        'stage="parse",le="+Inf"} 1' in text)
+
+        filename = os.path.join(tempfile.mkdtemp(prefix="resydes_"), "metrics.prom")
+        metrics.to_file(filename)
+        with open(filename) as file:
+            self.assertEqual(text, file.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, unittest
+
+import requests
+
+import des.metrics
+import des.monitor
+from des.monitor import MonitorServer
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestMonitor(unittest.TestCase):
+
+    def setUp(self):
+        des.metrics.reset_instance()
+        des.monitor.reset_instance()
+
+    def test01_progress(self):
+        monitor = des.monitor.instance()
+        monitor.start_round(2)
+        monitor.start_source("http://example.com/rs1")
+        self.assertEqual(["http://example.com/rs1"], monitor.status()["current_sources"])
+        monitor.end_source("http://example.com/rs1", True)
+        monitor.start_source("http://example.com/rs2")
+        monitor.end_source("http://example.com/rs2", False)
+        monitor.end_round()
+
+        status = monitor.status()
+        self.assertEqual(1, status["round"])
+        self.assertEqual(2, status["sources_done"])
+        self.assertEqual(0, status["sources_queued"])
+        self.assertIsNotNone(status["sources"]["http://example.com/rs1"]["last_success"])
+        self.assertIsNone(status["sources"]["http://example.com/rs2"]["last_success"])
+        self.assertEqual(1, status["sources"]["http://example.com/rs2"]["failures"])
+
+        metrics = des.metrics.instance()
+        self.assertEqual(2, metrics.get_gauge(des.metrics.ROUND_SOURCES, source="", state="done"))
+        self.assertEqual(1, metrics.get(des.metrics.SOURCES_PROCESSED, source="http://example.com/rs2",
+                                        outcome="failure"))
+
+    def test02_server(self):
+        des.monitor.instance().start_round(1)
+        des.metrics.instance().fetched("http://example.com/rs/resourcelist.xml", 200, 10)
+        des.metrics.instance().fetched("http://example.com/rs/changelist.xml", 503, 10)
+        server = MonitorServer(port=0)
+        server.start()
+        try:
+            base = "http://localhost:%d" % server.port
+            response = requests.get(base + "/metrics")
+            self.assertEqual(200, response.status_code)
+            self.assertTrue('resydes_round_sources{source="",state="queued"} 1' in response.text)
+
+            status = requests.get(base + "/status").json()
+            self.assertEqual(1, status["sources_queued"])
+            self.assertEqual(0.5, status["fetch_error_rate"])
+
+            self.assertEqual(404, requests.get(base + "/foo").status_code)
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, threading, time, unittest
+
+import des.deadline
+import des.metrics
+import des.reporter
+from des.pipeline import Pipeline
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test01_stages(self):
+        out = []
+        pipeline = Pipeline("test", queue_size=5)
+        pipeline.add_stage("double", lambda items: (2 * item for item in items), stream=True)
+        pipeline.add_stage("odd", lambda item: [item, item + 1])
+        pipeline.add_stage("collect", lambda item: out.append(item))
+        counts = pipeline.run(range(100))
+
+        self.assertEqual({"double": 100, "odd": 100, "collect": 200}, counts)
+        self.assertEqual(list(range(200)), out)
+
+    def test02_workers(self):
+        threads = set()
+        out = []
+
+        def work(item):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            return [item]
+
+        pipeline = Pipeline("test", queue_size=2)
+        pipeline.add_stage("work", work, workers=4)
+        pipeline.add_stage("collect", lambda item: out.append(item))
+        start = time.time()
+        counts = pipeline.run(range(40))
+
+        self.assertEqual(40, counts["collect"])
+        self.assertEqual(list(range(40)), sorted(out))
+        self.assertEqual(4, len(threads))
+        # four workers sleep at the same time
+        self.assertLess(time.time() - start, 0.3)
+
+    def test03_error(self):
+        def fail(item):
+            if item == 10:
+                raise ValueError("item %d" % item)
+            return [item]
+
+        fed = []
+
+        def feed():
+            for item in range(100000):
+                fed.append(item)
+                yield item
+
+        pipeline = Pipeline("test", queue_size=2)
+        pipeline.add_stage("fail", fail)
+        pipeline.add_stage("collect", lambda item: None)
+        self.assertRaises(ValueError, pipeline.run, feed())
+        # the other stages stopped
+        self.assertLess(len(fed), 100)
+
+        def broken_feed():
+            yield 1
+            raise IOError("feed")
+
+        pipeline = Pipeline("test")
+        pipeline.add_stage("collect", lambda item: None)
+        self.assertRaises(IOError, pipeline.run, broken_feed())
+
+    def test04_backpressure(self):
+        fed = []
+        seen = []
+
+        def feed():
+            for item in range(50):
+                fed.append(item)
+                yield item
+
+        def slow(item):
+            # the first stages cannot run ahead more than the queues allow
+            seen.append(len(fed) - item)
+            time.sleep(0.005)
+
+        pipeline = Pipeline("test", queue_size=3)
+        pipeline.add_stage("pass", lambda item: [item])
+        pipeline.add_stage("slow", slow)
+        pipeline.run(feed())
+
+        self.assertEqual(50, len(seen))
+        # two queues of 3, the item in each stage and the one the feeder holds
+        self.assertLessEqual(max(seen), 3 + 3 + 3)
+
+    def test05_last_stage_starts_before_feed_ends(self):
+        fed = []
+        first = []
+
+        def feed():
+            for item in range(1000):
+                fed.append(item)
+                yield item
+
+        def write(item):
+            if len(first) == 0:
+                first.append(len(fed))
+
+        pipeline = Pipeline("test", queue_size=10)
+        pipeline.add_stage("parse", lambda items: iter(items), stream=True)
+        pipeline.add_stage("write", write)
+        pipeline.run(feed())
+
+        self.assertLess(first[0], 1000)
+
+    def test06_context(self):
+        found = []
+
+        def look(item):
+            found.append((des.metrics.instance().get_source(), des.reporter.instance().get_source(),
+                          des.deadline.current()))
+
+        des.metrics.instance().set_source("http://example.com/rs")
+        des.reporter.instance().set_source("http://example.com/rs")
+        try:
+            deadline = des.deadline.Deadline(60, "test")
+            with des.deadline.scope(deadline):
+                pipeline = Pipeline("test")
+                pipeline.add_stage("look", look, workers=2)
+                pipeline.run(range(4))
+        finally:
+            des.metrics.reset_instance()
+            des.reporter.reset_instance()
+
+        self.assertEqual(4, len(found))
+        for metrics_source, reporter_source, current in found:
+            self.assertEqual("http://example.com/rs", metrics_source)
+            self.assertEqual("http://example.com/rs", reporter_source)
+            self.assertIs(deadline, current)
+
+    def test07_partition(self):
+        seen = {}
+        lock = threading.Lock()
+
+        def work(item):
+            key, number = item
+            time.sleep(0.001 * (number % 3))
+            with lock:
+                seen.setdefault(key, []).append((number, threading.current_thread().name))
+
+        pipeline = Pipeline("test", queue_size=4)
+        pipeline.add_stage("work", work, workers=3, partition=lambda item: item[0])
+        counts = pipeline.run((key, number) for number in range(20) for key in range(5))
+
+        self.assertEqual(100, counts["work"])
+        for key, items in seen.items():
+            # items with the same key are handled by one worker, in order
+            self.assertEqual(list(range(20)), [number for number, thread in items])
+            self.assertEqual(1, len(set(thread for number, thread in items)))
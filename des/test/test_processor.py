@@ -2,15 +2,17 @@
 # -*- coding: utf-8 -*-
 
 
-import datetime, glob, logging, logging.config, os.path, pathlib, shutil, threading, unittest, des.processor
+import datetime, glob, gzip, logging, logging.config, os.path, pathlib, shutil, threading, time, unittest
+import des.processor, des.state, des.taskqueue, des.visited
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 
-from des.processor import Sodesproc, Redumpproc
+from des.processor import Sodesproc, Capaproc, Redumpproc
 from des.status import Status
 from des.config import Config
 from des.location_mapper import DestinationMap
 from des.processor_listener import SitemapWriter
 from resync.client import Client
+from resync.resource import Resource
 
 logging.config.fileConfig('logging.conf')
 logger = logging.getLogger(__name__)
@@ -259,4 +261,227 @@ class TestRedumpproc(unittest.TestCase):
 
         redumpproc.process_source()
 
+    def test_failed_dump(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        des.visited.reset_instance()
+        uri = "http://localhost:8000/rs/source/s11/resourcedump.xml"
+        os.makedirs("rs/source/s11", exist_ok=True)
+        try:
+            with open("rs/source/s11/resourcedump.xml", "w") as file:
+                file.write(RESOURCEDUMP)
+            des.state.instance().set_state(uri, None)
+
+            redumpproc = Redumpproc(uri)
+            des.taskqueue.TaskQueue(workers=2).run([des.processor.ProcessorTask(redumpproc)])
+        finally:
+            shutil.rmtree("rs/source/s11", ignore_errors=True)
+
+        # the dump is not there: the resource dump is not synced
+        self.assertEqual(Status.processed_with_exceptions, redumpproc.status)
+        self.assertTrue(redumpproc.has_exceptions())
+        self.assertIsNone(des.state.instance().get_state(uri))
+
+
+CAPABILITYLIST = """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:ln href="http://localhost:8000/rs/source/s12/.well-known/resourcesync" rel="up"/>
+<rs:md capability="capabilitylist"/>
+<url><loc>http://localhost:8000/rs/source/s12/resourcelist.xml</loc><rs:md capability="resourcelist"/></url>
+<url><loc>http://localhost:8000/rs/source/s12/changelist.xml</loc><rs:md capability="changelist"/></url>
+</urlset>"""
+
+
+class TestReadSource(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        des.reporter.reset_instance()
+        os.makedirs("rs/source/s12", exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree("rs/source/s12", ignore_errors=True)
+
+    def test01_read_gzipped(self):
+        with gzip.open("rs/source/s12/capabilitylist.xml.gz", "wt", encoding="utf-8") as file:
+            file.write(CAPABILITYLIST)
+        capaproc = Capaproc("http://localhost:8000/rs/source/s12/capabilitylist.xml.gz")
+        self.assertTrue(capaproc.read_source())
+        # the md of the urls does not take the place of the md of the document
+        self.assertEqual("capabilitylist", capaproc.source_document.capability)
+        self.assertEqual("http://localhost:8000/rs/source/s12/.well-known/resourcesync", capaproc.up_url)
+        self.assertFalse(capaproc.is_index)
+        self.assertEqual(["resourcelist", "changelist"],
+                         [resource.capability for resource in capaproc.source_document.resources])
+
+    def test02_read_not_a_sitemap(self):
+        with open("rs/source/s12/capabilitylist.xml", "w") as file:
+            file.write("<html><body/></html>")
+        capaproc = Capaproc("http://localhost:8000/rs/source/s12/capabilitylist.xml")
+        self.assertFalse(capaproc.read_source())
+        self.assertEqual(Status.read_error, capaproc.status)
+
+
+class TestFreshness(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        Config().__set_prop__(Config.key_audit_only, "False")
+        des.reporter.reset_instance()
+
+    def test01_skip_resource(self):
+        uri = "http://localhost:8000/rs/source/s9/resourcelist.xml"
+        des.state.instance().set_state(uri, None, kind=des.state.FRESHNESS)
+        capaproc = Capaproc("http://localhost:8000/rs/source/s9/capabilitylist.xml")
+
+        resource = Resource(uri=uri, md_at="2016-01-01T00:00:00Z")
+        self.assertFalse(capaproc.__skip_resource__(resource))
+
+        capaproc.__process_child__(resource, ProcessedProcessor())
+        self.assertTrue(capaproc.__skip_resource__(resource))
+        self.assertFalse(capaproc.__skip_resource__(Resource(uri=uri, md_at="2016-01-02T00:00:00Z")))
+        # md:completed takes precedence over md:at
+        self.assertFalse(capaproc.__skip_resource__(Resource(uri=uri, md_at="2016-01-01T00:00:00Z",
+                                                             md_completed="2016-01-03T00:00:00Z")))
+        # no freshness information: never skip
+        self.assertFalse(capaproc.__skip_resource__(Resource(uri=uri)))
+
+        processor = ProcessedProcessor()
+        capaproc.__process_child__(resource, processor)
+        self.assertFalse(processor.processed)
+        self.assertTrue(des.reporter.instance().sync_status[0].in_sync)
+
+    def test02_no_state_after_audit(self):
+        Config().__set_prop__(Config.key_audit_only, "True")
+        uri = "http://localhost:8000/rs/source/s9/resourcelist.xml"
+        des.state.instance().set_state(uri, None, kind=des.state.FRESHNESS)
+        capaproc = Capaproc("http://localhost:8000/rs/source/s9/capabilitylist.xml")
+
+        resource = Resource(uri=uri, md_at="2016-01-01T00:00:00Z")
+        capaproc.__process_child__(resource, ProcessedProcessor())
+        self.assertFalse(capaproc.__skip_resource__(resource))
+
+
+class TestVisited(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        des.reporter.reset_instance()
+        des.visited.reset_instance()
+        os.makedirs("rs/source/s10", exist_ok=True)
+        with open("rs/source/s10/capabilitylist.xml", "w") as file:
+            file.write(SELF_REFERRING_CAPABILITYLIST)
+
+    def tearDown(self):
+        shutil.rmtree("rs/source/s10", ignore_errors=True)
+
+    def test01_cycle(self):
+        uri = "http://localhost:8000/rs/source/s10/capabilitylist.xml"
+        capaproc = Capaproc(uri)
+        capaproc.process_once()
+        self.assertEqual(Status.processed_with_exceptions, capaproc.status)
+        self.assertEqual(1, len(capaproc.exceptions))
+        self.assertTrue(capaproc.exceptions[0].startswith("Cycle detected"))
+
+    def test02_duplicate(self):
+        uri = "http://localhost:8000/rs/source/s10/capabilitylist.xml"
+        Capaproc(uri).process_once()
+        des.reporter.reset_instance()
+
+        capaproc = Capaproc(uri)
+        capaproc.process_once()
+        self.assertEqual(Status.duplicate, capaproc.status)
+        self.assertEqual(0, len(capaproc.exceptions))
+        self.assertEqual(1, len(des.reporter.instance().sync_status))
+
+        des.visited.reset_instance()
+        capaproc = Capaproc(uri)
+        capaproc.process_once()
+        self.assertEqual(Status.processed_with_exceptions, capaproc.status)
+
+    def test03_concurrent_visit(self):
+        uri = "http://localhost:8000/rs/source/s10/capabilitylist.xml"
+        # another document that points to uri is processing it
+        des.visited.instance().enter(uri)
+
+        parent = Capaproc("http://localhost:8000/rs/source/s10/other.xml")
+        capaproc = Capaproc(uri)
+        capaproc.parent = parent
+        capaproc.process_once()
+        self.assertEqual(Status.duplicate, capaproc.status)
+        self.assertEqual(0, len(capaproc.exceptions))
+        self.assertIsNone(des.reporter.instance().sync_status[0].exception)
+
+    def test04_shared_child_on_task_queue(self):
+        base = "http://localhost:8000/rs/source/s10/"
+        for name, children in (("root", ["a", "b"]), ("a", ["shared"]), ("b", ["shared"]), ("shared", [])):
+            with open("rs/source/s10/%s.xml" % name, "w") as file:
+                file.write(capabilitylist([base + child + ".xml" for child in children]))
+        # the shared child is still in progress when the second parent gets to it
+        listener = SlowListener(base + "shared.xml")
+        des.processor.processor_listeners.append(listener)
+        try:
+            root = Capaproc(base + "root.xml")
+            des.taskqueue.TaskQueue(workers=2).run([des.processor.ProcessorTask(root)])
+        finally:
+            des.processor.processor_listeners.remove(listener)
+
+        self.assertEqual(Status.processed, root.status)
+        self.assertEqual([], root.exceptions)
+        statuses = des.reporter.instance().sync_status
+        self.assertEqual([base + "shared.xml"], [status.uri for status in statuses])
+        self.assertIsNone(statuses[0].exception)
+
+
+SELF_REFERRING_CAPABILITYLIST = """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md capability="capabilitylist"/>
+<url><loc>http://localhost:8000/rs/source/s10/capabilitylist.xml</loc><rs:md capability="capabilitylist"/></url>
+</urlset>"""
+
+
+RESOURCEDUMP = """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md capability="resourcedump" at="2016-01-01T00:00:00Z"/>
+<url><loc>http://localhost:8000/rs/source/s11/missing.zip</loc>
+<rs:md type="application/zip" at="2016-01-01T00:00:00Z"/></url>
+</urlset>"""
+
+
+def capabilitylist(uris):
+    return """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md capability="capabilitylist"/>
+%s
+</urlset>""" % "\n".join('<url><loc>%s</loc><rs:md capability="capabilitylist"/></url>' % uri for uri in uris)
+
+
+class SlowListener(object):
+
+    def __init__(self, uri):
+        self.uri = uri
+
+    def event_sitemap_received(self, uri, capability, text):
+        if uri == self.uri:
+            time.sleep(0.2)
+
+
+class ProcessedProcessor(object):
+
+    def __init__(self):
+        self.status = Status.init
+        self.exceptions = []
+        self.processed = False
+
+    def process_source(self):
+        self.processed = True
+        self.status = Status.processed
+
+    def process_once(self, on_processed=None):
+        self.process_source()
+        if on_processed is not None:
+            on_processed(self)
 
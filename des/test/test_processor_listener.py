@@ -0,0 +1,104 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import gzip, logging, logging.config, os, shutil, stat, tempfile, unittest
+
+from des.config import Config
+from des.location_mapper import DestinationMap
+from des.processor_listener import SitemapWriter
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+SITEMAP = """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md capability="resourcelist" at="%s"/>
+</urlset>"""
+
+
+class TestSitemapWriter(unittest.TestCase):
+
+    def setUp(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        DestinationMap.__set_map_filename__("test-files/desmap.txt")
+        DestinationMap().__drop__()
+        Config().__set_prop__(Config.key_use_netloc, "False")
+        self.destination = tempfile.mkdtemp(prefix="resydes_")
+        DestinationMap().__set_destination__("http://example.com/rs", self.destination)
+        self.local_path = os.path.join(self.destination, "sitemaps", "resourcelist.xml")
+
+    def tearDown(self):
+        shutil.rmtree(self.destination, ignore_errors=True)
+
+    def test01_write(self):
+        writer = SitemapWriter()
+        writer.event_sitemap_received("http://example.com/rs/resourcelist.xml", "resourcelist",
+                                      SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertTrue(os.path.isfile(self.local_path))
+        # no temporary files left behind
+        self.assertEqual(["resourcelist.xml"], os.listdir(os.path.dirname(self.local_path)))
+
+    def test02_skip_unchanged(self):
+        writer = SitemapWriter()
+        uri = "http://example.com/rs/resourcelist.xml"
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        inode = os.stat(self.local_path).st_ino
+
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertEqual(inode, os.stat(self.local_path).st_ino)
+
+        # a new writer compares against the copy on disk
+        writer = SitemapWriter()
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertEqual(inode, os.stat(self.local_path).st_ino)
+
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-02-02T00:00:00Z")
+        self.assertNotEqual(inode, os.stat(self.local_path).st_ino)
+        with open(self.local_path) as file:
+            self.assertTrue("2016-02-02T00:00:00Z" in file.read())
+
+    def test03_directory_removed(self):
+        writer = SitemapWriter()
+        uri = "http://example.com/rs/resourcelist.xml"
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        shutil.rmtree(os.path.dirname(self.local_path))
+
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertTrue(os.path.isfile(self.local_path))
+
+    def test04_compressed(self):
+        Config().__set_prop__(Config.key_compress_sitemaps, "True")
+        writer = SitemapWriter()
+        # a gzipped sitemap arrives decompressed
+        uri = "http://example.com/rs/resourcelist.xml.gz"
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertEqual(["resourcelist.xml.gz"], os.listdir(os.path.dirname(self.local_path)))
+        with gzip.open(self.local_path + ".gz", "rt") as file:
+            self.assertTrue("2016-01-01T00:00:00Z" in file.read())
+        inode = os.stat(self.local_path + ".gz").st_ino
+
+        writer = SitemapWriter()
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertEqual(inode, os.stat(self.local_path + ".gz").st_ino)
+
+        Config().__set_prop__(Config.key_compress_sitemaps, "False")
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        self.assertTrue(os.path.isfile(self.local_path))
+
+    def test05_mode(self):
+        writer = SitemapWriter()
+        uri = "http://example.com/rs/resourcelist.xml"
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-01-01T00:00:00Z")
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(0o666 & ~umask, stat.S_IMODE(os.stat(self.local_path).st_mode))
+
+        # a changed sitemap keeps the mode of the old copy
+        os.chmod(self.local_path, 0o640)
+        writer.event_sitemap_received(uri, "resourcelist", SITEMAP % "2016-02-02T00:00:00Z")
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(self.local_path).st_mode))
+
+
+if __name__ == "__main__":
+    unittest.main()
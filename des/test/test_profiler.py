@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os, pstats, shutil, tempfile, threading, time, tracemalloc, unittest
+
+from des.processor import Capaproc
+from des.profiler import RoundProfiler
+from des.taskqueue import Task, TaskQueue
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+def work_on_worker():
+    time.sleep(0.01)
+
+
+class SleepingTask(Task):
+
+    kind = "sleeping"
+
+    def run(self):
+        time.sleep(0.1)
+        if threading.current_thread() is not threading.main_thread():
+            work_on_worker()
+
+
+class TestRoundProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="resydes_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test01_profile(self):
+        profiler = RoundProfiler(directory=self.directory, top=5)
+        profiler.start()
+        processor = Capaproc("http://example.com/rs/capabilitylist.xml")
+        processor.has_exceptions()
+        base_name = profiler.stop()
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual(3, len(os.listdir(self.directory)))
+        pstats.Stats(base_name + ".prof")
+        tracemalloc.Snapshot.load(base_name + ".snapshot")
+        with open(base_name + ".txt") as file:
+            summary = file.read()
+        self.assertTrue("per processor class" in summary)
+        self.assertTrue("Processor\n" in summary)
+        self.assertTrue("has_exceptions" in summary)
+
+    def test02_worker_threads(self):
+        profiler = RoundProfiler(directory=self.directory, top=50)
+        profiler.start()
+        # the first task is run by the calling thread, the second one by a worker
+        TaskQueue(workers=2).run([SleepingTask(), SleepingTask()])
+        base_name = profiler.stop()
+
+        functions = [key[2] for key in pstats.Stats(base_name + ".prof").stats]
+        self.assertIn("work_on_worker", functions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, unittest
+
+from des.scheduler import Scheduler
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test01_due_order(self):
+        scheduler = Scheduler(10, 1000)
+        scheduler.set_sources(["a", "b"], now=0)
+        self.assertEqual(0, scheduler.wait_time(now=0))
+        self.assertEqual("a", scheduler.pop(now=0))
+        scheduler.reschedule("a", 0, now=0)
+        self.assertEqual("b", scheduler.pop(now=0))
+        scheduler.reschedule("b", 0, now=5)
+        self.assertIsNone(scheduler.pop(now=5))
+        self.assertEqual(5, scheduler.wait_time(now=5))
+        self.assertEqual("a", scheduler.pop(now=10))
+
+    def test02_adapt(self):
+        scheduler = Scheduler(10, 1000, initial_interval=100)
+        scheduler.set_sources(["busy", "static"], now=0)
+        for uri in ("busy", "static"):
+            scheduler.pop(now=0)
+            self.assertEqual(100, scheduler.reschedule(uri, 0, now=0).interval)
+
+        # 50 changes in 100 seconds: poll as often as allowed
+        self.assertEqual("busy", scheduler.pop(now=100))
+        self.assertEqual(10, scheduler.reschedule("busy", 50, now=100).interval)
+        # no changes: back off
+        self.assertEqual("static", scheduler.pop(now=100))
+        self.assertEqual(200, scheduler.reschedule("static", 0, now=100).interval)
+        self.assertEqual("busy", scheduler.pop(now=110))
+        for i in range(10):
+            schedule = scheduler.reschedule("static", 0, now=300 + i)
+        self.assertEqual(1000, schedule.interval)
+
+        # a static source that starts changing is polled more often
+        schedule = scheduler.reschedule("static", 5, now=1309)
+        self.assertEqual(400, schedule.interval)
+
+    def test03_set_sources(self):
+        scheduler = Scheduler(10, 1000)
+        scheduler.set_sources(["a", "b"], now=0)
+        scheduler.set_sources(["b", "c"], now=0)
+        self.assertEqual(2, len(scheduler))
+        self.assertEqual(["b", "c"], sorted([scheduler.pop(now=0), scheduler.pop(now=0)]))
+        self.assertIsNone(scheduler.pop(now=0))
+        self.assertIsNone(scheduler.reschedule("a", 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os, shutil, tempfile, unittest
+
+from des.config import Config
+from des.shard import HashRing, configure_shard, merge_reports, parse_shard, shard_filename
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="resydes_")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test01_parse_shard(self):
+        self.assertEqual((0, 4), parse_shard("0/4"))
+        self.assertEqual((3, 4), parse_shard("3/4"))
+        for value in ("4/4", "-1/4", "0/0", "1", "a/b"):
+            self.assertRaises(ValueError, parse_shard, value)
+
+    def test02_shard_filename(self):
+        self.assertEqual("logs/sync-status.shard-1-of-4.csv", shard_filename("logs/sync-status.csv", 1, 4))
+        self.assertEqual("state.shard-0-of-2", shard_filename("state", 0, 2))
+
+    def test03_hash_ring(self):
+        keys = ["http://example%d.com/.well-known/resourcesync" % i for i in range(2000)]
+        ring = HashRing(4)
+        shards = [ring.shard_of(key) for key in keys]
+        self.assertEqual(shards, [HashRing(4).shard_of(key) for key in keys])
+        for index in range(4):
+            # each shard gets a fair part of the keys
+            self.assertTrue(300 < shards.count(index) < 700, shards.count(index))
+
+        # adding a shard only moves keys to the new shard
+        bigger = HashRing(5)
+        moved = [key for key, shard in zip(keys, shards) if bigger.shard_of(key) != shard]
+        self.assertTrue(len(moved) < 700, len(moved))
+        self.assertTrue(all(bigger.shard_of(key) == 4 for key in moved))
+
+    def test04_merge_reports(self):
+        filename = os.path.join(self.directory, "sync-status.csv")
+        self.assertEqual(0, merge_reports(filename, 2))
+        self.assertFalse(os.path.exists(filename))
+
+        with open(shard_filename(filename, 0, 2), "w") as file:
+            file.write("date,uri\n2016-01-03,http://a.com\n2016-01-01,http://b.com\n")
+        with open(shard_filename(filename, 1, 2), "w") as file:
+            file.write("date,uri\n2016-01-02,http://c.com\n")
+        self.assertEqual(3, merge_reports(filename, 2))
+        with open(filename) as file:
+            self.assertEqual(["date,uri", "2016-01-01,http://b.com", "2016-01-02,http://c.com",
+                              "2016-01-03,http://a.com"], file.read().splitlines())
+
+    def test05_configure_shard(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        config = Config()
+        config.__set_prop__(Config.key_sync_status_report_file, "logs/sync-status.csv")
+        config.__set_prop__(Config.key_monitor_port, "9100")
+        config.__set_prop__(Config.key_journal_dir, "journal/")
+        configure_shard(2, 3)
+        self.assertEqual("logs/sync-status.shard-2-of-3.csv", config.prop(Config.key_sync_status_report_file))
+        self.assertTrue(".shard-2-of-3" in config.prop(Config.key_state_store_file))
+        self.assertTrue(".shard-2-of-3" in config.prop(Config.key_metrics_report_file))
+        self.assertEqual("journal.shard-2-of-3", config.prop(Config.key_journal_dir))
+        self.assertEqual(9102, config.int_prop(Config.key_monitor_port))
+        Config().__drop__()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, shutil, tempfile, unittest, zipfile, io
+
+import requests
+from resync.resource_list import ResourceList
+
+from des.processor import Capaproc
+from des.test.simulator import SourceSimulator, md5_of
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestSourceSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="resydes_sim_")
+        self.simulator = SourceSimulator(self.root)
+        self.simulator.start()
+
+    def tearDown(self):
+        self.simulator.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test01_resource_list(self):
+        self.simulator.generate(sources=1, resources=25, per_sitemap=10)
+        base = self.simulator.source_urls()[0]
+
+        rl = ResourceList()
+        rl.read(base + "/resourcelist.xml")
+        self.assertEqual(25, len(rl))
+
+        for resource in list(rl)[:3]:
+            response = requests.get(resource.uri)
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(resource.md5, md5_of(response.content))
+        self.assertTrue(self.simulator.requests > 3)
+        self.assertTrue(self.simulator.bytes_sent > 0)
+
+    def test02_dump(self):
+        self.simulator.generate(sources=1, resources=10, dumps=2)
+        base = self.simulator.source_urls()[0]
+
+        response = requests.get(base + "/rd_00001.zip")
+        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+            self.assertTrue("manifest.xml" in z.namelist())
+            self.assertEqual(6, len(z.namelist()))
+
+    def test03_errors(self):
+        self.simulator.error_rate = 1.0
+        self.simulator.generate(sources=1, resources=1)
+        response = requests.get(self.simulator.source_urls()[0] + "/capabilitylist.xml")
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(1, self.simulator.errors)
+
+    def test04_capability_index(self):
+        self.simulator.generate(sources=1, resources=25, per_sitemap=10, changes=5, capability_index=True)
+        base = self.simulator.source_urls()[0]
+
+        index = Capaproc(base + "/capabilitylist.xml")
+        self.assertTrue(index.read_source())
+        self.assertTrue(index.is_index)
+        self.assertEqual([base + "/capabilitylist_00000.xml", base + "/capabilitylist_00001.xml"],
+                         [resource.uri for resource in index.source_document.resources])
+
+        capabilitylist = Capaproc(base + "/capabilitylist_00001.xml")
+        self.assertTrue(capabilitylist.read_source())
+        self.assertFalse(capabilitylist.is_index)
+        self.assertEqual(["changelist"], [resource.capability for resource in capabilitylist.source_document.resources])
+
+        # the resource list is a sitemapindex
+        response = requests.get(base + "/resourcelist.xml")
+        self.assertTrue("<sitemapindex" in response.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
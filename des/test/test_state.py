@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, os.path, shutil, tempfile, unittest
+
+import des.state
+from des.compare import Entry
+from des.config import Config
+from des.state import StateStore
+from resync.client_state import ClientState
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="resydes_")
+        self.filename = os.path.join(self.tmpdir, "state.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test01_get_set(self):
+        store = StateStore(self.filename)
+        self.assertIsNone(store.get_state("http://example.com/changelist.xml"))
+
+        store.set_state("http://example.com/changelist.xml", 1451606400.0)
+        self.assertEqual(1451606400.0, store.get_state("http://example.com/changelist.xml"))
+        # kinds are kept apart
+        self.assertIsNone(store.get_state("http://example.com/changelist.xml", kind=des.state.FRESHNESS))
+
+        store.set_state("http://example.com/changelist.xml", None)
+        self.assertIsNone(store.get_state("http://example.com/changelist.xml"))
+        store.close()
+
+    def test02_commit(self):
+        store = StateStore(self.filename)
+        store.set_state("http://example.com/changelist.xml", 1451606400.0)
+        store.set_state("http://example.com/resourcelist.xml", 1451606401.0, kind=des.state.FRESHNESS)
+
+        # not yet committed
+        other = StateStore(self.filename)
+        self.assertIsNone(other.get_state("http://example.com/changelist.xml"))
+        other.close()
+
+        store.commit()
+        other = StateStore(self.filename)
+        self.assertEqual(1451606400.0, other.get_state("http://example.com/changelist.xml"))
+        self.assertEqual(1451606401.0,
+                         other.get_state("http://example.com/resourcelist.xml", kind=des.state.FRESHNESS))
+
+        store.set_state("http://example.com/changelist.xml", None)
+        store.close()
+        other.close()
+        other = StateStore(self.filename)
+        self.assertIsNone(other.get_state("http://example.com/changelist.xml"))
+        other.close()
+
+    def test03_legacy_state(self):
+        uri = "http://example.com/legacy/changelist.xml"
+        client_state = ClientState()
+        client_state.status_file = os.path.join(self.tmpdir, "client-status.cfg")
+        client_state.set_state(uri, 1451606400.0)
+
+        store = StateStore(self.filename, legacy_filename=client_state.status_file)
+        self.assertEqual(1451606400.0, store.get_state(uri))
+        self.assertIsNone(store.get_state(uri, kind=des.state.FRESHNESS))
+        store.close()
+
+        # the state file is copied once; state that is removed stays removed
+        client_state.set_state(uri, 1454284800.0)
+        store = StateStore(self.filename, legacy_filename=client_state.status_file)
+        self.assertEqual(1451606400.0, store.get_state(uri))
+        store.set_state(uri, None)
+        store.close()
+        store = StateStore(self.filename, legacy_filename=client_state.status_file)
+        self.assertIsNone(store.get_state(uri))
+        store.close()
+
+    def test04_instance(self):
+        Config.__set_config_filename__("test-files/config.txt")
+        Config().__drop__()
+        Config().__set_prop__(Config.key_state_store_file, self.filename)
+        des.state.reset_instance()
+
+        store = des.state.instance()
+        self.assertEqual(self.filename, store.filename)
+        self.assertIs(store, des.state.instance())
+        store.set_state("http://example.com/changelist.xml", 1451606400.0)
+
+        des.state.reset_instance()
+        self.assertEqual(1451606400.0, des.state.instance().get_state("http://example.com/changelist.xml"))
+        des.state.reset_instance()
+
+    def test05_retries(self):
+        source = "http://example.com/resourcelist.xml"
+        entries = [Entry("http://example.com/r%d" % i, 1451606400.0, i, "1B2M2Y8AsgTpgAmY7PhCfg==") for i in range(3)]
+        store = StateStore(self.filename)
+        self.assertEqual([], store.get_retries(source))
+        for entry in entries:
+            store.set_retry(source, entry, 1, 100.0)
+        store.set_retry(source, entries[0], 2, 200.0)
+        store.remove_retries(source, [entries[1].uri])
+        self.assertEqual({entries[0].uri: (2, 200.0), entries[2].uri: (1, 100.0)},
+                         dict((retry.entry.uri, (retry.attempts, retry.next_attempt))
+                              for retry in store.get_retries(source)))
+        store.close()
+
+        store = StateStore(self.filename)
+        retries = sorted(store.get_retries(source))
+        self.assertEqual([entries[0], entries[2]], [retry.entry for retry in retries])
+        self.assertEqual([], store.get_retries("http://example.com/other.xml"))
+        store.remove_retries(source)
+        store.close()
+        self.assertEqual([], StateStore(self.filename).get_retries(source))
+
+        self.assertEqual(des.state.fingerprint(b"<urlset/>"), des.state.fingerprint(b"<urlset/>"))
+        self.assertNotEqual(des.state.fingerprint(b"<urlset/>"), des.state.fingerprint(b"<urlset />"))
+
+    def test06_marked(self):
+        source = "http://example.com/changelist.xml"
+        store = StateStore(self.filename)
+        self.assertEqual(frozenset(), store.get_marked(source))
+        store.set_marked(source, ["http://example.com/r1", "http://example.com/r2"])
+        store.close()
+
+        store = StateStore(self.filename)
+        self.assertEqual({"http://example.com/r1", "http://example.com/r2"}, store.get_marked(source))
+        store.set_marked(source, ["http://example.com/r3"])
+        store.close()
+        self.assertEqual({"http://example.com/r3"}, StateStore(self.filename).get_marked(source))
+
+    def test07_other_process(self):
+        uri = "http://example.com/changelist.xml"
+        store = StateStore(self.filename)
+        other = StateStore(self.filename)
+        self.assertIsNone(store.get_state(uri))
+        self.assertEqual(frozenset(), store.get_marked(uri))
+
+        other.set_state(uri, 1451606400.0)
+        other.set_marked(uri, ["http://example.com/r1"])
+        other.commit()
+        # cached until the next commit
+        self.assertIsNone(store.get_state(uri))
+        store.set_state("http://example.com/resourcelist.xml", 1451606401.0)
+        store.commit()
+        self.assertEqual(1451606400.0, store.get_state(uri))
+        self.assertEqual({"http://example.com/r1"}, store.get_marked(uri))
+        self.assertEqual(1451606401.0, store.get_state("http://example.com/resourcelist.xml"))
+        store.close()
+        other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
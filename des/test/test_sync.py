@@ -1,10 +1,15 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os.path, logging, threading
+import os.path, logging, shutil, threading, time
 import unittest
 
+import des.columns
+import des.journal
 import des.reporter
+import des.state
+import resync.w3c_datetime as w3c
 from des.config import Config
+from resync.client import ClientFatalError
 from des.location_mapper import DestinationMap
 from des.status import Status
 from des.sync import Relisync, Chanlisync
@@ -170,6 +175,163 @@ class TestRelisync(unittest.TestCase):
 
         reporter.sync_status_to_file("logs/baseline-netloc.csv")
 
+    def test05_audit_modes(self):
+        uri = "http://localhost:8000/rs/source/s1/resourcelist.xml"
+        Config().__set_prop__(Config.key_use_netloc, "False")
+        Config().__set_prop__(Config.key_audit_only, "False")
+        DestinationMap().__set_destination__("http://localhost:8000/rs/source/s1", "rs/destination/d1")
+        __clear_destination__("d1")
+        __clear_sources_xml__("s1")
+        __create_resourcelist__("s1")
+        Relisync(uri).process_source()
+
+        Config().__set_prop__(Config.key_audit_only, "True")
+        des.reporter.reset_instance()
+        for mode in ("fast", "full"):
+            Config().__set_prop__(Config.key_audit_mode, mode)
+            Relisync(uri).process_source()
+        statuses = des.reporter.instance().sync_status
+        self.assertEqual([True, True], [status.in_sync for status in statuses])
+        self.assertEqual([0, 3], [status.verified for status in statuses])
+        self.assertEqual([0.0, 1.0], [status.coverage for status in statuses])
+
+        # each audit verifies the next part: after 3 audits every resource has been verified once
+        Config().__set_prop__(Config.key_audit_mode, "sampled")
+        Config().__set_prop__(Config.key_audit_sample_rounds, "3")
+        des.state.instance().set_state(uri, None, kind=des.state.AUDIT)
+        des.reporter.reset_instance()
+        for i in range(3):
+            relisync = Relisync(uri)
+            relisync.process_source()
+            self.assertEqual(Status.processed, relisync.status)
+        statuses = des.reporter.instance().sync_status
+        self.assertEqual(3, sum(status.verified for status in statuses))
+        self.assertEqual([1 / 3, 2 / 3, 1.0], [status.coverage for status in statuses])
+        self.assertEqual(3, des.state.instance().get_state(uri, kind=des.state.AUDIT))
+
+    def test06_resume_from_journal(self):
+        uri = "http://localhost:8000/rs/source/s1/resourcelist.xml"
+        Config().__set_prop__(Config.key_use_netloc, "False")
+        Config().__set_prop__(Config.key_audit_only, "False")
+        Config().__set_prop__(Config.key_audit_mode, "full")
+        DestinationMap().__set_destination__("http://localhost:8000/rs/source/s1", "rs/destination/d1")
+        __clear_destination__("d1")
+        __clear_sources_xml__("s1")
+        __create_resourcelist__("s1")
+        relisync = Relisync(uri)
+        relisync.process_source()
+        self.assertEqual(Status.processed, relisync.status)
+        # completed: no journal left
+        self.assertFalse(os.path.exists(des.journal.journal_filename(uri)))
+
+        # an interrupted synchronisation verified two resources
+        with des.journal.Journal(uri) as journal:
+            for entry in list(Relisync(uri).read_resource_list())[:2]:
+                journal.record(entry)
+
+        Config().__set_prop__(Config.key_audit_only, "True")
+        des.reporter.reset_instance()
+        for i in range(2):
+            relisync = Relisync(uri)
+            relisync.process_source()
+            self.assertEqual(Status.processed, relisync.status)
+        statuses = des.reporter.instance().sync_status
+        self.assertEqual([True, True], [status.in_sync for status in statuses])
+        self.assertEqual([1, 3], [status.verified for status in statuses])
+        self.assertFalse(os.path.exists(des.journal.journal_filename(uri)))
+
+    def test07_retry(self):
+        uri = "http://localhost:8000/rs/source/s1/resourcelist.xml"
+        Config().__set_prop__(Config.key_use_netloc, "False")
+        Config().__set_prop__(Config.key_audit_only, "False")
+        Config().__set_prop__(Config.key_retry_backoff, "3600")
+        DestinationMap().__set_destination__("http://localhost:8000/rs/source/s1", "rs/destination/d1")
+        __clear_destination__("d1")
+        __clear_sources_xml__("s1")
+        __create_resourcelist__("s1")
+        missing = "rs/source/s1/files/resource1.txt"
+        os.rename(missing, missing + ".away")
+        store = des.state.instance()
+        try:
+            des.reporter.reset_instance()
+            relisync = Relisync(uri)
+            relisync.process_source()
+            # the other resources are synchronized
+            self.assertEqual(Status.processed_with_exceptions, relisync.status)
+            self.assertEqual(2, des.reporter.instance().sync_status[1].created)
+            retries = store.get_retries(uri)
+            self.assertEqual(["http://localhost:8000/rs/source/s1/files/resource1.txt"],
+                             [retry.entry.uri for retry in retries])
+            self.assertEqual(1, retries[0].attempts)
+
+            # the resource list did not change and the retry is not due: nothing is done
+            des.reporter.reset_instance()
+            relisync = Relisync(uri)
+            relisync.process_source()
+            self.assertEqual(Status.processed_with_exceptions, relisync.status)
+            statuses = des.reporter.instance().sync_status
+            self.assertFalse(any(status.audit for status in statuses))
+            self.assertEqual(1, store.get_retries(uri)[0].attempts)
+
+            # due, still missing: the wait doubles
+            store.set_retry(uri, retries[0].entry, 1, 0.0)
+            Relisync(uri).process_source()
+            self.assertEqual(2, store.get_retries(uri)[0].attempts)
+            self.assertGreater(store.get_retries(uri)[0].next_attempt, time.time() + 7000)
+        finally:
+            os.rename(missing + ".away", missing)
+
+        # due and back at the source: only the one resource is fetched
+        store.set_retry(uri, retries[0].entry, 2, 0.0)
+        des.reporter.reset_instance()
+        relisync = Relisync(uri)
+        relisync.process_source()
+        self.assertEqual(Status.processed, relisync.status)
+        statuses = des.reporter.instance().sync_status
+        self.assertEqual(1, len(statuses))
+        self.assertFalse(statuses[0].audit)
+        self.assertTrue(statuses[0].in_sync)
+        self.assertEqual(1, statuses[0].created)
+        self.assertEqual([], store.get_retries(uri))
+        self.assertTrue(os.path.isfile("rs/destination/d1/resources/files/resource1.txt"))
+
+        # no more retries: a full synchronisation again
+        des.reporter.reset_instance()
+        Relisync(uri).process_source()
+        self.assertTrue(des.reporter.instance().sync_status[0].audit)
+
+    def test08_extra_local_file(self):
+        uri = "http://localhost:8000/rs/source/s1/resourcelist.xml"
+        Config().__set_prop__(Config.key_use_netloc, "False")
+        Config().__set_prop__(Config.key_audit_only, "False")
+        DestinationMap().__set_destination__("http://localhost:8000/rs/source/s1", "rs/destination/d1")
+        __clear_destination__("d1")
+        __clear_sources_xml__("s1")
+        __create_resourcelist__("s1")
+        Relisync(uri).process_source()
+        extra = "rs/destination/d1/resources/files/extra.txt"
+        with open(extra, "w") as file:
+            file.write("not in the resource list")
+
+        # all resources of the source are the same, yet the destination is not in sync
+        Config().__set_prop__(Config.key_audit_only, "True")
+        des.reporter.reset_instance()
+        Relisync(uri).process_source()
+        status = des.reporter.instance().sync_status[0]
+        self.assertEqual(3, status.same)
+        self.assertEqual(1, status.deleted)
+        self.assertFalse(status.in_sync)
+
+        Config().__set_prop__(Config.key_audit_only, "False")
+        des.reporter.reset_instance()
+        Relisync(uri).process_source()
+        statuses = des.reporter.instance().sync_status
+        self.assertEqual(2, len(statuses))
+        self.assertFalse(statuses[0].in_sync)
+        self.assertEqual(1, statuses[1].to_delete)
+        self.assertEqual(1, statuses[1].deleted)
+        self.assertFalse(os.path.exists(extra))
+
 
 class TestChanlisync(unittest.TestCase):
 
@@ -180,6 +342,9 @@ class TestChanlisync(unittest.TestCase):
         DestinationMap().__drop__()
         des.reporter.reset_instance()
 
+    def tearDown(self):
+        shutil.rmtree("rs/source/s8", ignore_errors=True)
+
     def test_01_no_change(self):
         Config().__set_prop__(Config.key_use_netloc, "False")
         Config().__set_prop__(Config.key_audit_only, "False")
@@ -305,4 +470,113 @@ class TestChanlisync(unittest.TestCase):
         self.assertEqual(0, reporter.sync_status[0].updated)
         self.assertEqual(0, reporter.sync_status[0].deleted)
         self.assertEqual(0, reporter.sync_status[0].to_delete)
-        self.assertIsNone(reporter.sync_status[0].exception)
\ No newline at end of file
+        self.assertIsNone(reporter.sync_status[0].exception)
+
+    def test_04_high_water_mark(self):
+        uri = "http://localhost:8000/rs/source/s8/changelist.xml"
+        os.makedirs("rs/source/s8", exist_ok=True)
+        with open("rs/source/s8/changelist.xml", "w") as file:
+            file.write(CHANGELIST)
+        des.state.instance().set_state(uri, None)
+
+        chanlisync = Chanlisync(uri)
+        change_list, skipped, latest, at_latest = chanlisync.read_change_list()
+        self.assertEqual(3, len(change_list))
+        self.assertEqual(0, skipped)
+        # md:until of the archived change list is beyond the last change
+        self.assertEqual(w3c.str_to_datetime("2016-01-31T00:00:00Z"), latest)
+        self.assertEqual(set(), at_latest)
+
+        # only the changes at the mark that were processed are skipped
+        mark = w3c.str_to_datetime("2016-01-02T00:00:00Z")
+        resource2 = "http://localhost:8000/rs/source/s8/files/resource2.txt"
+        change_list, skipped, latest, at_latest = chanlisync.read_change_list(mark, {resource2})
+        self.assertEqual(1, len(change_list))
+        self.assertEqual(2, skipped)
+        self.assertEqual("http://localhost:8000/rs/source/s8/files/resource3.txt", change_list.resources[0].uri)
+
+        change_list, skipped, latest, at_latest = chanlisync.read_change_list(mark)
+        self.assertEqual(2, len(change_list))
+        self.assertEqual(1, skipped)
+
+        change_list, skipped, latest, at_latest = chanlisync.read_change_list(
+            w3c.str_to_datetime("2016-01-31T00:00:00Z"))
+        self.assertEqual(0, len(change_list))
+        self.assertEqual(3, skipped)
+        self.assertIsNone(latest)
+
+    def test_05_parallel_changes(self):
+        class Client(object):
+            def __init__(self, failing=None):
+                self.mapper = self
+                self.failing = failing
+                self.calls = []
+                self.lock = threading.Lock()
+
+            def src_to_dst(self, uri):
+                return uri
+
+            def update_resource(self, resource, filename, change):
+                if resource.uri == self.failing:
+                    raise ClientFatalError("Failed to GET %s" % resource.uri)
+                with self.lock:
+                    self.calls.append((resource.uri, resource.timestamp, threading.current_thread().name))
+                return 1
+
+            def delete_resource(self, resource, filename, allow_deletion=False):
+                return self.update_resource(resource, filename, "deleted")
+
+        Config().__set_prop__(Config.key_change_workers, "4")
+        change_list = des.columns.ResourceColumns(capability_name="changelist")
+        for t in range(100):
+            change_list.append("http://example.com/r%d" % (t % 7), float(t), change="updated" if t % 3 else "deleted")
+        chanlisync = Chanlisync("http://example.com/changelist.xml")
+
+        client = Client()
+        self.assertEqual((0, 66, 34), chanlisync.__apply_changes__(client, change_list, True))
+        self.assertEqual(99.0, chanlisync.applied_until)
+        for uri in set(call[0] for call in client.calls):
+            calls = [call for call in client.calls if call[0] == uri]
+            # changes to a resource are applied in order of time, by one thread
+            self.assertEqual(sorted(call[1] for call in calls), [call[1] for call in calls])
+            self.assertEqual(1, len(set(call[2] for call in calls)))
+
+        # r3 fails at time 3: the mark may not move beyond what came before
+        client = Client("http://example.com/r3")
+        self.assertRaises(ClientFatalError, chanlisync.__apply_changes__, client, change_list, True)
+        self.assertLess(chanlisync.applied_until if chanlisync.applied_until is not None else -1.0, 3.0)
+        applied = set(call[1] for call in client.calls)
+        self.assertNotIn(3.0, applied)
+        for t in range(100):
+            if chanlisync.applied_until is not None and t <= chanlisync.applied_until:
+                self.assertIn(float(t), applied)
+
+    def test_06_changes_at_the_mark(self):
+        uri = "http://localhost:8000/rs/source/s8/changelist.xml"
+        os.makedirs("rs/source/s8", exist_ok=True)
+        with open("rs/source/s8/changelist.xml", "w") as file:
+            file.write(CHANGELIST.replace("2016-01-03T00:00:00Z", "2016-01-02T00:00:00Z")
+                       .replace(' until="2016-01-31T00:00:00Z"', ""))
+        mark = w3c.str_to_datetime("2016-01-02T00:00:00Z")
+        # resource3 was added at the mark after the change list was read
+        marked = {"http://localhost:8000/rs/source/s8/files/resource2.txt"}
+
+        chanlisync = Chanlisync(uri)
+        change_list, skipped, latest, at_latest = chanlisync.read_change_list(mark, marked)
+        self.assertEqual(["http://localhost:8000/rs/source/s8/files/resource3.txt"],
+                         [resource.uri for resource in change_list])
+        self.assertEqual(mark, latest)
+        self.assertEqual({"http://localhost:8000/rs/source/s8/files/resource2.txt",
+                          "http://localhost:8000/rs/source/s8/files/resource3.txt"}, at_latest)
+
+
+CHANGELIST = """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md capability="changelist" from="2016-01-01T00:00:00Z" until="2016-01-31T00:00:00Z"/>
+<url><loc>http://localhost:8000/rs/source/s8/files/resource1.txt</loc><lastmod>2016-01-01T00:00:00Z</lastmod>
+<rs:md change="created"/></url>
+<url><loc>http://localhost:8000/rs/source/s8/files/resource2.txt</loc><lastmod>2016-01-02T00:00:00Z</lastmod>
+<rs:md change="created"/></url>
+<url><loc>http://localhost:8000/rs/source/s8/files/resource3.txt</loc><lastmod>2016-01-03T00:00:00Z</lastmod>
+<rs:md change="updated"/></url>
+</urlset>"""
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, logging.config, threading, time, unittest
+
+import des.reporter
+from des.taskqueue import Task, TaskQueue, fork, current_task
+
+logging.config.fileConfig('logging.conf')
+logger = logging.getLogger(__name__)
+
+
+class TreeTask(Task):
+    """
+    Forks children tasks of depth - 1, records the order of runs and completions.
+    """
+
+    kind = "tree"
+
+    def __init__(self, log, name, children=0, depth=0, source=None, sleep=0.0):
+        super(TreeTask, self).__init__(source=source)
+        self.log = log
+        self.name = name
+        self.children = children
+        self.depth = depth
+        self.sleep = sleep
+        self.threads = set()
+
+    def run(self):
+        self.log.append(("run", self.name, threading.current_thread().name))
+        time.sleep(self.sleep)
+        if self.depth > 0:
+            for index in range(self.children):
+                fork(TreeTask(self.log, "%s.%d" % (self.name, index), self.children, self.depth - 1,
+                              sleep=self.sleep))
+
+    def complete(self):
+        self.log.append(("complete", self.name, threading.current_thread().name))
+
+
+class FailingTask(Task):
+
+    kind = "failing"
+
+    def run(self):
+        raise ValueError("failed on %s" % self.source)
+
+
+class TestTaskQueue(unittest.TestCase):
+
+    def setUp(self):
+        des.reporter.reset_instance()
+
+    def test01_fork_without_queue(self):
+        log = []
+        fork(TreeTask(log, "a", children=2, depth=2))
+        self.assertIsNone(current_task())
+        # depth first, each task completes after its children
+        self.assertEqual([("run", "a"), ("run", "a.0"), ("run", "a.0.0"), ("complete", "a.0.0"),
+                          ("run", "a.0.1"), ("complete", "a.0.1"), ("complete", "a.0"),
+                          ("run", "a.1"), ("run", "a.1.0"), ("complete", "a.1.0"),
+                          ("run", "a.1.1"), ("complete", "a.1.1"), ("complete", "a.1"),
+                          ("complete", "a")], [entry[:2] for entry in log])
+
+    def test02_work_stealing(self):
+        log = []
+        # one large source and three small ones
+        tasks = [TreeTask(log, "big", children=12, depth=1, source="big", sleep=0.02)] + \
+                [TreeTask(log, "small%d" % i, source="small%d" % i) for i in range(3)]
+        left = TaskQueue(workers=4).run(tasks)
+        self.assertEqual([], left)
+
+        names = [entry[1] for entry in log if entry[0] == "complete"]
+        self.assertEqual(16, len(names))
+        self.assertEqual(16, len(set(names)))
+        self.assertTrue(names.index("big") > max(names.index("big.%d" % i) for i in range(12)))
+        # children of the big source were run by more than one worker
+        threads = set(entry[2] for entry in log if entry[0] == "run" and entry[1].startswith("big."))
+        self.assertTrue(len(threads) > 1, threads)
+
+    def test03_stop(self):
+        log = []
+        tasks = [TreeTask(log, "t%d" % i, source="t%d" % i) for i in range(5)]
+        left = TaskQueue(workers=2).run(tasks, stop=lambda: len(log) >= 2)
+        self.assertTrue(0 < len(left) < 5)
+        completed = [entry[1] for entry in log if entry[0] == "complete"]
+        self.assertEqual(5, len(left) + len(completed))
+
+    def test04_failure_attributed_to_source(self):
+        tasks = [FailingTask(source="http://example.com/s%d" % i) for i in range(3)]
+        TaskQueue(workers=2).run(tasks)
+        reporter = des.reporter.instance()
+        for i in range(3):
+            statuses = reporter.statuses_of("http://example.com/s%d" % i)
+            self.assertEqual(1, len(statuses))
+            self.assertTrue(isinstance(statuses[0].exception, ValueError))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging, threading
+
+# What we know of a uri when a processor asks to visit it.
+NEW = 1             # not visited in this round.
+IN_PROGRESS = 2     # being processed: by a document that leads to it (a cycle) or by another one (a duplicate).
+DONE = 3            # processed before in this round.
+
+_instance = None
+_lock = threading.Lock()
+
+
+def instance():
+    """
+    Get the registry of uris visited during the current round.
+    :return: an instance of Visited
+    """
+    global _instance
+    with _lock:
+        if _instance is None:
+            _instance = Visited()
+
+    return _instance
+
+
+def reset_instance():
+    """
+    Reset the _instance variable: next round starts with an empty registry.
+    :return: None
+    """
+    global _instance
+    with _lock:
+        _instance = None
+
+
+class Visited(object):
+    """
+    Keeps track of the sitemap uris that are processed during one round, so that each sitemap is processed at most
+    once per round. Sibling sitemaps are processed at the same time, so a uri that is in progress is not necessarily
+    part of a cycle: the visitor tells by looking at the documents that lead to it.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.in_progress = set()
+        self.done = set()
+
+    def enter(self, uri):
+        """
+        Register the start of a visit to uri.
+        :param uri: the uri to visit
+        :return: NEW if the visit may proceed, IN_PROGRESS or DONE if it should not
+        """
+        with self.lock:
+            if uri in self.in_progress:
+                return IN_PROGRESS
+            if uri in self.done:
+                return DONE
+            self.in_progress.add(uri)
+            return NEW
+
+    def leave(self, uri):
+        """
+        Register the end of a visit to uri.
+        :param uri: the uri visited
+        :return: None
+        """
+        with self.lock:
+            self.in_progress.discard(uri)
+            self.done.add(uri)
+
+    def __len__(self):
+        return len(self.done) + len(self.in_progress)
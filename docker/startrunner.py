@@ -1,8 +1,10 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse
+import argparse, logging.config, sys
+from des.config import Config
 from des.desrunner import DesRunner
+from des.shard import Coordinator, merge_reports, parse_shard
 
 print("================= Resydes version 0.1 =================")
 
@@ -14,9 +16,26 @@ parser.add_argument("-c", "--config", help="the configuration filename", default
 parser.add_argument("-t", "--task", help="the task that should be run. " + str(task_choices), default="discover",
                         choices=task_choices, metavar="")
 parser.add_argument("-o", "--once", help="explore source urls once and exit", action="store_true")
+parser.add_argument("-p", "--profile", help="profile each round and write the results next to the sync status report",
+                        action="store_true")
+
+parser.add_argument("--shard", help="process only this shard of the source urls, given as index/count", metavar="")
+parser.add_argument("--shards", help="partition the source urls over this many worker processes", type=int,
+                        default=1, metavar="")
+parser.add_argument("--merge", help="merge the sync status reports of --shards shards and exit", action="store_true")
 
 args = parser.parse_args()
 
-runner = DesRunner(config_filename=args.config)
-runner.run(args.sources, args.task, args.once)
+if args.merge or args.shards > 1:
+    Config.__set_config_filename__(args.config)
+    report = Config().prop(Config.key_sync_status_report_file, "sync-status.csv")
+    if args.merge:
+        merge_reports(report, args.shards)
+    else:
+        logging.config.fileConfig(Config().prop(Config.key_logging_configuration_file, "conf/logging.conf"))
+        sys.exit(Coordinator(args.shards, config_filename=args.config)
+                 .run(args.sources, args.task, args.once, args.profile))
+else:
+    runner = DesRunner(config_filename=args.config, shard=parse_shard(args.shard) if args.shard else None)
+    runner.run(args.sources, args.task, args.once, args.profile)
 